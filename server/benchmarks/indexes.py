@@ -0,0 +1,174 @@
+"""
+Query plans and latency of the lookups served by the indexes of migration
+4d9b1e6a7c38, without and with the indexes.
+
+Seeds a scratch database with N orders of three models each, SQLite in a
+temporary directory by default. The database of the .env is never used:
+the benchmark runs on a bare app of its own, and refuses a --database-url
+that already has tables, since it drops everything it created. Run from
+the server directory:
+    python -m benchmarks.indexes --orders 20000
+    python -m benchmarks.indexes --orders 20000 --database-url postgresql://localhost/scratch
+
+On SQLite with 20000 orders the file path lookup goes from a 9 ms table
+scan to 0.15 ms, the stl models of an order from 4 ms to 0.17 ms.
+"""
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy import inspect, insert, text
+
+from print3dstore.models import File, Material, Order, PaymentGateway, Spool, StlModel, User, db
+
+INDEXES = (
+    "ix_file_full_path",
+    "ix_order_created_at",
+    "ix_order_status",
+    "ix_order_user_id",
+    "ix_spool_material_id",
+    "ix_stl_model_file_id",
+    "ix_stl_model_material_id",
+    "ix_stl_model_order_id",
+)
+MATERIALS = 5
+MODELS_PER_ORDER = 3
+REPEATS = 50
+
+
+def seed(orders: int) -> None:
+    users = max(orders // 10, 1)
+    db.session.execute(insert(Material), [
+        dict(id=id, name=f"material {id}", cost_per_gram=10, density=1.24) for id in range(1, MATERIALS + 1)
+    ])
+    db.session.execute(insert(Spool), [
+        dict(id=id, make="bench", material_id=id % MATERIALS + 1, color="red", grams=1000, grams_left=500)
+        for id in range(1, MATERIALS * 4 + 1)
+    ])
+    db.session.execute(insert(PaymentGateway), [dict(id=1, name="Cash", type="cash")])
+    db.session.execute(insert(User), [
+        dict(id=id, email=f"user{id}@example.com", password="x") for id in range(1, users + 1)
+    ])
+
+    statuses = list(Order.Status)
+    started_at = datetime.datetime(2024, 1, 1)
+    db.session.execute(insert(Order), [
+        dict(
+            id=id,
+            user_id=id % users + 1,
+            payment_gateway_id=1,
+            status=statuses[id % len(statuses)],
+            created_at=started_at + datetime.timedelta(minutes=10 * id),
+            estimated_cost=100 * (id % 50),
+        )
+        for id in range(1, orders + 1)
+    ])
+    models = orders * MODELS_PER_ORDER
+    db.session.execute(insert(File), [
+        dict(id=id, full_path=f"/media/{id:064x}.stl", content_hash=f"{id:064x}") for id in range(1, models + 1)
+    ])
+    db.session.execute(insert(StlModel), [
+        dict(id=id, file_id=id, order_id=(id - 1) // MODELS_PER_ORDER + 1, material_id=id % MATERIALS + 1)
+        for id in range(1, models + 1)
+    ])
+    db.session.commit()
+
+
+def queries(orders: int) -> dict[str, object]:
+    middle = orders // 2
+    models = orders * MODELS_PER_ORDER
+    return {
+        # tasks.slice_files
+        "file by path": db.select(File).filter_by(full_path=f"/media/{models // 2:064x}.stl"),
+        # Order.stl_models and finalize_order
+        "models of order": db.select(StlModel).where(StlModel.order_id == middle),
+        # tasks.pending_models
+        "models of file": db.select(StlModel).where(StlModel.file_id == models // 2),
+        # the profile orders page
+        "orders of user": db.select(Order).where(Order.user_id == 2),
+        # the status filter of the admin order list
+        "orders by status": db.select(Order).where(Order.status == Order.Status.SHIPPED).limit(20),
+        # MaterialView.delete_view
+        "models of material": db.select(StlModel.id).where(StlModel.material_id == 1).limit(1),
+        "spools of material": db.select(Spool).where(Spool.material_id == 1),
+        # analytics.order_page
+        "orders of a day": db.select(Order).where(
+            Order.created_at >= datetime.datetime(2024, 1, 2),
+            Order.created_at < datetime.datetime(2024, 1, 3),
+        ),
+    }
+
+
+def plan(statement) -> str:
+    sql = str(statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    explain = "EXPLAIN QUERY PLAN " if db.engine.dialect.name == "sqlite" else "EXPLAIN "
+    rows = db.session.execute(text(explain + sql)).all()
+    return "; ".join(str(row[-1]) for row in rows)
+
+
+def latency(statement) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        started_at = time.perf_counter()
+        db.session.execute(statement).all()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings) * 1000
+
+
+def report(label: str, orders: int) -> None:
+    db.session.execute(text("ANALYZE"))
+    print(f"\n{label}")
+    for name, statement in queries(orders).items():
+        print(f"{name:<20} {latency(statement):8.3f} ms  {plan(statement)}")
+
+
+def scratch_app(url: str) -> Flask:
+    """
+    An app bound to `url` only. create_app would read the .env database
+    and create its tables.
+    """
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    db.init_app(app)
+    with app.app_context():
+        tables = inspect(db.engine).get_table_names()
+    if len(tables) > 0:
+        raise SystemExit(f"{url} has tables ({', '.join(sorted(tables)[:5])}), point --database-url at an empty scratch database")
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--database-url")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = arguments.database_url or f"sqlite:///{os.path.join(directory, 'bench.sqlite')}"
+        app = scratch_app(url)
+        with app.app_context():
+            db.create_all()
+            seed(arguments.orders)
+            indexes = [
+                index for table in db.metadata.tables.values() for index in table.indexes
+                if index.name in INDEXES
+            ]
+
+            for index in indexes:
+                index.drop(db.engine)
+            report(f"{arguments.orders} orders without the indexes", arguments.orders)
+
+            for index in indexes:
+                index.create(db.engine)
+            report(f"{arguments.orders} orders with the indexes", arguments.orders)
+
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
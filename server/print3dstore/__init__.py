@@ -12,27 +12,51 @@ from flask_admin.contrib.sqla import ModelView
 from flask_admin.base import MenuLink
 
 from celery import Celery, Task
+from kombu import Queue
 
-from print3dstore.cli import load_fixtures_command
+from print3dstore import storage, thumbnails
+from print3dstore.cli import build_previews_command, clean_uploads_command, load_fixtures_command, rebuild_rollups_command
 from print3dstore.admin.admin_views import AccessControlView, AnalyticsView, DashboardView, MaterialView, OrderView, PaymentGatewayView, PrinterView, RoleView, SpoolView, StlModelView, UserView
+from print3dstore.slicing.scheduling import QUEUES as SLICE_QUEUES
 from .models import Material, Order, PaymentGateway, Printer, Role, Spool, StlModel, User, db
 
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
+    # uploads are hashed while they are streamed to media/uploads
+    app.request_class = storage.UploadRequest
+    app.teardown_appcontext(storage.close_temporary_files)
     app.config.from_mapping(dotenv_values(".env"))
+
+    # ensure the instance folder exists
+    try:
+        os.makedirs(app.instance_path)
+    except OSError:
+        pass
+
+    # before the extensions are initialized, they read the database and broker urls
+    if test_config is None:
+        # load the instance config, if it exists, when not testing
+        app.config.from_pyfile('config.py', silent=True)
+    else:
+        # load the test config if passed in
+        app.config.from_mapping(test_config)
+
     celery_init_app(app)
 
     db.init_app(app)
 
     migrate = Migrate(app, db, f"{app.root_path}/migrations")
 
-    from .blueprints import main, media, auth, profile, order, tasks
+    from .blueprints import main, media, auth, profile, order, tasks, uploads
     app.register_blueprint(main.bp)
     app.register_blueprint(media.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(profile.bp)
     app.register_blueprint(order.bp)
     app.register_blueprint(tasks.bp)
+    app.register_blueprint(uploads.bp)
+
+    app.jinja_env.globals["thumbnail"] = thumbnails.img
 
     app.config["FLASK_ADMIN_FLUID_LAYOUT"] = True
     app.config["FLASK_ADMIN_SWATCH"] = "morph"
@@ -52,23 +76,13 @@ def create_app(test_config=None):
 
     admin.init_app(app)
 
-    # ensure the instance folder exists
-    try:
-        os.makedirs(app.instance_path)
-    except OSError:
-        pass
-
-    if test_config is None:
-        # load the instance config, if it exists, when not testing
-        app.config.from_pyfile('config.py', silent=True)
-    else:
-        # load the test config if passed in
-        app.config.from_mapping(test_config)
-
     with app.app_context():
         db.create_all()
 
     app.cli.add_command(load_fixtures_command)
+    app.cli.add_command(clean_uploads_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(build_previews_command)
 
     return app
 
@@ -85,6 +99,8 @@ def celery_init_app(app: Flask) -> Celery:
             broker_url=app.config["CELERY_BROKER_URL"],
             result_backend=app.config["CELERY_RESULT_BACKEND"],
             task_ignore_result=app.config["CELERY_IGNORE_RESULT"],
+            # workers started without -Q consume the slice queues as well
+            task_queues=[Queue("celery"), *(Queue(name) for name in SLICE_QUEUES)],
         )
     )
     celery_app.set_default()
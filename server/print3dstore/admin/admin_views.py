@@ -1,16 +1,19 @@
 import datetime
-import json
 import math
-import os
 from flask import app, flash, g, make_response, redirect, render_template, request, session
 from werkzeug.security import generate_password_hash
 from flask_admin import BaseView, expose, AdminIndexView
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.form import SecureForm, rules
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.orm import joinedload, selectinload
 from wtforms.validators import DataRequired
 
-from print3dstore.models import Material, PaymentGateway, StlModel, User, UserRole, db, Order, Role, Spool
+from print3dstore import analytics, catalog, metrics, permissions, rollups, storage, thumbnails
+from print3dstore.models import Material, StlModel, User, UserRole, db, Order, Role, Spool, Upload
 from print3dstore.errors import RequestException
+from print3dstore.slicing import pricing
+from print3dstore.admin import fulltext, pagination
 from print3dstore.blueprints.forms.order import OrderEditForm
 from print3dstore.blueprints.forms.user import UserForm
 
@@ -29,9 +32,30 @@ class DashboardView(AdminIndexView):
 class AnalyticsView(BaseView):
     @expose("/")
     def index(self):
-        spools = db.session.scalars(db.select(Spool)).all()
-        orders = db.session.scalars(db.select(Order)).all()
-        return self.render('admin/analytics.html', spools=spools, orders=orders)
+        date_range = analytics.DateRange.from_args(request.args)
+        period = request.args.get("period")
+        if period not in analytics.PERIODS:
+            period = "day"
+        page = max(request.args.get("page", 1, type=int), 1)
+        orders, pages = analytics.order_page(date_range, page)
+        slice_cache_stats = metrics.get_many("slice_cache.")
+        slice_outcomes = metrics.get_many("slice.") | metrics.get_many("slicer.")
+        return self.render(
+            'admin/analytics.html',
+            date_range=date_range,
+            period=period,
+            page=page,
+            pages=pages,
+            orders=orders,
+            part_files=analytics.part_files([order.id for order in orders]),
+            revenue_by_status=analytics.revenue_by_status(date_range),
+            revenue_by_period=analytics.revenue_by_period(date_range, period),
+            revenue_by_material=analytics.revenue_by_material(date_range),
+            queue_depth=analytics.queue_depth(),
+            spools=analytics.spool_fill(),
+            slice_cache_stats=slice_cache_stats,
+            slice_outcomes=slice_outcomes,
+        )
     
     def is_accessible(self):
         if g.user is None:
@@ -41,12 +65,130 @@ class AnalyticsView(BaseView):
 class AccessControlView(ModelView):
     form_base_class = SecureForm
     can_set_page_size = True
+    # the rows are counted by get_list, see admin.pagination
+    simple_list_pager = True
+    list_template = "admin/model/keyset_list.html"
+    # the largest page size offered by the list template
+    max_page_size = 100
+    # table searched through admin.fulltext instead of ILIKE on column_searchable_list
+    search_table: str|None = None
 
     def is_accessible(self):
         if g.user is None:
             return False
         return g.user.has_permission(Role.all_permissions[self.name]["read"]) or g.user.has_permission(Role.all_permissions["Superuser"])
 
+    def _get_list_extra_args(self):
+        view_args = super()._get_list_extra_args()
+        # cursors belong to one page, sort and page size links start over
+        for name in pagination.CURSOR_ARGS:
+            view_args.extra_args.pop(name, None)
+        if view_args.page_size:
+            view_args.page_size = min(view_args.page_size, self.max_page_size)
+        return view_args
+
+    def seek_columns(self, sort_column) -> list|None:
+        """
+        Columns of the keyset for `sort_column`, None when the list has to
+        be paginated with OFFSET.
+        """
+        primary_key = getattr(self.model, self._primary_key)
+        if sort_column is None and self.search_table and request.args.get("search"):
+            # ordered by rank
+            return None
+        if sort_column is None:
+            return None if self.column_default_sort else [primary_key]
+        if sort_column not in self._sortable_columns or self._sortable_joins.get(sort_column):
+            return None
+
+        attribute = self._sortable_columns[sort_column]
+        if not pagination.seekable(attribute):
+            return None
+        return [primary_key] if attribute is primary_key else [attribute, primary_key]
+
+    def cursor(self, columns: list) -> tuple[str|None, tuple|None]:
+        for direction in pagination.CURSOR_ARGS:
+            if direction in request.args:
+                values = pagination.decode_cursor(request.args[direction], columns)
+                return (direction, values) if values is not None else (None, None)
+        return None, None
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        matches = fulltext.matches(self.search_table, search) if self.search_table else None
+        if matches is None:
+            return super()._apply_search(query, count_query, joins, count_joins, search)
+
+        primary_key = getattr(self.model, self._primary_key)
+        query = query.join(matches, matches.c.id == primary_key)
+        if count_query is not None:
+            count_query = count_query.join(matches, matches.c.id == primary_key)
+        # sorts the list when no column is chosen, see _apply_sorting
+        g.search_rank = matches.c.rank
+        return query, count_query, joins, count_joins
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        query, joins = super()._apply_sorting(query, joins, sort_column, sort_desc)
+        primary_key = getattr(self.model, self._primary_key)
+        rank = g.pop("search_rank", None)
+        if rank is not None and sort_column is None:
+            return query.order_by(rank.desc(), primary_key), joins
+
+        columns = self.seek_columns(sort_column)
+        if columns is None:
+            # ties in the sort column would otherwise move between pages
+            return query.order_by(primary_key), joins
+
+        direction, values = self.cursor(columns)
+        # before a cursor the rows are read backwards, get_list turns them around
+        backwards = bool(sort_desc) != (direction == "before")
+        if direction is not None:
+            keyset = tuple_(*columns)
+            query = query.filter(keyset < tuple_(*values) if backwards else keyset > tuple_(*values))
+        return query.order_by(None).order_by(*(column.desc() if backwards else column for column in columns)), joins
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        columns = self.seek_columns(sort_column)
+        page_size = page_size or self.page_size
+        if columns is not None:
+            # pages start at a cursor, one more row tells whether there is another page
+            count, query = super().get_list(
+                None, sort_column, sort_desc, search, filters, execute=False, page_size=page_size + 1
+            )
+        else:
+            count, query = super().get_list(
+                page, sort_column, sort_desc, search, filters, execute=False, page_size=page_size
+            )
+        if not search and not filters:
+            count = pagination.estimated_count(self.model.__tablename__, self.get_count_query())
+        if not execute:
+            return count, query
+
+        data = query.all()
+        if columns is None:
+            return count, data
+
+        direction, _ = self.cursor(columns)
+        more = len(data) > page_size
+        data = data[:page_size]
+        if direction == "before":
+            data.reverse()
+        has_previous = direction == "after" or (direction == "before" and more)
+        has_next = direction == "before" or more
+
+        view_args = self._get_list_extra_args()
+        def cursor_url(name, row):
+            values = tuple(getattr(row, column.key) for column in columns)
+            extra_args = dict(view_args.extra_args, **{name: pagination.encode_cursor(values)})
+            return self._get_list_url(view_args.clone(page=None, extra_args=extra_args))
+
+        self._template_args.update(
+            keyset_pager=True,
+            first_url=self._get_list_url(view_args.clone(page=None)),
+            previous_url=cursor_url("before", data[0]) if has_previous and data else None,
+            next_url=cursor_url("after", data[-1]) if has_next and data else None,
+        )
+        return count, data
+
 
 class UserView(AccessControlView):
     can_create = False
@@ -63,6 +205,7 @@ class UserView(AccessControlView):
         "phone",
     ]
     column_searchable_list = ["first_name", "last_name", "email"]
+    search_table = "user"
 
     column_formatters = dict(
         roles=lambda _v, _c, m, _p: ", ".join(list(map(lambda user_role: user_role.role.name ,m.roles)))
@@ -70,6 +213,9 @@ class UserView(AccessControlView):
 
     form = UserForm
 
+    def get_query(self):
+        return super().get_query().options(selectinload(User.roles).joinedload(UserRole.role))
+
     @expose("/edit", methods=["GET", "POST"])
     def edit_view(self):
         if request.method == "GET":
@@ -104,6 +250,7 @@ class UserView(AccessControlView):
         for role_id in user_form.roles.data:
             user_role = UserRole(user_id=user.id, role_id=int(role_id))
             db.session.add(user_role)
+        user.permissions_changed()
 
         user.first_name = user_form.first_name.data
         user.last_name = user_form.last_name.data
@@ -129,11 +276,36 @@ class UserView(AccessControlView):
     def on_model_delete(self, model):
         if g.user.id == model.id:
             session.clear()
+
+        # runs in the transaction of the delete: the orders and uploads go
+        # first, so the files they used can be released before the commit
+        orders = list(model.orders)
+        rollups.remove(rollups.contributions(orders))
+        files = [stl_model.file for order in orders for stl_model in order.stl_models]
+        uploads = db.session.scalars(db.select(Upload).where(Upload.user_id == model.id)).all()
+        files.extend(upload.file for upload in uploads if upload.file is not None)
+        for order in orders:
+            db.session.delete(order)
+        for upload in uploads:
+            db.session.delete(upload)
+        db.session.flush()
+        # or the cascade of the user would delete the orders again
+        db.session.expire(model, ["orders"])
+
+        g.deleted_uploads = [upload.id for upload in uploads]
+        g.unused_files = [path for path in map(storage.release, files) if path is not None]
         return super().on_model_delete(model)
 
+    def after_model_delete(self, model):
+        # the bytes go once the delete is committed, G-code stays in the slice cache
+        for upload_id in g.pop("deleted_uploads", []):
+            storage.ChunkedFile(upload_id).close()
+        storage.remove(g.pop("unused_files", []))
+        return super().after_model_delete(model)
+
 
 class OrderView(AccessControlView):
-    column_filters = ["user", "status"]
+    column_filters = ["user", "status", "estimated_cost", "estimated_time"]
     can_create = False
     form = OrderEditForm
     column_list = [
@@ -141,14 +313,18 @@ class OrderView(AccessControlView):
         "user",
         "stl_models",
         "estimated_cost",
-        "estimated_printing_time",
+        "estimated_time",
         "payment_gateway",
         "address",
         "status",
     ]
+    column_labels = dict(estimated_time="Estimated printing time")
+    # the totals are stored on the order, see Order.update_totals
     column_sortable_list = (
         ("user", ("user.email")),
         ("payment_gateway", ("payment_gateway.type")),
+        "estimated_cost",
+        "estimated_time",
         "status",
     )
     column_searchable_list = (
@@ -159,59 +335,43 @@ class OrderView(AccessControlView):
         "address_line2",
         "status"
     )
+    search_table = "order"
     column_formatters = dict(
         order_id=lambda  _v, _c, m, _p: f"#{m.id}",
         user=lambda _v, _c, m, _p: m.user.email,
         stl_models=lambda _v, _c, m, _p: list(
             map(
-                lambda model: model.file.full_path[
-                    model.file.full_path.rfind("/") + 1:
-                ],
+                lambda model: model.display_name,
                 m.stl_models
             )
         ),
-        estimated_cost=lambda _v, _c, m, _p: f"""BGN {math.fsum(list(
-            map(
-                lambda model: model.estimated_cost / 100.0 if model.estimated_cost else 0,
-                m.stl_models
-            )
-        ))} lv.""",
-        estimated_printing_time=lambda _v, _c, m, _p: math.fsum(map(
-            lambda model: math.ceil(model.estimated_time / 3600) if model.estimated_time else 0,
-            m.stl_models
-        )),
+        estimated_cost=lambda _v, _c, m, _p: f"BGN {m.estimated_cost / 100.0} lv." if m.estimated_cost else 0,
+        estimated_time=lambda _v, _c, m, _p: math.ceil(m.estimated_time / 3600) if m.estimated_time else 0,
         payment_gateway=lambda _v, _c, m, _p: m.payment_gateway.type,
         address=lambda _v, _c, m, _p: f"{m.city}, {m.address_line1}, {m.address_line2}"
     )
 
+    def get_query(self):
+        # everything the formatters touch, in a constant number of queries per page
+        return super().get_query().options(
+            joinedload(Order.user),
+            joinedload(Order.payment_gateway),
+            selectinload(Order.stl_models).joinedload(StlModel.file),
+        )
+
     def on_form_prefill(self, form, id):
         order = db.get_or_404(Order, id)
-        materials = db.session.scalars(db.select(Material)).all()
-        spools = db.session.scalars(db.select(Spool)).all()
-        payment_gateways = db.session.scalars(db.select(PaymentGateway)).all()
-        stl_models = db.session.scalars(db.select(StlModel)).all()
-        
-        form_material_choices = list()
-        for material in materials:
-            option = (material.id, material.name)
-            form_material_choices.append(option)
-
-        form.material.choices = form_material_choices
-        form.material.process_data(order.stl_models[0].material_id)
+        catalog_choices = catalog.current()
 
-        form_color_choices = list()
-        for spool in spools:
-            form_color_choices.append(spool.color)
+        form.material.choices = list(catalog_choices.materials)
+        form.material.process_data(order.stl_models[0].material_id)
 
-        form.color.choices = form_color_choices
+        form.color.choices = list(catalog_choices.colors)
         form.color.process_data(order.stl_models[0].color)
 
-        form_payment_gateway_choices = list()
-        for payment_gateway in payment_gateways:
-            option = (payment_gateway.id, f"{payment_gateway.name} - {payment_gateway.type}")
-            form_payment_gateway_choices.append(option)
-
-        form.payment_method.choices = form_payment_gateway_choices
+        form.payment_method.choices = [
+            (id, f"{name} - {type}") for id, name, type in catalog_choices.payment_gateways
+        ]
         form.payment_method.process_data(order.payment_gateway_id)
 
         form.city.data = order.city
@@ -221,6 +381,8 @@ class OrderView(AccessControlView):
         form.phone.data = order.phone
 
         form.status.choices = [
+            Order.Status.SLICING,
+            Order.Status.STALLED,
             Order.Status.FINISHED,
             Order.Status.IN_PROGRESS,
             Order.Status.QUEUED,
@@ -246,17 +408,27 @@ class OrderView(AccessControlView):
                 )
 
 
-            order.stl_models[0].material_id = request.form.get("material")
-            order.stl_models[0].color = request.form.get("color")
-
-            order.city = request.form.get("city")
-            order.postal_code = request.form.get("postal_code")
-            order.phone = request.form.get("phone")
-            order.address_line1 = request.form.get("address_line1")
-            order.address_line2 = request.form.get("address_line2")
-            
-            order.payment_gateway_id = request.form.get("payment_method")
-            order.status = request.form.get("status")
+            material = db.get_or_404(Material, int(request.form.get("material")))
+            with rollups.tracking([order]):
+                # the form has one material and color for the order, like the order form
+                for stl_model in order.stl_models:
+                    stl_model.material = material
+                    stl_model.color = request.form.get("color")
+                    if stl_model.slice_result is not None:
+                        # the toolpath does not depend on the material, reprice without slicing again
+                        stl_model.estimated_cost = pricing.price(stl_model.slice_result, material)
+                    elif stl_model.file.volume is not None:
+                        _, stl_model.rough_cost = pricing.rough_quote(stl_model.file.volume, material)
+                order.update_totals()
+
+                order.city = request.form.get("city")
+                order.postal_code = request.form.get("postal_code")
+                order.phone = request.form.get("phone")
+                order.address_line1 = request.form.get("address_line1")
+                order.address_line2 = request.form.get("address_line2")
+
+                order.payment_gateway_id = request.form.get("payment_method")
+                order.status = request.form.get("status")
 
             db.session.commit()
 
@@ -267,32 +439,47 @@ class OrderView(AccessControlView):
     def delete_view(self):
         order = db.get_or_404(Order, request.form["id"])
         files = [stl_model.file for stl_model in order.stl_models]
-        for file in files:
-            db.session.delete(file)
-        db.session.commit()
-        try:
-            for stl_model in order.stl_models:
-                os.remove(stl_model.file.full_path)
-                os.remove(stl_model.file.full_path.replace(".stl", ".gcode"))
-        except OSError as e:
-            pass
-        return super().delete_view()
+        removed = rollups.contributions([order])
+        response = super().delete_view()
+        if inspect(order).was_deleted:
+            rollups.remove(removed)
+            # the bytes go with the last model using them, G-code stays in the slice cache
+            unused = [path for path in map(storage.release, files) if path is not None]
+            db.session.commit()
+            storage.remove(unused)
+        return response
+
+
+class CatalogView(AccessControlView):
+    """
+    Views of the models behind the order form choices, see catalog.
+    """
+    def on_model_change(self, form, model, is_created):
+        catalog.changed()
+        return super().on_model_change(form, model, is_created)
+
+    def on_model_delete(self, model):
+        catalog.changed()
+        return super().on_model_delete(model)
 
 
-class MaterialView(AccessControlView):
+class MaterialView(CatalogView):
     column_list = [
         "name",
         "cost_per_gram",
+        "density",
     ]
     column_formatters = {
         "cost_per_gram": lambda _v, _c, m, _p: m.cost_per_gram / 100.0,
     }
     form_columns = [
         "name",
-        "cost_per_gram"
+        "cost_per_gram",
+        "density",
     ]
     form_args = {
-        "cost_per_gram": {"label": "Cost per gram (in cents)", "validators": [DataRequired()]}
+        "cost_per_gram": {"label": "Cost per gram (in cents)", "validators": [DataRequired()]},
+        "density": {"label": "Density (g/cm3)"},
     }
     @expose("/delete", methods=["POST"])
     def delete_view(self):
@@ -306,7 +493,7 @@ class MaterialView(AccessControlView):
         return super().delete_view()
 
 
-class SpoolView(AccessControlView):
+class SpoolView(CatalogView):
     column_list = [
         "make",
         "material",
@@ -319,7 +506,7 @@ class SpoolView(AccessControlView):
     )
 
 
-class PaymentGatewayView(AccessControlView):
+class PaymentGatewayView(CatalogView):
     pass
 
 
@@ -332,28 +519,46 @@ class StlModelView(AccessControlView):
     can_edit = True
 
     column_formatters = dict(
-        file=lambda _v, _c, m, _p: m.file.full_path[
-                    m.file.full_path.rfind("/") + 1:
-                ],
+        file=lambda _v, _c, m, _p: thumbnails.img(m.file, 32) + " " + m.display_name,
         material=lambda _v, _c, m, _p: m.material.name,
         estimated_cost=lambda _v, _c, m, _p: f"BGN {m.estimated_cost / 100.0} lv." if m.estimated_cost else 0,
         estimated_time=lambda _v, _c, m, _p: str(datetime.timedelta(seconds=m.estimated_time)) if m.estimated_time else 0
     )
 
+    def get_query(self):
+        return super().get_query().options(joinedload(StlModel.file), joinedload(StlModel.material))
+
+    @expose("/delete", methods=["POST"])
+    def delete_view(self):
+        stl_model = db.get_or_404(StlModel, request.form["id"])
+        file = stl_model.file
+        order = stl_model.order
+        before = rollups.contributions([order])
+        response = super().delete_view()
+        if inspect(stl_model).was_deleted:
+            rollups.apply(before, rollups.contributions([order]))
+            unused = storage.release(file)
+            db.session.commit()
+            storage.remove([unused] if unused is not None else [])
+        return response
+
 class RoleView(AccessControlView):
     column_list = [
         "name",
         "permissions",
     ]
     column_formatters = dict(
-        permissions=lambda _v, _c, m, _p: ", ".join(
-            str(perm) for perm in json.loads(m.permissions)
-        )
+        permissions=lambda _v, _c, m, _p: ", ".join(permissions.names_of(m.permission_mask))
     )
     form_columns = [
         "name",
         "permissions"
     ]
+
+    def on_model_change(self, form, model, is_created):
+        model.permissions_changed()
+        return super().on_model_change(form, model, is_created)
+
     @expose("/delete", methods=["POST"])
     def delete_view(self):
         role = db.get_or_404(Role, request.form["id"])
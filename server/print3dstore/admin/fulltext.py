@@ -0,0 +1,179 @@
+"""
+Indexed, ranked search for the admin order and user lists.
+
+On PostgreSQL "order" and "user" have a search_vector tsvector column with
+a GIN index, and user emails a trigram index for partial matches. On
+SQLite the same columns are indexed by the FTS5 tables order_search and
+user_search. Both are kept up to date by triggers, created by migration
+b7e2c9d41f05. SQLite databases made by create_all get the FTS5 tables from
+the after_create hooks below. PostgreSQL databases made without the
+migrations have no index, and the views fall back to the ILIKE search of
+Flask-Admin there.
+
+Every word of a search has to match, like the ILIKE search: an order
+matches a word through its own columns, its user's or its number, so
+"mar pl" finds the orders of Maria in Plovdiv.
+"""
+import functools
+import re
+
+from sqlalchemy import Float, Integer, event, inspect, text
+
+from print3dstore.models import Order, User, db
+
+# every word of the search matches as a prefix
+WORD = re.compile(r"\w+")
+
+# the columns of the FTS5 tables, as in migration b7e2c9d41f05
+SQLITE_COLUMNS = {
+    "order": ("city", "postal_code", "address_line1", "address_line2", "status"),
+    "user": ("first_name", "last_name", "email"),
+}
+
+# (id, rank) of the orders matching word {i}
+POSTGRESQL_ORDER_WORD = """
+    SELECT "order".id, ts_rank("order".search_vector, to_tsquery('simple', :tsquery_{i})) AS rank
+    FROM "order" WHERE "order".search_vector @@ to_tsquery('simple', :tsquery_{i})
+    UNION ALL
+    SELECT "order".id,
+        ts_rank("user".search_vector, to_tsquery('simple', :tsquery_{i}))
+        + CASE WHEN "user".email ILIKE :pattern_{i} THEN 1 ELSE 0 END
+    FROM "user" JOIN "order" ON "order".user_id = "user".id
+    WHERE "user".search_vector @@ to_tsquery('simple', :tsquery_{i}) OR "user".email ILIKE :pattern_{i}
+    UNION ALL
+    SELECT "order".id, 10 FROM "order" WHERE "order".id = :number_{i}
+"""
+
+# bm25 is lower for better matches
+SQLITE_ORDER_WORD = """
+    SELECT order_search.rowid AS id, -bm25(order_search) AS rank
+    FROM order_search WHERE order_search MATCH :match_{i}
+    UNION ALL
+    SELECT "order".id, -bm25(user_search)
+    FROM user_search JOIN "order" ON "order".user_id = user_search.rowid
+    WHERE user_search MATCH :match_{i}
+    UNION ALL
+    SELECT "order".id, 10 FROM "order" WHERE "order".id = :number_{i}
+"""
+
+# every word against the one table, (id, rank)
+USER_MATCHES = {
+    "postgresql": """
+        SELECT "user".id,
+            ts_rank("user".search_vector, query) + CASE WHEN "user".email ILIKE :pattern THEN 1 ELSE 0 END AS rank
+        FROM "user", to_tsquery('simple', :tsquery) AS query
+        WHERE "user".search_vector @@ query OR "user".email ILIKE :pattern
+    """,
+    "sqlite": """
+        SELECT user_search.rowid AS id, -bm25(user_search) AS rank
+        FROM user_search WHERE user_search MATCH :match
+    """,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def installed(url: str, table: str) -> bool:
+    """
+    Whether the migrations created the search index of `table`, cached by
+    database url.
+    """
+    if db.engine.dialect.name == "postgresql":
+        return any(column["name"] == "search_vector" for column in inspect(db.engine).get_columns(table))
+    return inspect(db.engine).has_table(f"{table}_search")
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def order_matches(words: list[str], dialect: str):
+    """
+    Orders matching every word of `words`, ranked by the sum of the best
+    rank of each word.
+    """
+    template = POSTGRESQL_ORDER_WORD if dialect == "postgresql" else SQLITE_ORDER_WORD
+    selects = [
+        f"(SELECT id, MAX(rank) AS rank FROM ({template.format(i=i)}) AS word_matches GROUP BY id) AS word_{i}"
+        for i in range(len(words))
+    ]
+    joins = "".join(f" JOIN {select} ON word_{i}.id = word_0.id" for i, select in enumerate(selects) if i > 0)
+    ranks = " + ".join(f"word_{i}.rank" for i in range(len(words)))
+    statement = text(f"SELECT word_0.id, {ranks} AS rank FROM {selects[0]}{joins}")
+
+    for i, word in enumerate(words):
+        number = int(word) if word.isdigit() else None
+        if dialect == "postgresql":
+            statement = statement.bindparams(
+                **{f"tsquery_{i}": f"{word}:*", f"pattern_{i}": f"%{escape_like(word)}%", f"number_{i}": number}
+            )
+        else:
+            statement = statement.bindparams(**{f"match_{i}": f'"{word}"*', f"number_{i}": number})
+    return statement
+
+
+def user_matches(words: list[str], term: str, dialect: str):
+    statement = text(USER_MATCHES[dialect])
+    if dialect == "postgresql":
+        return statement.bindparams(
+            tsquery=" & ".join(f"{word}:*" for word in words),
+            pattern=f"%{escape_like(term.strip())}%",
+        )
+    return statement.bindparams(match=" ".join(f'"{word}"*' for word in words))
+
+
+def matches(table: str, term: str):
+    """
+    Subquery of the ids and ranks of the `table` rows matching `term`, None
+    when the table has no search index or the term no words.
+    """
+    words = WORD.findall(term)
+    if table not in SQLITE_COLUMNS or len(words) == 0:
+        return None
+    if not installed(str(db.engine.url), table):
+        return None
+
+    dialect = "postgresql" if db.engine.dialect.name == "postgresql" else "sqlite"
+    if table == "order":
+        statement = order_matches(words, dialect)
+    else:
+        statement = user_matches(words, term, dialect)
+    return statement.columns(id=Integer, rank=Float).subquery("search_matches")
+
+
+def create_sqlite_index(table, connection, **kw) -> None:
+    """
+    The FTS5 table and triggers of migration b7e2c9d41f05, for SQLite
+    databases made by create_all.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    name = table.name
+    columns = ", ".join(SQLITE_COLUMNS[name])
+    new_values = ", ".join(f"new.{column}" for column in SQLITE_COLUMNS[name])
+    old_values = ", ".join(f"old.{column}" for column in SQLITE_COLUMNS[name])
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE {name}_search USING fts5({columns}, content='{name}', content_rowid='id')"
+    ))
+    connection.execute(text(
+        f'CREATE TRIGGER {name}_search_insert AFTER INSERT ON "{name}" BEGIN '
+        f"INSERT INTO {name}_search (rowid, {columns}) VALUES (new.id, {new_values}); END"
+    ))
+    connection.execute(text(
+        f'CREATE TRIGGER {name}_search_delete AFTER DELETE ON "{name}" BEGIN '
+        f"INSERT INTO {name}_search ({name}_search, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+    ))
+    connection.execute(text(
+        f'CREATE TRIGGER {name}_search_update AFTER UPDATE ON "{name}" BEGIN '
+        f"INSERT INTO {name}_search ({name}_search, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {name}_search (rowid, {columns}) VALUES (new.id, {new_values}); END"
+    ))
+
+
+def drop_sqlite_index(table, connection, **kw) -> None:
+    if connection.dialect.name == "sqlite":
+        connection.execute(text(f"DROP TABLE IF EXISTS {table.name}_search"))
+
+
+for model in (Order, User):
+    event.listen(model.__table__, "after_create", create_sqlite_index)
+    event.listen(model.__table__, "before_drop", drop_sqlite_index)
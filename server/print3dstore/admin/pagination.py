@@ -0,0 +1,78 @@
+"""
+Keyset pagination for the admin model views.
+
+A page is fetched with WHERE (sort column, id) > (values of the last row
+shown) instead of an OFFSET, so a deep page costs the same as the first
+one. The values travel in the `after` and `before` URL arguments as an
+opaque cursor. Only non-nullable columns of the model itself can be sought
+on, other sorts fall back to OFFSET pages.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from sqlalchemy import text
+from sqlalchemy.orm import InstrumentedAttribute
+
+from print3dstore.models import db
+
+CURSOR_ARGS = ("after", "before")
+
+
+def seekable(attribute) -> bool:
+    if not isinstance(attribute, InstrumentedAttribute):
+        return False
+    columns = getattr(attribute.property, "columns", None)
+    return columns is not None and len(columns) == 1 and not columns[0].nullable
+
+
+def encode_cursor(values: tuple) -> str:
+    def default(value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        raise TypeError(f"{type(value).__name__} cannot be part of a cursor")
+
+    return base64.urlsafe_b64encode(json.dumps(values, default=default).encode()).decode()
+
+
+def decode_cursor(cursor: str, attributes: list) -> tuple|None:
+    """
+    The values of `cursor` for `attributes`, None when it is not a cursor
+    of these columns.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(attributes):
+        return None
+
+    decoded = []
+    for attribute, value in zip(attributes, values):
+        python_type = attribute.property.columns[0].type.python_type
+        try:
+            if python_type in (datetime.date, datetime.datetime) and isinstance(value, str):
+                value = python_type.fromisoformat(value)
+            elif python_type in (int, float, str) and not isinstance(value, python_type):
+                value = python_type(value)
+        except (TypeError, ValueError):
+            return None
+        decoded.append(value)
+    return tuple(decoded)
+
+
+def estimated_count(table_name: str, count_query) -> int:
+    """
+    Rows of the table from the planner statistics on PostgreSQL, which are
+    refreshed by autovacuum. Counted on other databases and before the
+    table is first analyzed.
+    """
+    if db.engine.dialect.name == "postgresql":
+        estimate = db.session.scalar(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+            {"table": f'"{table_name}"'},
+        )
+        if estimate is not None and estimate >= 0:
+            return estimate
+    return count_query.scalar()
@@ -0,0 +1,188 @@
+"""
+Aggregates for the admin analytics dashboard.
+
+The revenue and queue figures are read from the rollups (see
+print3dstore.rollups), a few rows per day of the range however many
+orders there are. The order list is paginated.
+"""
+import dataclasses
+import datetime
+
+from sqlalchemy import case, func
+
+from print3dstore.models import File, Material, MaterialRollup, Order, OrderRollup, Spool, StlModel, User, db
+
+DEFAULT_DAYS = 30
+PAGE_SIZE = 25
+PERIODS = ("day", "month")
+
+# orders that still have printing ahead of them
+OPEN_STATUSES = (Order.Status.SLICING, Order.Status.STALLED, Order.Status.QUEUED, Order.Status.IN_PROGRESS)
+SLICING_STATUSES = (Order.Status.SLICING, Order.Status.STALLED)
+PRINTING_STATUSES = (Order.Status.QUEUED, Order.Status.IN_PROGRESS)
+
+
+@dataclasses.dataclass
+class DateRange:
+    start: datetime.date
+    # inclusive
+    end: datetime.date
+
+    @classmethod
+    def from_args(cls, args: dict) -> "DateRange":
+        """
+        The range of the `from` and `to` (YYYY-MM-DD) arguments, the last
+        DEFAULT_DAYS days by default.
+        """
+        end = parse_date(args.get("to")) or datetime.date.today()
+        start = parse_date(args.get("from")) or end - datetime.timedelta(days=DEFAULT_DAYS - 1)
+        if start > end:
+            start, end = end, start
+        return cls(start, end)
+
+    def condition(self):
+        return db.and_(
+            Order.created_at >= datetime.datetime.combine(self.start, datetime.time()),
+            Order.created_at < datetime.datetime.combine(self.end + datetime.timedelta(days=1), datetime.time()),
+        )
+
+    def covers(self, day):
+        return day.between(self.start, self.end)
+
+
+def parse_date(value: str|None) -> datetime.date|None:
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def period_of(column, period: str):
+    """
+    The day (YYYY-MM-DD) or month (YYYY-MM) of a date column, as text.
+    """
+    if db.engine.dialect.name == "postgresql":
+        return func.to_char(column, "YYYY-MM-DD" if period == "day" else "YYYY-MM")
+    return func.strftime("%Y-%m-%d" if period == "day" else "%Y-%m", column)
+
+
+def revenue_by_status(date_range: DateRange) -> list:
+    return db.session.execute(
+        db.select(
+            OrderRollup.status,
+            func.sum(OrderRollup.orders).label("orders"),
+            func.sum(OrderRollup.estimated_cost).label("revenue"),
+        )
+        .where(date_range.covers(OrderRollup.day))
+        .group_by(OrderRollup.status)
+        .having(func.sum(OrderRollup.orders) > 0)
+        .order_by(OrderRollup.status)
+    ).all()
+
+
+def revenue_by_period(date_range: DateRange, period: str) -> list:
+    bucket = period_of(OrderRollup.day, period).label("period")
+    return db.session.execute(
+        db.select(
+            bucket,
+            func.sum(OrderRollup.orders).label("orders"),
+            func.sum(OrderRollup.estimated_cost).label("revenue"),
+        )
+        .where(date_range.covers(OrderRollup.day))
+        .where(OrderRollup.status != Order.Status.CANCELLED)
+        .group_by(bucket)
+        .having(func.sum(OrderRollup.orders) > 0)
+        .order_by(bucket)
+    ).all()
+
+
+def revenue_by_material(date_range: DateRange) -> list:
+    return db.session.execute(
+        db.select(
+            Material.name,
+            func.sum(MaterialRollup.models).label("models"),
+            func.sum(MaterialRollup.estimated_cost).label("revenue"),
+            func.sum(MaterialRollup.estimated_time).label("printing_time"),
+            func.sum(MaterialRollup.filament_grams).label("filament_grams"),
+        )
+        .join(MaterialRollup, MaterialRollup.material_id == Material.id)
+        .where(date_range.covers(MaterialRollup.day))
+        .where(MaterialRollup.status != Order.Status.CANCELLED)
+        .group_by(Material.id, Material.name)
+        .having(func.sum(MaterialRollup.models) > 0)
+        .order_by(Material.name)
+    ).all()
+
+
+def spool_fill() -> list:
+    ratio = case((Spool.grams > 0, Spool.grams_left * 1.0 / Spool.grams), else_=0.0).label("ratio")
+    return db.session.execute(
+        db.select(Spool.make, Spool.color, Spool.grams, Spool.grams_left, ratio)
+        .order_by(ratio)
+    ).all()
+
+
+def queue_depth() -> dict[str, int]:
+    orders = dict(db.session.execute(
+        db.select(OrderRollup.status, func.sum(OrderRollup.orders))
+        .where(OrderRollup.status.in_(OPEN_STATUSES))
+        .group_by(OrderRollup.status)
+    ).all())
+    queued_time = db.session.scalar(
+        db.select(func.coalesce(func.sum(OrderRollup.estimated_time), 0))
+        .where(OrderRollup.status.in_(PRINTING_STATUSES))
+    )
+    models_to_slice, filament_grams = db.session.execute(
+        db.select(
+            func.coalesce(func.sum(case((MaterialRollup.status.in_(SLICING_STATUSES), MaterialRollup.unsliced), else_=0)), 0),
+            func.coalesce(func.sum(case((MaterialRollup.status.in_(PRINTING_STATUSES), MaterialRollup.filament_grams), else_=0)), 0),
+        )
+        .where(MaterialRollup.status.in_(OPEN_STATUSES))
+    ).one()
+    return {
+        **{status: orders.get(status, 0) for status in OPEN_STATUSES},
+        "printing_hours": round(queued_time / 3600, 1),
+        "filament_grams": round(filament_grams),
+        "models_to_slice": models_to_slice,
+    }
+
+
+def order_page(date_range: DateRange, page: int) -> tuple[list, int]:
+    """
+    One page of the orders in the range, newest first, and the page count.
+    """
+    total = db.session.scalar(
+        db.select(func.count(Order.id)).where(date_range.condition())
+    )
+    parts = (
+        db.select(func.count(StlModel.id))
+        .where(StlModel.order_id == Order.id)
+        .correlate(Order)
+        .scalar_subquery()
+        .label("parts")
+    )
+    rows = db.session.execute(
+        db.select(Order.id, Order.created_at, Order.status, Order.estimated_cost, User.email, parts)
+        .join(User, Order.user_id == User.id)
+        .where(date_range.condition())
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .limit(PAGE_SIZE)
+        .offset((page - 1) * PAGE_SIZE)
+    ).all()
+    return rows, max(1, -(-total // PAGE_SIZE))
+
+
+def part_files(order_ids: list[int]) -> dict[int, list[File]]:
+    """
+    Files of the parts of the orders, for their thumbnails.
+    """
+    files = {}
+    rows = db.session.execute(
+        db.select(StlModel.order_id, File)
+        .join(File, StlModel.file_id == File.id)
+        .where(StlModel.order_id.in_(order_ids))
+        .order_by(StlModel.id)
+    )
+    for order_id, file in rows:
+        files.setdefault(order_id, []).append(file)
+    return files
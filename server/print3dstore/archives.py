@@ -0,0 +1,202 @@
+"""
+Extraction of ZIP and 3MF archives into one STL per part.
+
+Entries are decompressed chunk by chunk straight into upload files, and the
+mesh XML of a 3MF is parsed incrementally, so an archive is never unpacked
+in memory. The entry count, the total extracted size and the compression
+ratio are checked against the central directory before anything is read,
+and the extracted bytes are counted again while streaming, so a zip bomb
+is stopped before it fills the disk.
+"""
+import os
+import zipfile
+from array import array
+from xml.etree import ElementTree
+
+import numpy as np
+from flask import current_app
+
+from print3dstore import storage
+from print3dstore.slicing import stl
+
+ARCHIVE_EXTENSIONS = (".zip", ".3mf")
+
+MAX_ENTRIES = 100
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# uncompressed size to compressed size, STL and 3MF meshes compress about 5:1
+MAX_RATIO = 100
+
+THREE_MF_NAMESPACE = "{http://schemas.microsoft.com/3dmanufacturing/core/2015/02}"
+THREE_MF_MODEL = "3D/3dmodel.model"
+# millimeters per 3MF unit
+THREE_MF_UNITS = {
+    "micron": 0.001,
+    "millimeter": 1.0,
+    "centimeter": 10.0,
+    "inch": 25.4,
+    "foot": 304.8,
+    "meter": 1000.0,
+}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def max_bytes() -> int:
+    return int(current_app.config.get("ARCHIVE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+class Budget:
+    """
+    Bytes and parts an archive may still extract.
+    """
+    def __init__(self) -> None:
+        self.bytes = max_bytes()
+        self.entries = MAX_ENTRIES
+
+    def take_entry(self) -> None:
+        self.entries -= 1
+        if self.entries < 0:
+            raise ArchiveError(f"Archives may contain at most {MAX_ENTRIES} models.")
+
+    def take_bytes(self, amount: int) -> None:
+        self.bytes -= amount
+        if self.bytes < 0:
+            raise ArchiveError(f"Archives may extract to at most {max_bytes() // (1024 * 1024)} MB.")
+
+
+def check_entry(info: zipfile.ZipInfo) -> None:
+    if info.flag_bits & 0x1:
+        raise ArchiveError("Encrypted archives cannot be read.")
+    if info.compress_size > 0 and info.file_size / info.compress_size > MAX_RATIO:
+        raise ArchiveError(f"{info.filename} is compressed suspiciously well.")
+
+
+def extract(path: str, archive_name: str) -> list[tuple[str, storage.HashingFile]]:
+    """
+    One (name, upload file) per model of the archive at `path`. The upload
+    files are removed at the end of the request unless they are stored.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            infos = archive.infolist()
+            if len(infos) > MAX_ENTRIES * 2:
+                raise ArchiveError(f"Archives may contain at most {MAX_ENTRIES} models.")
+
+            names = {info.filename for info in infos}
+            if archive_name.lower().endswith(".3mf") or THREE_MF_MODEL in names:
+                parts = three_mf_parts(archive, archive_name)
+            else:
+                parts = stl_parts(archive, archive_name)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, ElementTree.ParseError, EOFError, ValueError, TypeError) as error:
+        raise ArchiveError(f"The archive could not be read: {error}")
+
+    if len(parts) == 0:
+        raise ArchiveError("The archive contains no STL or 3MF models.")
+    return parts
+
+
+def stl_parts(archive: zipfile.ZipFile, archive_name: str) -> list[tuple[str, storage.HashingFile]]:
+    infos = [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and info.filename.lower().endswith(".stl")
+        and not os.path.basename(info.filename).startswith(".")
+        and not info.filename.startswith("__MACOSX/")
+    ]
+
+    budget = Budget()
+    for info in infos:
+        # the central directory may lie, it is checked again while extracting
+        budget.take_entry()
+        budget.take_bytes(info.file_size)
+        check_entry(info)
+
+    budget = Budget()
+    parts = []
+    for info in infos:
+        budget.take_entry()
+        part = storage.temporary_file()
+        with archive.open(info) as entry:
+            for chunk in iter(lambda: entry.read(storage.CHUNK_SIZE), b""):
+                budget.take_bytes(len(chunk))
+                part.write(chunk)
+        part.flush()
+        parts.append((f"{archive_name}/{os.path.basename(info.filename)}", part))
+
+    return parts
+
+
+def three_mf_parts(archive: zipfile.ZipFile, archive_name: str) -> list[tuple[str, storage.HashingFile]]:
+    """
+    Every mesh object of the 3MF model becomes a binary STL. Build item and
+    component transforms are not applied, each part is sliced on its own.
+    """
+    try:
+        info = archive.getinfo(THREE_MF_MODEL)
+    except KeyError:
+        raise ArchiveError(f"The 3MF file has no {THREE_MF_MODEL}.")
+    check_entry(info)
+    if info.file_size > max_bytes():
+        raise ArchiveError(f"Archives may extract to at most {max_bytes() // (1024 * 1024)} MB.")
+
+    budget = Budget()
+    parts = []
+    scale = 1.0
+    vertices = array("f")
+    triangles = array("l")
+    container = None
+    with archive.open(info) as model:
+        for event, element in ElementTree.iterparse(model, events=("start", "end")):
+            tag = element.tag.removeprefix(THREE_MF_NAMESPACE)
+            if event == "start":
+                if tag == "model":
+                    scale = THREE_MF_UNITS.get(element.get("unit", "millimeter"), 1.0)
+                elif tag == "object":
+                    vertices = array("f")
+                    triangles = array("l")
+                elif tag in ("vertices", "triangles"):
+                    container = element
+                continue
+
+            if tag == "vertex":
+                vertices.extend((float(element.get("x")), float(element.get("y")), float(element.get("z"))))
+            elif tag == "triangle":
+                triangles.extend((int(element.get("v1")), int(element.get("v2")), int(element.get("v3"))))
+                # each triangle is written as a 50 byte STL record
+                budget.take_bytes(stl.TRIANGLE_DTYPE.itemsize)
+            elif tag == "object" and len(triangles) > 0:
+                budget.take_entry()
+                name = element.get("name") or f"object-{element.get('id')}"
+                parts.append((f"{archive_name}/{name}.stl", write_stl(vertices, triangles, scale)))
+
+            if tag in ("vertex", "triangle") and container is not None:
+                # drop parsed elements, the tree would otherwise hold the whole model
+                container.clear()
+            elif tag == "object":
+                element.clear()
+
+    return parts
+
+
+def write_stl(vertices: array, triangles: array, scale: float) -> storage.HashingFile:
+    points = np.frombuffer(vertices, dtype=np.float32).reshape(-1, 3) * scale
+    indices = np.frombuffer(triangles, dtype=np.int64 if triangles.itemsize == 8 else np.int32).reshape(-1, 3)
+    if indices.size > 0 and (indices.min() < 0 or indices.max() >= len(points)):
+        raise ArchiveError("The 3MF file references vertices it does not define.")
+
+    part = storage.temporary_file()
+    part.write(b"print3dstore 3mf part".ljust(80, b" "))
+    part.write(len(indices).to_bytes(4, "little"))
+    for start in range(0, len(indices), stl.CHUNK_TRIANGLES):
+        batch = indices[start:start + stl.CHUNK_TRIANGLES]
+        records = np.zeros(len(batch), dtype=stl.TRIANGLE_DTYPE)
+        records["vertices"] = points[batch]
+        part.write(records.tobytes())
+    part.flush()
+    return part
@@ -94,14 +94,11 @@ def load_logged_in_user():
     user_id = session.get("user_id")
     if user_id is None:
         g.user = None
-        g.roles = None
     else:
+        # the roles are not loaded, permission checks go through print3dstore.permissions
         g.user = db.session.get(User, user_id)
         if g.user is None:
             session.clear()
-            g.roles = None
-        else:
-            g.roles = g.user.roles
 
 
 def login_required(view):
@@ -8,9 +8,10 @@ class OrderForm(CsrfBaseForm):
     order_heading = HiddenField(label="Order details")
     stl_models = FileField(
         label="Models",
-        validators=[validators.input_required()],
+        # large models are uploaded in chunks beforehand, see blueprints/uploads.py
+        validators=[validators.optional()],
         widget=FileInput(False),
-        render_kw={"accept": ".stl", "class": "form-control"}
+        render_kw={"accept": ".stl,.zip,.3mf", "class": "form-control"}
     )
     material = SelectField(
         label="Material",
@@ -1,5 +1,98 @@
+"""
+Delivery of the files under media/.
+
+Content addressed models, media/<sha256>.stl, their previews,
+media/<sha256>.v<format version>.mesh, and thumbnails,
+media/thumbnails/<sha256>-<size>.v<renderer version>.png, never change.
+They get their name as a strong ETag and are cached by browsers as
+immutable for a year, so the STL viewer downloads a model once. Other files are revalidated.
+Uploads in progress under media/uploads are not served.
+
+MEDIA_BACKEND picks what sends the bytes:
+    flask     werkzeug streams the file and answers Range requests (default)
+    nginx     X-Accel-Redirect to MEDIA_ACCEL_PREFIX, an internal location
+    sendfile  X-Sendfile with the absolute path, for Apache mod_xsendfile
+With a proxy backend the worker only checks the path and the conditional
+headers, the proxy answers Range requests and streams the file, e.g.
+    location /protected-media/ {
+        internal;
+        alias /srv/print3dstore/server/print3dstore/media/;
+    }
+"""
+import mimetypes
 import os
-from flask import Blueprint
+import re
+import urllib.parse
+
+from flask import Blueprint, Response, abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+from print3dstore import storage
+
+bp = Blueprint("media", __name__, url_prefix="/media")
+
+BACKENDS = ("flask", "nginx", "sendfile")
+DEFAULT_ACCEL_PREFIX = "/protected-media/"
+
+CONTENT_ADDRESSED = re.compile(r"^(?P<name>[0-9a-f]{64}(\.v\d+)?|thumbnails/[0-9a-f]{64}-\d+\.v\d+)\.(stl|mesh|png)$")
+PRIVATE_DIRS = ("uploads",)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def backend() -> str:
+    name = current_app.config.get("MEDIA_BACKEND", "flask")
+    if name not in BACKENDS:
+        raise ValueError(f"MEDIA_BACKEND must be one of {', '.join(BACKENDS)}, not {name}")
+    return name
+
+
+@bp.get("/<path:filename>")
+def file(filename: str):
+    path = safe_join(storage.media_dir(), filename)
+    if path is None or filename.split("/")[0] in PRIVATE_DIRS or not os.path.isfile(path):
+        # error.html links to the current endpoint, which needs the filename
+        abort(404)
+
+    content_addressed = CONTENT_ADDRESSED.match(filename)
+    if backend() == "flask":
+        response = send_file(
+            path,
+            conditional=True,
+            etag=content_addressed["name"] if content_addressed else True,
+            max_age=IMMUTABLE_MAX_AGE if content_addressed else None,
+        )
+    else:
+        response = offload(path, filename, content_addressed["name"] if content_addressed else None)
+
+    if content_addressed:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
 
-bp = Blueprint("media", __name__, static_url_path="/media", static_folder="../media")
+def offload(path: str, filename: str, etag: str|None) -> Response:
+    """
+    An empty response telling the proxy to send `path`, or a 304 when the
+    client has the file already.
+    """
+    stat = os.stat(path)
+    response = Response(mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream")
+    response.last_modified = stat.st_mtime
+    if etag is not None:
+        response.set_etag(etag)
+    else:
+        response.set_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}", weak=True)
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
 
+    if backend() == "nginx":
+        prefix = current_app.config.get("MEDIA_ACCEL_PREFIX", DEFAULT_ACCEL_PREFIX)
+        response.headers["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{urllib.parse.quote(filename)}"
+    else:
+        response.headers["X-Sendfile"] = path
+    response.accept_ranges = "bytes"
+    return response
@@ -1,11 +1,11 @@
-from flask import Blueprint, current_app, flash, g, make_response, redirect, render_template, request, url_for
-
-import uuid
+from flask import Blueprint, flash, g, make_response, redirect, render_template, request, url_for
 
+from print3dstore import archives, catalog, events, rollups, storage
 from print3dstore.wrapper_functions import error_handler
 from print3dstore.errors import RequestException
 from print3dstore.blueprints.auth import login_required
-from print3dstore.models import PaymentGateway, Spool, User, db, File, Material, Order, StlModel
+from print3dstore.models import PaymentGateway, Role, Upload, User, db, Material, Order, StlModel
+from print3dstore.slicing import pricing, stl
 
 from .forms.order import OrderForm
 
@@ -17,28 +17,11 @@ bp = Blueprint("order", __name__)
 @error_handler
 @login_required
 def order():
-    materials = db.session.scalars(db.select(Material)).all()
-    spools = db.session.scalars(db.select(Spool)).all()
-    payment_gateways = db.session.scalars(db.select(PaymentGateway)).all()
+    catalog_choices = catalog.current()
     form = OrderForm()
-    form.material.choices = list(
-        map(
-            lambda material: material.name,
-            materials
-        )
-    )
-    form.color.choices = list(
-        map(
-            lambda spool: spool.color,
-            spools
-        )
-    )
-    form.payment_method.choices = list(
-        map(
-            lambda payment_gateway: payment_gateway.name,
-            payment_gateways
-        )
-    )
+    form.material.choices = [name for _, name in catalog_choices.materials]
+    form.color.choices = list(catalog_choices.colors)
+    form.payment_method.choices = [name for _, name, _ in catalog_choices.payment_gateways]
     if g.user is not None:
         form.city.data = g.user.city
         form.postal_code.data = g.user.postal_code
@@ -52,7 +35,9 @@ def order():
         if not form.validate():
             return render_template("order.html", form=form)
 
-        stl_files = request.files.getlist("stl_models")
+        # the file input is sent empty when the models were uploaded through /uploads
+        stl_files = [stl_file for stl_file in request.files.getlist("stl_models") if stl_file.filename]
+        upload_ids = set(request.form.getlist("uploads"))
         material_name = request.form.get("material")
         color = request.form.get("color")
         city = request.form.get("city")
@@ -81,23 +66,65 @@ def order():
             db.select(PaymentGateway).filter_by(name=payment_method)
         )
 
-        files_added = []
+        finished_uploads = db.session.scalars(
+            db.select(Upload)
+            .where(Upload.id.in_(upload_ids))
+            .where(Upload.user_id == g.user.id)
+            .where(Upload.file_id.is_not(None))
+        ).all()
+        if len(finished_uploads) != len(upload_ids):
+            flash("Some of your models were not uploaded completely. Upload them again.", "danger")
+            return render_template("order.html", form=form)
+
+        if len(stl_files) + len(finished_uploads) == 0:
+            flash("Upload at least one model.", "danger")
+            return render_template("order.html", form=form)
+
+        parts = []
+        rejected = []
         for stl_file in stl_files:
-            mat = material_name.upper().replace(" ", "_")
-            col = color.upper().replace(" ", "_")
-            file_name = stl_file.filename.replace(" ", "_")
+            upload = storage.hashed(stl_file)
+            if not archives.is_archive(stl_file.filename):
+                parts.append((stl_file.filename, upload))
+                continue
 
-            file_path = f"{current_app.root_path}/media/{mat}-{col}-{str(uuid.uuid4())}-{file_name}"
-            stl_file.save(file_path)
-            new_file = File(full_path=file_path)
+            try:
+                # every model of a ZIP or 3MF archive becomes a part of the order
+                parts.extend(archives.extract(upload.name, stl_file.filename))
+            except archives.ArchiveError as error:
+                rejected.append(f"{stl_file.filename}: {error}")
 
-            db.session.add(new_file)
-            files_added.append(new_file)
+        uploads = []
+        for file_name, upload in parts:
+            try:
+                uploads.append((file_name, upload, storage.check(upload)))
+            except stl.StlError as error:
+                rejected.append(f"{file_name}: {error}")
+
+        if len(rejected) > 0:
+            # nothing is stored or queued for an order with models that cannot be printed,
+            # the uploads are removed when the request is closed
+            db.session.rollback()
+            flash(" ".join(rejected), "danger")
+            return render_template("order.html", form=form)
 
+        # columns is None for bytes that were uploaded and analyzed before
+        files = [
+            (file_name, storage.reference(upload, **(columns or {})))
+            for file_name, upload, columns in uploads
+        ]
+
+        for finished_upload in finished_uploads:
+            # the reference held by the upload passes to the model
+            files.append((finished_upload.name, finished_upload.file))
+            db.session.delete(finished_upload)
+
+        # the models are created once every file is looked up, a lookup would flush them without an order
         stl_models = []
-        for file in files_added:
-            stl_model = StlModel(file=file, color=color)
+        for file_name, file in files:
+            stl_model = StlModel(file=file, color=color, name=file_name)
             stl_model.material = material
+            _, stl_model.rough_cost = pricing.rough_quote(file.volume, material)
 
             db.session.add(stl_model)
             stl_models.append(stl_model)
@@ -111,17 +138,30 @@ def order():
             city = city,
             postal_code = postal_code,
             phone = phone,
+            status=Order.Status.SLICING,
         )
 
         db.session.add(order)
+        db.session.flush()
+        rollups.add([order])
 
-        db.session.commit()
-
-        # create the tasks after committing to the database
-        for stl_model in stl_models:
-            tasks.slice.delay(stl_model.file.full_path, material.id)
+        # commits the order before the tasks are created
+        sent = tasks.enqueue_order_slicing(order)
+        tasks.enqueue_previews([file for _, file in files])
 
-        flash("Order has been saved", "success")
+        rough_cost = sum(stl_model.rough_cost for stl_model in stl_models)
+        if sent:
+            flash(
+                f"Order has been saved. Rough estimate: BGN {rough_cost / 100.0} lv., "
+                "the exact price will be ready once your models are sliced.",
+                "success"
+            )
+        else:
+            flash(
+                f"Order has been saved. Rough estimate: BGN {rough_cost / 100.0} lv., "
+                "but slicing could not be started. Retry it from your orders.",
+                "warning"
+            )
 
         return redirect(url_for("main.root"))
     
@@ -132,8 +172,95 @@ def order():
 @error_handler
 @login_required
 def retry_slice(order_id: int):
-    order = db.get_or_404(Order, order_id)
-    for stl_model in order.stl_models:
-        tasks.slice.delay(stl_model.file.full_path, stl_model.material_id)
-    
+    order = get_viewable_order(order_id)
+    # slice tasks still pending would slice the models twice
+    if not order.slice_stalled:
+        flash("The order has no models left to slice.", "info")
+        return redirect(url_for('profile.orders'))
+
+    with rollups.tracking([order]):
+        order.status = Order.Status.SLICING
+    # the status is committed only once the jobs are planned
+    if not tasks.enqueue_order_slicing(order):
+        flash("Slicing could not be started, try again later.", "danger")
+
     return redirect(url_for('profile.orders'))
+
+
+def get_viewable_order(order_id: int) -> Order:
+    order = db.get_or_404(Order, order_id)
+    if order.user_id != g.user.id and not (
+        g.user.has_permission(Role.all_permissions["Order"]["read"]) or
+        g.user.has_permission(Role.all_permissions["Superuser"])
+    ):
+        raise RequestException("You cannot view this order", 403)
+    return order
+
+
+@bp.get("/order/<order_id>/progress")
+@error_handler
+@login_required
+def progress(order_id: int) -> dict[str, object]:
+    """
+    Slicing state of every part of the order. The parts are sliced in
+    parallel, see tasks.enqueue_order_slicing.
+    """
+    return get_viewable_order(order_id).progress()
+
+
+@bp.get("/order/<order_id>/events")
+@error_handler
+@login_required
+def order_events(order_id: int):
+    """
+    The progress of the order, pushed as its parts are sliced. No Content
+    once the order is no longer slicing, which EventSource does not retry;
+    order.progress has its final state.
+    """
+    order = get_viewable_order(order_id)
+    if order.status != Order.Status.SLICING:
+        return "", 204
+    return events.stream([order], order.user_id, order_id=order.id)
+
+
+@bp.get("/orders/events")
+@error_handler
+@login_required
+def user_events():
+    """
+    The progress of the orders of the user that are slicing, pushed as
+    their parts are sliced.
+    """
+    orders = db.session.scalars(
+        db.select(Order)
+        .where(Order.user_id == g.user.id)
+        .where(Order.status == Order.Status.SLICING)
+        .order_by(Order.id)
+    ).all()
+    # the orders the page was waiting on are over, it reloads to show them
+    if len(orders) == 0:
+        return "", 204
+    return events.stream(orders, g.user.id)
+
+
+@bp.get("/order/<order_id>/quote")
+@error_handler
+@login_required
+def quote(order_id: int) -> dict[str, object]:
+    """
+    Price of every sliced model of the order in every material, computed
+    from the stored slice results without running the slicer again.
+    """
+    order = get_viewable_order(order_id)
+    materials = db.session.scalars(db.select(Material).order_by(Material.id)).all()
+    sliced = [stl_model for stl_model in order.stl_models if stl_model.slice_result is not None]
+    pending = [stl_model.id for stl_model in order.stl_models if stl_model.slice_result is None]
+
+    costs = pricing.price_matrix([stl_model.slice_result for stl_model in sliced], materials)
+
+    return {
+        "models": [stl_model.id for stl_model in sliced],
+        "materials": [material.name for material in materials],
+        "costs": costs.tolist(),
+        "pending": pending,
+    }
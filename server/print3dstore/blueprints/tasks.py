@@ -1,17 +1,23 @@
-import math
-import re
-import subprocess
+import os
+import sys
 import time
 
-from celery import shared_task, Task
+from celery import chord, shared_task, Signature, Task
 from celery.utils.log import logging
 
 from celery.result import AsyncResult
 from flask import Blueprint, render_template
 from flask import request
+from kombu.exceptions import OperationalError as BrokerError
 import logging
 
-from print3dstore.models import File, Material, Order, StlModel, db
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+
+from print3dstore import events, metrics, previews, rollups, thumbnails
+from print3dstore.models import File, Order, StlModel, db
+from print3dstore.slicing import cache as slice_cache, engine, failures, gcode, pricing, scheduling, stl
+from print3dstore.slicing.slicer import DEFAULT_PROFILE, slicer_version
 
 from . import tasks
 
@@ -23,12 +29,18 @@ logger.setLevel(logging.DEBUG)
 
 @bp.get("/result/<id>")
 def result(id: str) -> dict[str, object]:
+    """
+    State of a task, read once from the result backend. Slicing progress
+    is pushed by the order event streams, see print3dstore.events.
+    """
     result = AsyncResult(id)
     ready = result.ready()
+    # the stored value, or the exception of a failed task; get() would wait on and re-raise it
+    value = result.result
     return {
         "ready": ready,
         "successful": result.successful() if ready else None,
-        "value": result.get() if ready else result.result,
+        "value": repr(value) if isinstance(value, BaseException) else value,
     }
 
 
@@ -43,83 +55,455 @@ def process() -> dict[str, object]:
     result = tasks.process.delay(total=request.form.get("total", type=int))
     return {"result_id": result.id}
 
-@shared_task(ignore_result=False, autoretry_for=(Exception,))
-def slice(file_path: str, material_id: int) -> dict:
-    try:
-        material = db.get_or_404(Material, material_id)
-        file = db.session.execute(
-            db.select(File).filter_by(full_path=file_path)
-        ).scalar_one_or_none()
-
-        if file is None:
-            raise Exception(f"Error with passed {file_path=} is not found.")
-        
-        logger.debug(f"{file.full_path} found.")
-
-        logger.info(f"Begin slicing file {file.full_path}...")
-        run_command = subprocess.run(
-            ["bash", "./print3dstore/slicer/prusa-slicer", "-g", file_path, "--load", "./print3dstore/slicer/general.ini", "--threads", "1"],
-            capture_output=True
-        )
-
-        run_result = run_command.stdout.decode("utf-8")
-        run_error = run_command.stderr.decode("utf-8")
-        if run_result in (None, ""):
-            raise Exception("Error slicing the requested file", run_error)
-
-        gcode_path = re.search(r"Slicing result exported to (.+)", run_result, re.MULTILINE | re.IGNORECASE)
-
-        if gcode_path is None:
-            errors = []
-            if "exceeds the maximum build volume height" in run_error:
-                errors.append("This model cannot be printed, because it is too big. Try scaling it down.")
+# models under this size are sliced together in one slicer invocation
+BATCH_MAX_BYTES = 2 * 1024 * 1024
+BATCH_SIZE = 8
 
-            if len(errors) > 0:
-                file.stl_model.errors = " ".join(errors)
-                file.stl_model.order.status = Order.Status.CANCELLED
-                db.session.commit()
-            raise Exception("Error with sliced file. Could not find result of slicing\n", f"Slicer error: {run_error}")
 
-        logger.info(f"Gcode exported to {gcode_path.group(1)}. Looking for estimates")
+def enqueue_order_slicing(order: Order) -> bool:
+    """
+    Slices every model of `order` as one celery chord. finalize_order runs
+    once all of them are done and writes the order totals.
 
-        gcode_file = open(gcode_path.group(1), "r")
-        gcode_contents = gcode_file.read()
+    Commits the caller's transaction, the slicing order the tasks read,
+    once the jobs are planned. When the broker cannot take the chord the
+    order is stalled so it can be retried, see Order.slice_stalled.
+    Returns whether the chord was sent.
+    """
+    signatures = slice_signatures(order.stl_models)
+    db.session.commit()
+    if len(signatures) == 0:
+        return True
 
-        estimated_time_regex = re.search(r"estimated printing time \(normal mode\) = (.+)", gcode_contents, re.MULTILINE | re.IGNORECASE)
-        filament_used_regex = re.search(r"total filament used \[g\] = (.+)", gcode_contents, re.MULTILINE | re.IGNORECASE)
-
-        if estimated_time_regex is None:
-            raise Exception("Error finding estimated time in gcode file")
-        
-        if filament_used_regex is None:
-            raise Exception("Error finding filament cost in resulted gcode")
-
-        estimated_time = estimated_time_regex.group(1)
-        filament_used = filament_used_regex.group(1)
-
-        gcode_file.close()
+    try:
+        chord(signatures)(tasks.finalize_order.si(order.id))
+    except BrokerError as error:
+        logger.error(f"Could not enqueue the slicing of order {order.id}: {error}")
+        with rollups.tracking([order]):
+            order.status = Order.Status.STALLED
+        db.session.commit()
+        return False
+    return True
+
+
+def slice_signatures(stl_models: list[StlModel]) -> list[Signature]:
+    """
+    Slice jobs for `stl_models`, shortest expected job first: every job
+    goes to the queue of its expected runtime (see slicing.scheduling).
+    Small models of the same queue are batched so the slicer start-up cost
+    is paid once per batch.
+    """
+    if len(stl_models) == 0:
+        return []
+
+    user_pending = scheduling.pending_models(
+        stl_models[0].order.user_id,
+        exclude=[stl_model.id for stl_model in stl_models],
+    )
+
+    signatures = []
+    batches: dict[str, list[tuple[int, float]]] = {}
+    for stl_model in stl_models:
+        expected_runtime = scheduling.expected_runtime(stl_model.file)
+        queue = scheduling.choose_queue(expected_runtime, user_pending)
+        user_pending += 1
+
+        if scheduling.model_bytes(stl_model.file) > BATCH_MAX_BYTES:
+            signatures.append(batch_signature([(stl_model.id, expected_runtime)], queue))
+            continue
+
+        batch = batches.setdefault(queue, [])
+        batch.append((stl_model.id, expected_runtime))
+        if len(batch) == BATCH_SIZE:
+            signatures.append(batch_signature(batch, queue))
+            batches[queue] = []
+
+    for queue, batch in batches.items():
+        if len(batch) > 0:
+            signatures.append(batch_signature(batch, queue))
+
+    return signatures
+
+
+def batch_signature(batch: list[tuple[int, float]], queue: str) -> Signature:
+    return tasks.slice_models.s(
+        slice_payload([stl_model_id for stl_model_id, _ in batch]),
+        expected_runtime=sum(expected_runtime for _, expected_runtime in batch),
+    ).set(queue=queue)
+
+
+@shared_task(ignore_result=False)
+def finalize_order(order_id: int) -> dict:
+    """
+    Chord callback of enqueue_order_slicing: every model of the order is
+    sliced or failed. Writes the totals and moves the order on in one
+    transaction.
+    """
+    order = db.session.get(Order, order_id)
+    if order is None:
+        logger.warning(f"Order {order_id} was deleted while slicing")
+        return None
+
+    with rollups.tracking([order]):
+        order.update_totals()
+        failed = any(stl_model.errors is not None for stl_model in order.stl_models)
+        # models whose slicing was given up on stall the order until retry_slice
+        unsliced = any(stl_model.slice_result_id is None for stl_model in order.stl_models)
+        if failed:
+            order.status = Order.Status.CANCELLED
+        elif unsliced:
+            logger.warning(f"Order {order.id} has models that were not sliced")
+            if order.status == Order.Status.SLICING:
+                order.status = Order.Status.STALLED
+        elif order.status == Order.Status.SLICING:
+            order.status = Order.Status.QUEUED
+    events.order_changed([order])
+
+    db.session.commit()
+
+    logger.info(f"Order {order.id} is {order.status}, estimated cost {order.estimated_cost}")
+    return dict(status=order.status, estimated_cost=order.estimated_cost, estimated_time=order.estimated_time)
+
+
+# version of the slice_models payload. Bump it on incompatible changes and
+# keep a task draining the previous version until the queues are empty.
+# Version 1 were the slice and slice_batch tasks, which took file paths.
+PAYLOAD_VERSION = 2
+# retries of a payload of a newer version, uncapped in practice as the backoff
+# stays at failures.BACKOFF_MAX. max_retries=None falls back to the task's cap.
+UPGRADE_MAX_RETRIES = sys.maxsize
+
+
+def slice_payload(stl_model_ids: list[int]) -> dict:
+    return {"version": PAYLOAD_VERSION, "stl_model_ids": stl_model_ids}
+
+
+@shared_task(bind=True, ignore_result=False, max_retries=failures.MAX_RETRIES)
+def slice_models(self: Task, payload: dict, expected_runtime: float|None = None) -> list[dict]|None:
+    version = payload.get("version")
+    if isinstance(version, int) and version > PAYLOAD_VERSION:
+        # sent by an upgraded web process in the middle of a deploy, left for an
+        # upgraded worker: without a retry cap, a slow deploy must not drop it
+        logger.warning(f"Cannot read a slice payload of version {version}, retrying it")
+        metrics.increment("slice.payload_retries")
+        db.session.commit()
+        raise self.retry(countdown=failures.backoff(self.request.retries), max_retries=UPGRADE_MAX_RETRIES)
+    if version != PAYLOAD_VERSION:
+        logger.error(f"Dropping a malformed slice payload: {payload}")
+        metrics.increment("slice.payload_dropped")
+        db.session.commit()
+        return None
+
+    stl_model_ids = payload["stl_model_ids"]
+    logger.info(f"Slicing models {stl_model_ids}, expected to take {expected_runtime}s")
+    return slice_with_retries(self, stl_model_ids)
+
+
+@shared_task(bind=True, ignore_result=False, max_retries=failures.MAX_RETRIES)
+def slice(self: Task, file_path: str, material_id: int, expected_runtime: float|None = None) -> dict:
+    """
+    Version 1 payload, only drains the messages queued before slice_models.
+    """
+    results = slice_with_retries(self, legacy_model_ids([file_path]))
+    return results[0] if results else None
+
+
+@shared_task(bind=True, ignore_result=False, max_retries=failures.MAX_RETRIES)
+def slice_batch(self: Task, file_paths: list[str], material_id: int, expected_runtime: float|None = None) -> list[dict]:
+    """
+    Version 1 payload, only drains the messages queued before slice_models.
+    """
+    return slice_with_retries(self, legacy_model_ids(file_paths))
+
+
+def legacy_model_ids(file_paths: list[str]) -> list[int]:
+    """
+    Models a version 1 payload sliced: every unsliced model of the files.
+    """
+    return db.session.scalars(
+        db.select(StlModel.id)
+        .join(File, StlModel.file_id == File.id)
+        .where(File.full_path.in_(file_paths))
+        .where(StlModel.slice_result_id.is_(None))
+    ).all()
+
+
+def load_models(stl_model_ids: list[int]) -> list[StlModel]:
+    """
+    The models of `stl_model_ids` with their file, material and order, in
+    one query. Models deleted since they were queued are left out.
+    """
+    return db.session.scalars(
+        db.select(StlModel)
+        .options(
+            joinedload(StlModel.file),
+            joinedload(StlModel.material),
+            joinedload(StlModel.order),
+        )
+        .where(StlModel.id.in_(stl_model_ids))
+        .order_by(StlModel.id)
+    ).all()
 
-        hours = re.search(r"(\d+)h", estimated_time)
-        minutes = re.search(r"(\d+)m", estimated_time)
-        seconds = re.search(r"(\d+)s", estimated_time)
-        estimated_hours = int(hours.group(1)) if hours else 0
-        estimated_minutes = int(minutes.group(1)) if minutes else 0
-        estimated_seconds = int(seconds.group(1)) if seconds else 0
 
-        estimated_time_in_seconds = estimated_hours * 3600 + \
-            estimated_minutes * 60 + \
-                estimated_seconds
+def slice_with_retries(task: Task, stl_model_ids: list[int]) -> list[dict]|None:
+    """
+    Permanent failures are recorded on their models by slice_files and never
+    retried. Transient ones are retried with backoff until MAX_RETRIES.
+    """
+    try:
+        stl_models = load_models(stl_model_ids)
+        if len(stl_models) < len(set(stl_model_ids)):
+            logger.warning(f"Some of the models {stl_model_ids} were deleted while queued")
+        # sliced by an earlier try or along with a byte identical upload
+        results = slice_files([stl_model for stl_model in stl_models if stl_model.slice_result_id is None])
+    except (failures.TransientSliceError, OperationalError, OSError) as error:
+        db.session.rollback()
+        reason = type(error).__name__
+        if isinstance(error, failures.SliceError):
+            reason = error.reason
+            # the rollback dropped the counters of the failed run
+            metrics.increment("slicer.runs")
+            metrics.increment("slicer.cpu_ms.failed", int(error.cpu_time * 1000))
+        logger.warning(f"Transient slicing failure ({reason}): {error}")
+        metrics.increment(f"slice.failures.transient.{reason}")
+
+        if task.request.retries >= task.max_retries:
+            logger.error(f"Giving up slicing models {stl_model_ids} after {task.request.retries} retries")
+            metrics.increment("slice.gave_up")
+            db.session.commit()
+            return None
+
+        metrics.increment("slice.retries")
+        db.session.commit()
+        raise task.retry(exc=error, countdown=failures.backoff(task.request.retries))
+    except failures.PermanentSliceError as error:
+        db.session.rollback()
+        logger.error(error)
+        metrics.increment(f"slice.failures.permanent.{error.reason}")
+        db.session.commit()
+        return None
+    except Exception as exception:
+        # a bug rather than a slicing problem, retrying would not help
+        db.session.rollback()
+        logger.exception(exception)
+        metrics.increment("slice.failures.unexpected")
+        db.session.commit()
+        return None
+
+    metrics.increment("slice.succeeded", len(results))
+    db.session.commit()
+    return results
+
+
+def record_permanent_failure(file: File, error: failures.PermanentSliceError) -> None:
+    logger.warning(f"{file.full_path} cannot be sliced ({error.reason}): {error}")
+    # the order is cancelled by finalize_order once all of its models are done
+    stl_models = pending_models([file])
+    orders = {stl_model.order for stl_model in stl_models}
+    with rollups.tracking(orders):
+        for stl_model in stl_models:
+            stl_model.errors = str(error)
+    events.order_changed(orders)
+    metrics.increment(f"slice.failures.permanent.{error.reason}")
+
+
+def pending_models(files: list[File]) -> list[StlModel]:
+    """
+    Models of `files` without a slice result. Byte identical uploads share
+    their file, so one slice prices the models of every order using it.
+    """
+    if len(files) == 0:
+        return []
+    return db.session.scalars(
+        db.select(StlModel)
+        .options(joinedload(StlModel.material), joinedload(StlModel.order))
+        .where(StlModel.file_id.in_([file.id for file in files]))
+        .where(StlModel.slice_result_id.is_(None))
+        .order_by(StlModel.id)
+    ).all()
+
+
+def slice_files(stl_models: list[StlModel]) -> list[dict]:
+    profile_hash = slice_cache.hash_file(DEFAULT_PROFILE)
+    version = slicer_version()
+    if version is None:
+        # results of different slicer versions must not share cache keys
+        raise failures.TransientSliceError("The slicer version could not be read", "slicer_version")
+
+    files = []
+    for file in {stl_model.file_id: stl_model.file for stl_model in stl_models}.values():
+        if not os.path.exists(file.full_path):
+            record_permanent_failure(file, failures.PermanentSliceError(
+                "The uploaded file is missing. Upload the model again.", "missing_file"
+            ))
+            continue
+        files.append(file)
+
+    stl_hashes = {file.id: file.content_hash or slice_cache.hash_file(file.full_path) for file in files}
+    keys = {
+        file.id: slice_cache.cache_key(stl_hashes[file.id], profile_hash, version)
+        for file in files
+    }
 
-        file.stl_model.estimated_time = estimated_time_in_seconds
-        file.stl_model.estimated_cost = math.ceil(estimated_time_in_seconds / 3600) * 150 +\
-            math.ceil(float(filament_used)) * material.cost_per_gram
+    slice_results = {}
+    jobs = {}
+    for file in files:
+        key = keys[file.id]
+        if key in slice_results or slice_cache.gcode_path_for(key) in jobs.values():
+            continue
+        slice_result = slice_cache.lookup(key)
+        if slice_result is not None:
+            logger.info(f"Slice cache hit for {file.full_path}, skipping the slicer")
+            slice_results[key] = slice_result
+        else:
+            jobs[file] = slice_cache.gcode_path_for(key)
+
+    if len(jobs) > 0:
+        logger.info(f"Begin slicing {len(jobs)} file(s)...")
+        estimates = run_slicer(jobs)
+        for file in jobs:
+            if file.id not in estimates:
+                continue
+            estimated_time_in_seconds, filament_used, filament_volume, gcode_path, slice_duration = estimates[file.id]
+            slice_results[keys[file.id]] = slice_cache.store(
+                keys[file.id],
+                stl_hash=stl_hashes[file.id],
+                profile_hash=profile_hash,
+                slicer_version=version,
+                gcode_path=gcode_path,
+                estimated_time=estimated_time_in_seconds,
+                filament_used=filament_used,
+                filament_volume=filament_volume,
+                slice_duration=slice_duration,
+            )
+
+    sliced = [file for file in files if keys[file.id] in slice_results]
+    # the models of other orders using the same files are priced as well
+    to_price = pending_models(sliced)
+    orders = {stl_model.order for stl_model in to_price}
+    with rollups.tracking(orders):
+        for stl_model in to_price:
+            slice_result = slice_results[keys[stl_model.file_id]]
+            stl_model.slice_result = slice_result
+            stl_model.estimated_time = slice_result.estimated_time
+            stl_model.estimated_cost = pricing.price(slice_result, stl_model.material)
+    events.order_changed(orders)
+
+    results = []
+    for file in sliced:
+        slice_result = slice_results[keys[file.id]]
+        results.append(dict(gcode_path=slice_result.gcode_path, estimated_time=slice_result.estimated_time))
+
+    db.session.commit()
+
+    return results
+
+
+def run_slicer(jobs: dict[File, str]) -> dict[int, tuple[int, float, float|None, str, float]]:
+    """
+    Slices every file of `jobs` (file -> gcode path) in one slicer run.
+    Files a batched run did not export are sliced again on their own, so
+    their errors can be told apart. Returns the estimates and the share of
+    the slicer wall time by file id.
+    """
+    slicer_run, exported = engine.run_batch(
+        {file.full_path: gcode_path for file, gcode_path in jobs.items()}
+    )
+    metrics.increment("slicer.runs")
+    metrics.increment("slicer.cpu_ms", int(slicer_run.cpu_time * 1000))
+
+    estimates = {}
+    for file, gcode_path in jobs.items():
+        if file.full_path in exported:
+            estimates[file.id] = (
+                *read_estimates(exported[file.full_path]),
+                slicer_run.wall_time / len(exported),
+            )
+        elif len(jobs) == 1:
+            metrics.increment("slicer.cpu_ms.failed", int(slicer_run.cpu_time * 1000))
+            error = failures.classify(slicer_run)
+            if isinstance(error, failures.TransientSliceError):
+                raise error
+            record_permanent_failure(file, error)
+        else:
+            # transient errors of the lone run fail the whole batch, which is
+            # retried: the models sliced so far are cache hits then
+            logger.warning(f"{file.full_path} was not exported by the batched run, slicing it alone")
+            estimates.update(run_slicer({file: gcode_path}))
+
+    return estimates
+
+
+def read_estimates(gcode_path: str) -> tuple[int, float, float|None, str]:
+    logger.info(f"Gcode exported to {gcode_path}. Looking for estimates")
+
+    summary = gcode.read_summary(gcode_path)
+
+    return summary.normal_time, summary.total_filament_g, summary.total_filament_cm3, gcode_path
+
+
+def enqueue_previews(files: list[File]) -> None:
+    """
+    Builds the viewer preview and then the thumbnails of every file of
+    `files` that lacks either, once the files are committed.
+    """
+    for file in {file.id: file for file in files}.values():
+        if file.preview_path is None or file.thumbnail_version != thumbnails.RENDERER_VERSION:
+            try:
+                (tasks.build_preview.si(file.id) | tasks.render_thumbnails.si(file.id)).delay()
+            except BrokerError as error:
+                # the viewer falls back to the full model
+                logger.warning(f"Could not enqueue the preview of {file.full_path}: {error}")
+                return
+
+
+@shared_task(ignore_result=False)
+def build_preview(file_id: int) -> str|None:
+    file = db.session.get(File, file_id)
+    if file is None:
+        logger.warning(f"File {file_id} was deleted before its preview was built")
+        return None
+    if file.preview_path is not None and os.path.exists(file.preview_path):
+        return file.preview_path
 
+    try:
+        file.preview_path = previews.build(file.full_path)
+    except (stl.StlError, OSError) as error:
+        # the viewer falls back to the full model
+        logger.warning(f"Could not build the preview of {file.full_path}: {error}")
+        metrics.increment("preview.failures")
         db.session.commit()
+        return None
+
+    metrics.increment("preview.built")
+    db.session.commit()
+    logger.info(f"Built the preview of {file.full_path}")
+    return file.preview_path
+
+
+@shared_task(ignore_result=False)
+def render_thumbnails(file_id: int) -> int|None:
+    """
+    Renders the thumbnails of a file, from its preview when it was built.
+    """
+    file = db.session.get(File, file_id)
+    if file is None:
+        logger.warning(f"File {file_id} was deleted before its thumbnails were rendered")
+        return None
+    if file.thumbnail_version == thumbnails.RENDERER_VERSION:
+        return file.thumbnail_version
 
-        return dict(gcode_path=gcode_path.group(1), estimated_time=estimated_time)
-    except Exception as exception:
-        logger.error(exception)
+    try:
+        file.thumbnail_version = thumbnails.render(file.full_path, file.preview_path)
+    except (stl.StlError, OSError, ValueError) as error:
+        logger.warning(f"Could not render the thumbnails of {file.full_path}: {error}")
+        metrics.increment("thumbnail.failures")
+        db.session.commit()
+        return None
 
+    metrics.increment("thumbnail.rendered")
+    db.session.commit()
+    return file.thumbnail_version
 
 
 @shared_task()
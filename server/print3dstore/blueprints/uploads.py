@@ -0,0 +1,224 @@
+"""
+Resumable chunked uploads, for models too big to send in one order POST.
+
+    POST  /uploads                  {"name", "length"} -> {"id", "chunk_size", ...}
+    PATCH /uploads/<id>             body is one chunk, at the Upload-Offset header
+    GET   /uploads/<id>             offsets of the chunks still missing, to resume
+    POST  /uploads/<id>/finish      analyzes and stores the model
+
+Chunks may be sent in parallel and in any order. A finished upload is
+ordered by passing its id in the "uploads" field of the order form. A
+finished ZIP or 3MF archive is replaced by one upload per part, listed
+under "parts".
+
+Every upload allocates its full length on disk when it is created. A user
+may have UPLOAD_MAX_OPEN unfinished uploads of UPLOAD_MAX_OPEN_BYTES in
+total; abandoned ones go with the clean-uploads command.
+"""
+import uuid
+
+from flask import Blueprint, current_app, g, request, url_for
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from print3dstore import archives, storage
+from print3dstore.blueprints.auth import login_required
+from print3dstore.errors import RequestException
+from print3dstore.models import Upload, UploadChunk, User, db
+from print3dstore.slicing import stl
+from print3dstore.wrapper_functions import json_error_handler
+
+from .tasks import tasks
+
+bp = Blueprint("uploads", __name__, url_prefix="/uploads")
+
+CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_OPEN = 10
+DEFAULT_MAX_OPEN_BYTES = 2 * DEFAULT_MAX_BYTES
+
+
+def max_bytes() -> int:
+    return int(current_app.config.get("UPLOAD_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+def max_open() -> int:
+    return int(current_app.config.get("UPLOAD_MAX_OPEN", DEFAULT_MAX_OPEN))
+
+
+def max_open_bytes() -> int:
+    return int(current_app.config.get("UPLOAD_MAX_OPEN_BYTES", DEFAULT_MAX_OPEN_BYTES))
+
+
+def get_upload(upload_id: str) -> Upload:
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or upload.user_id != g.user.id:
+        raise RequestException("No such upload", 404)
+    return upload
+
+
+def missing_chunks(upload: Upload) -> list[int]:
+    received = set(db.session.scalars(
+        db.select(UploadChunk.index).where(UploadChunk.upload_id == upload.id)
+    ))
+    return [index for index in range(upload.chunk_count) if index not in received]
+
+
+def status(upload: Upload) -> tuple[dict[str, object], int, dict[str, str]]:
+    missing = missing_chunks(upload) if upload.file_id is None else []
+    # bytes received without a gap from the start, what a sequential client resumes from
+    offset = missing[0] * upload.chunk_size if missing else upload.length
+    return (
+        {
+            "id": upload.id,
+            "name": upload.name,
+            "length": upload.length,
+            "chunk_size": upload.chunk_size,
+            "missing": [index * upload.chunk_size for index in missing],
+            "finished": upload.file_id is not None,
+        },
+        200,
+        {"Upload-Offset": str(offset), "Upload-Length": str(upload.length)},
+    )
+
+
+@bp.post("")
+@json_error_handler
+@login_required
+def create():
+    data = request.get_json(silent=True)
+    if data is None:
+        raise RequestException("Expected a JSON body", 415)
+
+    name = str(data.get("name", "")).replace(" ", "_")
+    length = data.get("length")
+    if not (name.lower().endswith(".stl") or archives.is_archive(name)):
+        raise RequestException("Only STL files and ZIP or 3MF archives can be uploaded", 400)
+    if not isinstance(length, int) or length <= 0:
+        raise RequestException("Length must be a positive number of bytes", 400)
+    if length > max_bytes():
+        raise RequestException(f"Models larger than {max_bytes() // (1024 * 1024)} MB cannot be uploaded", 413)
+
+    # the user row is locked until the commit, parallel requests cannot pass the caps together
+    db.session.execute(db.select(User.id).where(User.id == g.user.id).with_for_update())
+    open_count, open_bytes = db.session.execute(
+        db.select(func.count(Upload.id), func.coalesce(func.sum(Upload.length), 0))
+        .where(Upload.user_id == g.user.id)
+        .where(Upload.file_id.is_(None))
+    ).one()
+    if open_count >= max_open():
+        raise RequestException(f"You have {open_count} unfinished uploads, finish one of them first", 429)
+    if open_bytes + length > max_open_bytes():
+        raise RequestException(
+            f"Unfinished uploads may hold at most {max_open_bytes() // (1024 * 1024)} MB, finish one of them first", 413
+        )
+
+    upload = Upload(id=str(uuid.uuid4()), user_id=g.user.id, name=name, length=length, chunk_size=CHUNK_SIZE)
+    storage.ChunkedFile(upload.id).allocate(length)
+    db.session.add(upload)
+    db.session.commit()
+
+    body, _, headers = status(upload)
+    headers["Location"] = url_for("uploads.upload_status", upload_id=upload.id)
+    return body, 201, headers
+
+
+@bp.get("/<upload_id>")
+@json_error_handler
+@login_required
+def upload_status(upload_id: str):
+    return status(get_upload(upload_id))
+
+
+@bp.route("/<upload_id>", methods=("PATCH", "PUT"))
+@json_error_handler
+@login_required
+def write_chunk(upload_id: str):
+    upload = get_upload(upload_id)
+    if upload.file_id is not None:
+        raise RequestException("The upload is already finished", 409)
+
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset is None or offset < 0 or offset >= upload.length or offset % upload.chunk_size != 0:
+        raise RequestException(f"Upload-Offset must be a multiple of {upload.chunk_size} below {upload.length}", 400)
+
+    index = offset // upload.chunk_size
+    length = upload.chunk_length(index)
+    if request.content_length != length:
+        raise RequestException(f"The chunk at {offset} must be {length} bytes long", 400)
+
+    # the body is read straight from the socket, werkzeug does not parse or spool it
+    written = storage.ChunkedFile(upload.id).write_at(offset, request.stream, length)
+    if written != length:
+        raise RequestException(f"The chunk at {offset} was cut short, send it again", 400)
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(UploadChunk(upload_id=upload.id, index=index))
+    except IntegrityError:
+        # a chunk sent again, its bytes were simply overwritten
+        pass
+    db.session.commit()
+
+    _, _, headers = status(upload)
+    return "", 204, headers
+
+
+@bp.post("/<upload_id>/finish")
+@json_error_handler
+@login_required
+def finish(upload_id: str):
+    upload = get_upload(upload_id)
+    if upload.file_id is not None:
+        return status(upload)
+
+    missing = missing_chunks(upload)
+    if len(missing) > 0:
+        raise RequestException(f"{len(missing)} chunks are missing, the first at {missing[0] * upload.chunk_size}", 409)
+
+    chunked_file = storage.ChunkedFile(upload.id)
+    parts = [(upload.name, chunked_file)]
+    try:
+        if archives.is_archive(upload.name):
+            parts = archives.extract(chunked_file.name, upload.name)
+        checked = [(name, part, storage.check(part)) for name, part in parts]
+    except (archives.ArchiveError, stl.StlError) as error:
+        name = upload.name
+        db.session.delete(upload)
+        db.session.commit()
+        chunked_file.close()
+        raise RequestException(f"{name}: {error}", 422)
+
+    if not archives.is_archive(upload.name):
+        [(_, _, columns)] = checked
+        upload.file = storage.reference(chunked_file, **(columns or {}))
+        upload.chunks = []
+        db.session.commit()
+        chunked_file.close()
+        tasks.enqueue_previews([upload.file])
+        return status(upload)
+
+    # every model of the archive becomes a finished upload of its own, ordered by id
+    part_uploads = [
+        Upload(
+            id=str(uuid.uuid4()),
+            user_id=upload.user_id,
+            name=name,
+            length=part.size,
+            chunk_size=upload.chunk_size,
+            file=storage.reference(part, **(columns or {})),
+        )
+        for name, part, columns in checked
+    ]
+    archive_id = upload.id
+    db.session.add_all(part_uploads)
+    db.session.delete(upload)
+    db.session.commit()
+    chunked_file.close()
+    tasks.enqueue_previews([part_upload.file for part_upload in part_uploads])
+
+    return {
+        "id": archive_id,
+        "finished": True,
+        "parts": [status(part_upload)[0] for part_upload in part_uploads],
+    }
@@ -0,0 +1,79 @@
+"""
+Choice lists of the order forms: materials, spool colors and payment
+gateways.
+
+They only change through the admin, so every process keeps them in memory
+under the catalog version, a counter in the metric table. The Material,
+Spool and PaymentGateway admin views bump it in the transaction of their
+writes, every process reloads the lists on its next form. A form costs one
+primary key lookup of the version instead of three table reads. Writes
+outside the admin have to call changed() as well.
+"""
+import dataclasses
+import threading
+
+from print3dstore import metrics
+from print3dstore.models import Material, PaymentGateway, Spool, db
+
+VERSION_METRIC = "catalog.version"
+
+
+@dataclasses.dataclass(frozen=True)
+class Catalog:
+    version: int
+    # (id, name)
+    materials: tuple[tuple[int, str], ...]
+    # distinct spool colors
+    colors: tuple[str, ...]
+    # (id, name, type)
+    payment_gateways: tuple[tuple[int, str, str], ...]
+
+
+def load(version: int) -> Catalog:
+    # plain tuples, form choices do not unpack rows
+    return Catalog(
+        version=version,
+        materials=tuple(map(tuple, db.session.execute(
+            db.select(Material.id, Material.name).order_by(Material.id)
+        ))),
+        colors=tuple(db.session.scalars(
+            db.select(Spool.color).distinct().order_by(Spool.color)
+        )),
+        payment_gateways=tuple(map(tuple, db.session.execute(
+            db.select(PaymentGateway.id, PaymentGateway.name, PaymentGateway.type).order_by(PaymentGateway.id)
+        ))),
+    )
+
+
+class CatalogCache:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # by database url, one process can run apps of several databases
+        self.catalogs: dict[str, Catalog] = {}
+
+    def get(self) -> Catalog:
+        url = str(db.engine.url)
+        version = metrics.get(VERSION_METRIC)
+        cached = self.catalogs.get(url)
+        if cached is not None and cached.version == version:
+            return cached
+
+        catalog = load(version)
+        with self.lock:
+            self.catalogs[url] = catalog
+        return catalog
+
+
+cache = CatalogCache()
+
+
+def current() -> Catalog:
+    return cache.get()
+
+
+def changed() -> None:
+    """
+    Makes every process reload the catalog once the caller's transaction
+    is committed.
+    """
+    metrics.increment(VERSION_METRIC)
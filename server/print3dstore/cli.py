@@ -1,5 +1,7 @@
 import click
-from print3dstore.models import db, User, Role, UserRole
+import datetime
+from print3dstore import rollups, storage, thumbnails
+from print3dstore.models import db, File, Upload, User, Role, UserRole
 from werkzeug.security import generate_password_hash
 import json
 
@@ -51,3 +53,63 @@ def first_load_command():
 
     db.session.commit()
     click.echo("User admin with password 'admin' has been created successfully.")
+
+
+@click.command("clean-uploads")
+@click.option("--hours", default=24, help="Age of the uploads to remove.")
+def clean_uploads_command(hours):
+    """
+    Removes chunked uploads that were abandoned or never ordered.
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(hours=hours)
+    uploads = db.session.scalars(db.select(Upload).where(Upload.created_at < cutoff)).all()
+
+    unused = []
+    for upload in uploads:
+        if upload.file is not None:
+            unused.append(storage.release(upload.file))
+        storage.ChunkedFile(upload.id).close()
+        db.session.delete(upload)
+
+    db.session.commit()
+    storage.remove([path for path in unused if path is not None])
+    click.echo(f"Removed {len(uploads)} uploads older than {hours} hours.")
+
+
+@click.command("rebuild-rollups")
+@click.option("--check", is_flag=True, help="Only compare the rollups with a full recompute.")
+def rebuild_rollups_command(check):
+    """
+    Rebuilds the analytics rollups from the orders, or checks them.
+    """
+    if check:
+        mismatches = rollups.differences(rollups.recompute(), rollups.stored())
+        for (model, *key), expected, actual in mismatches:
+            click.echo(f"{model.__tablename__} {key}: expected {expected}, stored {actual}")
+        if len(mismatches) > 0:
+            raise click.ClickException(f"{len(mismatches)} rollup rows differ from a full recompute.")
+        click.echo("The rollups match a full recompute.")
+        return
+
+    rows = rollups.rebuild()
+    db.session.commit()
+    click.echo(f"Rebuilt the rollups, {rows} rows.")
+
+
+@click.command("build-previews")
+def build_previews_command():
+    """
+    Queues the viewer previews and thumbnails of the files that have none,
+    or thumbnails of an older renderer.
+    """
+    from print3dstore.blueprints.tasks import enqueue_previews
+
+    files = db.session.scalars(
+        db.select(File).where(db.or_(
+            File.preview_path.is_(None),
+            File.thumbnail_version.is_(None),
+            File.thumbnail_version != thumbnails.RENDERER_VERSION,
+        ))
+    ).all()
+    enqueue_previews(files)
+    click.echo(f"Queued the previews and thumbnails of {len(files)} files.")
@@ -0,0 +1,188 @@
+"""
+Slicing progress pushed to the browser with Server-Sent Events.
+
+The slice tasks call order_changed for every order they touch. The
+progress of the order (Order.progress) is taken right away and published
+on the channel of its user once the transaction commits, so a client that
+reads the order after an event sees what the event says. A rollback drops
+the pending events.
+
+The /orders/events and /order/<id>/events streams subscribe to that
+channel. They send the current progress first, then every change, and a
+comment every KEEPALIVE seconds so proxies keep the connection open. After
+EVENTS_STREAM_SECONDS the stream ends and the browser reconnects, which
+frees the web worker thread of an idle page. Every open stream holds a
+thread, run the web process with threads or gevent workers.
+
+EVENTS_URL picks the pub/sub, CELERY_BROKER_URL by default:
+    redis://...  Redis PUBLISH/SUBSCRIBE, shared by every worker and web process
+    memory://    in the process only, for development with eager celery
+"""
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from typing import Iterable, Iterator
+
+from flask import Response, current_app
+from sqlalchemy import event
+
+from print3dstore.models import Order, db
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE = 15
+DEFAULT_STREAM_SECONDS = 600
+# browsers wait this long before reconnecting, in ms
+RECONNECT_DELAY = 3000
+SESSION_KEY = "print3dstore.events"
+
+
+def channel(user_id: int) -> str:
+    return f"print3dstore:orders:{user_id}"
+
+
+class MemoryPubSub:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.subscribers: dict[str, set[queue.Queue]] = {}
+
+    def publish(self, channel: str, data: str) -> None:
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(data)
+
+    def subscribe(self, channel: str) -> Iterator[str|None]:
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscriber)
+        return self.listen(channel, subscriber)
+
+    def listen(self, channel: str, subscriber: queue.Queue) -> Iterator[str|None]:
+        try:
+            while True:
+                try:
+                    yield subscriber.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield None
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+
+
+class RedisPubSub:
+    def __init__(self, url: str) -> None:
+        # only needed with a redis url, it is installed along with the celery broker
+        import redis
+
+        self.errors = (redis.RedisError, OSError)
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel: str, data: str) -> None:
+        try:
+            self.client.publish(channel, data)
+        except self.errors as error:
+            # the change is committed, pages pick it up when they reconnect
+            logger.warning(f"Could not publish on {channel}: {error}")
+
+    def subscribe(self, channel: str) -> Iterator[str|None]:
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        return self.listen(pubsub)
+
+    def listen(self, pubsub) -> Iterator[str|None]:
+        try:
+            while True:
+                message = pubsub.get_message(timeout=KEEPALIVE)
+                yield message["data"].decode() if message is not None else None
+        finally:
+            pubsub.close()
+
+
+class PubSubs:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # by url, one process can run apps of several configurations
+        self.pubsubs: dict[str, MemoryPubSub|RedisPubSub] = {}
+
+    def get(self, url: str) -> MemoryPubSub|RedisPubSub:
+        with self.lock:
+            if url not in self.pubsubs:
+                scheme = urllib.parse.urlsplit(url).scheme
+                if scheme == "memory":
+                    self.pubsubs[url] = MemoryPubSub()
+                elif scheme in ("redis", "rediss", "unix"):
+                    self.pubsubs[url] = RedisPubSub(url)
+                else:
+                    raise ValueError(f"EVENTS_URL must be a redis:// or memory:// url, not {url}")
+            return self.pubsubs[url]
+
+
+pubsubs = PubSubs()
+
+
+def pubsub() -> MemoryPubSub|RedisPubSub:
+    return pubsubs.get(current_app.config.get("EVENTS_URL") or current_app.config["CELERY_BROKER_URL"])
+
+
+def order_changed(orders: Iterable[Order]) -> None:
+    """
+    Publishes the progress of `orders` once the caller's transaction is
+    committed.
+    """
+    pending = db.session.info.setdefault(SESSION_KEY, [])
+    for order in orders:
+        pending.append((channel(order.user_id), json.dumps(order.progress())))
+
+
+@event.listens_for(db.session, "after_commit")
+def publish_pending(session) -> None:
+    pending = session.info.pop(SESSION_KEY, [])
+    if len(pending) == 0:
+        return
+    target = pubsub()
+    for name, data in pending:
+        target.publish(name, data)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def drop_pending(session, previous_transaction) -> None:
+    # a rolled back savepoint, e.g. of metrics.increment, keeps the events
+    if previous_transaction.parent is None:
+        session.info.pop(SESSION_KEY, None)
+
+
+def stream(orders: Iterable[Order], user_id: int, order_id: int|None = None) -> Response:
+    """
+    An event stream of the progress of `orders` and of every later change
+    to the orders of `user_id`, only to `order_id` when it is given.
+    """
+    # subscribed before reading the orders, a change in between is sent twice rather than lost
+    subscription = pubsub().subscribe(channel(user_id))
+    snapshots = [json.dumps(order.progress()) for order in orders]
+    deadline = time.monotonic() + int(current_app.config.get("EVENTS_STREAM_SECONDS", DEFAULT_STREAM_SECONDS))
+
+    def events() -> Iterator[str]:
+        try:
+            yield f"retry: {RECONNECT_DELAY}\n\n"
+            for snapshot in snapshots:
+                yield f"event: progress\ndata: {snapshot}\n\n"
+            for data in subscription:
+                if time.monotonic() > deadline:
+                    return
+                if data is None:
+                    yield ": keepalive\n\n"
+                elif order_id is None or json.loads(data)["id"] == order_id:
+                    yield f"event: progress\ndata: {data}\n\n"
+        finally:
+            subscription.close()
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        # nginx would buffer the stream until it ends
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,37 @@
+from sqlalchemy.exc import IntegrityError
+
+from print3dstore.models import Metric, db
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """
+    Bumps a named counter in the same transaction as the caller.
+    Counters live in the database so every celery worker and web
+    process sees the same numbers.
+    """
+    updated = db.session.execute(
+        db.update(Metric).where(Metric.name == name).values(value=Metric.value + amount)
+    )
+    if updated.rowcount > 0:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(Metric(name=name, value=amount))
+    except IntegrityError:
+        # another worker created the counter in the meantime
+        db.session.execute(
+            db.update(Metric).where(Metric.name == name).values(value=Metric.value + amount)
+        )
+
+
+def get(name: str) -> int:
+    value = db.session.scalar(db.select(Metric.value).where(Metric.name == name))
+    return value or 0
+
+
+def get_many(prefix: str) -> dict[str, int]:
+    metrics = db.session.scalars(
+        db.select(Metric).where(Metric.name.startswith(prefix)).order_by(Metric.name)
+    ).all()
+    return {metric.name: metric.value for metric in metrics}
@@ -0,0 +1,32 @@
+"""order estimated time, totals backfilled from the stl models
+
+Revision ID: 383e483ca4b5
+Revises: 075c8ce81e4c
+Create Date: 2026-10-18 15:20:11.402917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '383e483ca4b5'
+down_revision = '075c8ce81e4c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('estimated_time', sa.Integer(), nullable=True))
+
+    op.execute(
+        'UPDATE "order" SET '
+        'estimated_cost = (SELECT SUM(stl_model.estimated_cost) FROM stl_model WHERE stl_model.order_id = "order".id), '
+        'estimated_time = (SELECT SUM(stl_model.estimated_time) FROM stl_model WHERE stl_model.order_id = "order".id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_column('estimated_time')
@@ -0,0 +1,89 @@
+"""full-text search indexes of orders and users, see print3dstore.admin.fulltext
+
+Revision ID: b7e2c9d41f05
+Revises: e3f18a6c52d9
+Create Date: 2026-10-18 21:03:12.584210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c9d41f05'
+down_revision = 'e3f18a6c52d9'
+branch_labels = None
+depends_on = None
+
+ORDER_COLUMNS = ('city', 'postal_code', 'address_line1', 'address_line2', 'status')
+USER_COLUMNS = ('first_name', 'last_name', 'email')
+
+# emails are split on . and @ too, so their parts match on their own
+POSTGRESQL_VECTORS = {
+    'order': "to_tsvector('simple', concat_ws(' ', {row}.city, {row}.postal_code, {row}.address_line1, {row}.address_line2, {row}.status))",
+    'user': "to_tsvector('simple', concat_ws(' ', {row}.first_name, {row}.last_name, {row}.email, translate({row}.email, '.@', '  ')))",
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        upgrade_postgresql()
+    else:
+        upgrade_sqlite()
+
+
+def upgrade_postgresql():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, columns in (('order', ORDER_COLUMNS), ('user', USER_COLUMNS)):
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute(
+            f'CREATE FUNCTION {table}_search_vector() RETURNS trigger AS $$ '
+            f'BEGIN NEW.search_vector := {POSTGRESQL_VECTORS[table].format(row="NEW")}; RETURN NEW; END '
+            '$$ LANGUAGE plpgsql'
+        )
+        op.execute(
+            f'CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF {", ".join(columns)} '
+            f'ON "{table}" FOR EACH ROW EXECUTE FUNCTION {table}_search_vector()'
+        )
+        vector = POSTGRESQL_VECTORS[table].format(row=f'"{table}"')
+        op.execute(f'UPDATE "{table}" SET search_vector = {vector}')
+        op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], postgresql_using='gin')
+    op.execute('CREATE INDEX ix_user_email_trgm ON "user" USING gin (email gin_trgm_ops)')
+
+
+def upgrade_sqlite():
+    for table, columns in (('order', ORDER_COLUMNS), ('user', USER_COLUMNS)):
+        names = ', '.join(columns)
+        new_values = ', '.join(f'new.{column}' for column in columns)
+        old_values = ', '.join(f'old.{column}' for column in columns)
+        op.execute(f'CREATE VIRTUAL TABLE {table}_search USING fts5({names}, content=\'{table}\', content_rowid=\'id\')')
+        op.execute(
+            f'CREATE TRIGGER {table}_search_insert AFTER INSERT ON "{table}" BEGIN '
+            f'INSERT INTO {table}_search (rowid, {names}) VALUES (new.id, {new_values}); END'
+        )
+        op.execute(
+            f'CREATE TRIGGER {table}_search_delete AFTER DELETE ON "{table}" BEGIN '
+            f'INSERT INTO {table}_search ({table}_search, rowid, {names}) VALUES (\'delete\', old.id, {old_values}); END'
+        )
+        op.execute(
+            f'CREATE TRIGGER {table}_search_update AFTER UPDATE ON "{table}" BEGIN '
+            f'INSERT INTO {table}_search ({table}_search, rowid, {names}) VALUES (\'delete\', old.id, {old_values}); '
+            f'INSERT INTO {table}_search (rowid, {names}) VALUES (new.id, {new_values}); END'
+        )
+        op.execute(f'INSERT INTO {table}_search ({table}_search) VALUES (\'rebuild\')')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX ix_user_email_trgm')
+        for table in ('order', 'user'):
+            op.drop_index(f'ix_{table}_search_vector', table_name=table)
+            op.execute(f'DROP TRIGGER {table}_search_vector ON "{table}"')
+            op.execute(f'DROP FUNCTION {table}_search_vector()')
+            op.drop_column(table, 'search_vector')
+    else:
+        for table in ('order', 'user'):
+            for event in ('insert', 'delete', 'update'):
+                op.execute(f'DROP TRIGGER {table}_search_{event}')
+            op.execute(f'DROP TABLE {table}_search')
@@ -0,0 +1,61 @@
+"""role permission mask, converted from the permission json
+
+Revision ID: d85e1f6b7c20
+Revises: 2f7a9c31d8e4
+Create Date: 2026-10-18 18:47:12.663081
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd85e1f6b7c20'
+down_revision = '2f7a9c31d8e4'
+branch_labels = None
+depends_on = None
+
+# print3dstore.permissions.REGISTRY when this migration was written
+REGISTRY = (
+    "superuser",
+    "read_orders",
+    "write_orders",
+    "read_users",
+    "write_users",
+    "read_roles",
+    "write_roles",
+    "read_materials",
+    "write_materials",
+    "read_files",
+    "write_files",
+    "read_stl_models",
+    "write_stl_models",
+    "read_spools",
+    "write_spools",
+    "read_payment_gateways",
+    "write_payment_gateways",
+    "read_printers",
+    "write_printers",
+)
+
+
+def upgrade():
+    with op.batch_alter_table('role', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('permission_mask', sa.BigInteger(), server_default='0', nullable=False))
+
+    connection = op.get_bind()
+    role = sa.table('role', sa.column('id', sa.Integer), sa.column('permissions', sa.String), sa.column('permission_mask', sa.BigInteger))
+    for role_id, permissions in connection.execute(sa.select(role.c.id, role.c.permissions)).all():
+        granted = json.loads(permissions or "{}")
+        mask = 0
+        for index, name in enumerate(REGISTRY):
+            if granted.get(name):
+                mask |= 1 << index
+        connection.execute(role.update().where(role.c.id == role_id).values(permission_mask=mask))
+
+
+def downgrade():
+    with op.batch_alter_table('role', schema=None) as batch_op:
+        batch_op.drop_column('permission_mask')
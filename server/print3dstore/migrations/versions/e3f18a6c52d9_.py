@@ -0,0 +1,65 @@
+"""analytics rollups, filled from the existing orders
+
+Revision ID: e3f18a6c52d9
+Revises: 9a4c0e7d3b51
+Create Date: 2026-10-18 20:12:47.310584
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3f18a6c52d9'
+down_revision = '9a4c0e7d3b51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('order_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('estimated_cost', sa.Integer(), nullable=False),
+    sa.Column('estimated_time', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'status')
+    )
+    op.create_table('material_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('models', sa.Integer(), nullable=False),
+    sa.Column('unsliced', sa.Integer(), nullable=False),
+    sa.Column('estimated_cost', sa.Integer(), nullable=False),
+    sa.Column('estimated_time', sa.Integer(), nullable=False),
+    sa.Column('filament_grams', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['material_id'], ['material.id'], ),
+    sa.PrimaryKeyConstraint('day', 'material_id', 'status')
+    )
+
+    # the same figures as print3dstore.rollups.recompute
+    op.execute(
+        'INSERT INTO order_rollup (day, status, orders, estimated_cost, estimated_time) '
+        'SELECT DATE("order".created_at), COALESCE("order".status, \'\'), COUNT("order".id), '
+        'COALESCE(SUM("order".estimated_cost), 0), COALESCE(SUM("order".estimated_time), 0) '
+        'FROM "order" GROUP BY DATE("order".created_at), COALESCE("order".status, \'\')'
+    )
+    op.execute(
+        'INSERT INTO material_rollup '
+        '(day, material_id, status, models, unsliced, estimated_cost, estimated_time, filament_grams) '
+        'SELECT DATE("order".created_at), stl_model.material_id, COALESCE("order".status, \'\'), COUNT(stl_model.id), '
+        'SUM(CASE WHEN stl_model.slice_result_id IS NULL AND stl_model.errors IS NULL THEN 1 ELSE 0 END), '
+        'COALESCE(SUM(stl_model.estimated_cost), 0), COALESCE(SUM(stl_model.estimated_time), 0), '
+        'COALESCE(SUM(CASE WHEN COALESCE(slice_result.filament_volume, 0) != 0 AND COALESCE(material.density, 0) != 0 '
+        'THEN slice_result.filament_volume * material.density ELSE slice_result.filament_used END), 0) '
+        'FROM stl_model JOIN "order" ON stl_model.order_id = "order".id '
+        'JOIN material ON stl_model.material_id = material.id '
+        'LEFT OUTER JOIN slice_result ON stl_model.slice_result_id = slice_result.id '
+        'GROUP BY DATE("order".created_at), stl_model.material_id, COALESCE("order".status, \'\')'
+    )
+
+
+def downgrade():
+    op.drop_table('material_rollup')
+    op.drop_table('order_rollup')
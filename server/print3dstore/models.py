@@ -1,9 +1,11 @@
+import datetime
 from enum import StrEnum
-import json
 from flask_sqlalchemy import SQLAlchemy
 from typing import List, Optional
-from sqlalchemy import ForeignKey, Integer, String
-from sqlalchemy.orm import mapped_column, Mapped, relationship, DeclarativeBase, MappedAsDataclass
+from sqlalchemy import BigInteger, ForeignKey, Integer, String, func
+from sqlalchemy.orm import mapped_column, Mapped, relationship, validates, DeclarativeBase, MappedAsDataclass
+
+from print3dstore import permissions
 
 db = SQLAlchemy()
 
@@ -21,6 +23,8 @@ class Material(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
     cost_per_gram: Mapped[int]
+    # g/cm3, used to price a slice result in this material
+    density: Mapped[float|None]
 
     def __repr__(self) -> str:
         return self.name
@@ -31,7 +35,7 @@ class Spool(db.Model):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     make: Mapped[str]
-    material_id: Mapped[int] = mapped_column(ForeignKey("material.id"))
+    material_id: Mapped[int] = mapped_column(ForeignKey("material.id"), index=True)
     material: Mapped["Material"] = relationship(foreign_keys=material_id)
     color: Mapped[str]
     grams: Mapped[int]
@@ -42,12 +46,131 @@ class File(db.Model):
     __tablename__ = "file"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    stl_model: Mapped["StlModel"] = relationship(back_populates="file")
-    full_path: Mapped[str]
+    stl_models: Mapped[List["StlModel"]] = relationship(back_populates="file")
+    full_path: Mapped[str] = mapped_column(index=True)
+    # sha256 of the bytes, files uploaded before deduplication have none
+    content_hash: Mapped[str|None] = mapped_column(unique=True)
+    # stl models using the file, see print3dstore.storage
+    reference_count: Mapped[int] = mapped_column(default=1, server_default="1")
+
+    # geometry from the upload time analysis, in mm
+    triangle_count: Mapped[int|None]
+    volume: Mapped[float|None]
+    surface_area: Mapped[float|None]
+    size_x: Mapped[float|None]
+    size_y: Mapped[float|None]
+    size_z: Mapped[float|None]
+    # decimated mesh for the viewer, see print3dstore.previews
+    preview_path: Mapped[str|None]
+    # renderer version of the thumbnails, see print3dstore.thumbnails
+    thumbnail_version: Mapped[int|None]
+
+
+class Upload(db.Model):
+    """
+    A resumable upload, written chunk by chunk to media/uploads. Once
+    finished it holds one reference to its File until it is ordered.
+    """
+    __tablename__ = "upload"
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    name: Mapped[str]
+    length: Mapped[int]
+    chunk_size: Mapped[int]
+    created_at: Mapped[datetime.datetime] = mapped_column(default=func.now())
+
+    file_id: Mapped[int|None] = mapped_column(ForeignKey("file.id"))
+    file: Mapped["File"] = relationship(foreign_keys=file_id)
+
+    chunks: Mapped[List["UploadChunk"]] = relationship(cascade="all, delete-orphan")
+
+    @property
+    def chunk_count(self) -> int:
+        return -(-self.length // self.chunk_size)
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.length - index * self.chunk_size)
+
+
+class UploadChunk(db.Model):
+    __tablename__ = "upload_chunk"
+
+    upload_id: Mapped[str] = mapped_column(ForeignKey("upload.id"), primary_key=True)
+    index: Mapped[int] = mapped_column(primary_key=True)
+
+
+class SliceResult(db.Model):
+    __tablename__ = "slice_result"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    cache_key: Mapped[str] = mapped_column(unique=True)
+    stl_hash: Mapped[str]
+    profile_hash: Mapped[str]
+    slicer_version: Mapped[str]
+
+    gcode_path: Mapped[str|None]
+    gcode_size: Mapped[int] = mapped_column(default=0)
+    estimated_time: Mapped[int]
+    filament_used: Mapped[float]
+    filament_volume: Mapped[float|None]
+    # wall time of the slicer run, in seconds
+    slice_duration: Mapped[float|None]
+
+    hits: Mapped[int] = mapped_column(default=0)
+    last_used_at: Mapped[datetime.datetime] = mapped_column(default=func.now())
+
+    def __repr__(self) -> str:
+        return f"SliceResult(id={self.id}, stl_hash={self.stl_hash[:12]})"
+
+
+class Metric(db.Model):
+    __tablename__ = "metric"
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return f"Metric({self.name}={self.value})"
+
+
+class OrderRollup(db.Model):
+    """
+    Orders by creation day and status, see print3dstore.rollups.
+    """
+    __tablename__ = "order_rollup"
+
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    # orders without a status are counted under ""
+    status: Mapped[str] = mapped_column(primary_key=True)
+    orders: Mapped[int] = mapped_column(default=0)
+    estimated_cost: Mapped[int] = mapped_column(default=0)
+    estimated_time: Mapped[int] = mapped_column(default=0)
+
+
+class MaterialRollup(db.Model):
+    """
+    Stl models by order creation day, material and order status, see
+    print3dstore.rollups.
+    """
+    __tablename__ = "material_rollup"
+
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    material_id: Mapped[int] = mapped_column(ForeignKey("material.id"), primary_key=True)
+    status: Mapped[str] = mapped_column(primary_key=True)
+    models: Mapped[int] = mapped_column(default=0)
+    # models neither sliced nor failed
+    unsliced: Mapped[int] = mapped_column(default=0)
+    estimated_cost: Mapped[int] = mapped_column(default=0)
+    estimated_time: Mapped[int] = mapped_column(default=0)
+    filament_grams: Mapped[float] = mapped_column(default=0.0)
 
 
 class Order(db.Model):
     class Status(StrEnum):
+        SLICING = "slicing"
+        # the slice tasks ended with models neither sliced nor failed, see order.retry_slice
+        STALLED = "stalled"
         QUEUED = "queued"
         IN_PROGRESS = "in progress"
         SHIPPED = "shipped"
@@ -57,17 +180,20 @@ class Order(db.Model):
     __tablename__ = "order"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     user: Mapped["User"] = relationship(back_populates="orders", foreign_keys=user_id)
 
     stl_models: Mapped[List["StlModel"]] = relationship(
         back_populates="order", cascade="all, delete-orphan"
     )
 
+    # sums over stl_models, written when the order is priced
     estimated_cost: Mapped[int|None]
+    estimated_time: Mapped[int|None]
     real_cost: Mapped[int|None]
     shipping_cost: Mapped[int|None]
-    status: Mapped[str|None] = mapped_column(default=Status.QUEUED)
+    status: Mapped[str|None] = mapped_column(default=Status.QUEUED, index=True)
+    created_at: Mapped[datetime.datetime] = mapped_column(default=func.now(), server_default=func.now(), index=True)
 
     city: Mapped[str|None]
     postal_code: Mapped[str|None]
@@ -78,6 +204,51 @@ class Order(db.Model):
     payment_gateway_id: Mapped[int] = mapped_column(ForeignKey("payment_gateway.id"))
     payment_gateway: Mapped["PaymentGateway"] = relationship(foreign_keys=payment_gateway_id)
 
+    def update_totals(self) -> None:
+        self.estimated_cost, self.estimated_time = db.session.execute(
+            db.select(func.sum(StlModel.estimated_cost), func.sum(StlModel.estimated_time))
+            .where(StlModel.order_id == self.id)
+        ).one()
+
+    @property
+    def slice_stalled(self) -> bool:
+        """
+        No slice task of the order is left while some of its models are
+        neither sliced nor failed, the order history offers to retry them.
+        """
+        if self.status == Order.Status.STALLED:
+            return True
+        # orders saved before slicing was in place were queued without slicing
+        return self.status in (None, Order.Status.QUEUED) and any(
+            stl_model.slice_state == "slicing" for stl_model in self.stl_models
+        )
+
+    def progress(self) -> dict[str, object]:
+        """
+        Slicing state of every part, as served by order.progress and
+        pushed by print3dstore.events.
+        """
+        parts = [
+            {
+                "id": stl_model.id,
+                "name": stl_model.display_name,
+                "state": stl_model.slice_state,
+                "estimated_cost": stl_model.estimated_cost,
+                "estimated_time": stl_model.estimated_time,
+                "errors": stl_model.errors,
+            }
+            for stl_model in self.stl_models
+        ]
+        return {
+            "id": self.id,
+            "status": self.status,
+            "total": len(parts),
+            "sliced": sum(part["state"] == "sliced" for part in parts),
+            "failed": sum(part["state"] == "failed" for part in parts),
+            "estimated_cost": self.estimated_cost,
+            "parts": parts,
+        }
+
     def __repr__(self) -> str:
         return f"Order(id={self.id}, user_email={self.user.email})"
 
@@ -87,22 +258,41 @@ class StlModel(db.Model):
 
     id: Mapped[int] = mapped_column(primary_key=True)
 
-    file_id: Mapped[int] = mapped_column(ForeignKey("file.id"))
-    file: Mapped["File"] = relationship(foreign_keys=file_id, back_populates="stl_model")
-    order_id: Mapped[int] = mapped_column(ForeignKey("order.id"))
+    file_id: Mapped[int] = mapped_column(ForeignKey("file.id"), index=True)
+    file: Mapped["File"] = relationship(foreign_keys=file_id, back_populates="stl_models")
+    # name of the uploaded file, the stored one is named by its contents
+    name: Mapped[str|None]
+    order_id: Mapped[int] = mapped_column(ForeignKey("order.id"), index=True)
     order: Mapped["Order"] = relationship(back_populates="stl_models", foreign_keys=order_id)
 
     color: Mapped[str|None]
-    material_id: Mapped[int] = mapped_column(ForeignKey("material.id"))
+    material_id: Mapped[int] = mapped_column(ForeignKey("material.id"), index=True)
     material: Mapped["Material"] = relationship(foreign_keys=material_id)
 
+    slice_result_id: Mapped[int|None] = mapped_column(ForeignKey("slice_result.id"))
+    slice_result: Mapped["SliceResult"] = relationship(foreign_keys=slice_result_id)
+
     estimated_time: Mapped[int|None]
     estimated_cost: Mapped[int|None]
+    # shown until the model is sliced
+    rough_cost: Mapped[int|None]
 
     errors: Mapped[str|None]
 
     def __repr__(self) -> str:
-        return f"StlModel(id{self.file.full_path.split('/')[-1]})"
+        return f"StlModel(id{self.display_name})"
+
+    @property
+    def display_name(self) -> str:
+        return self.name or self.file.full_path.split('/')[-1]
+
+    @property
+    def slice_state(self) -> str:
+        if self.errors is not None:
+            return "failed"
+        if self.slice_result_id is not None:
+            return "sliced"
+        return "slicing"
 
 
 class PaymentGateway(db.Model):
@@ -134,12 +324,36 @@ class User(db.Model):
 
     phone: Mapped[str|None]
 
+    # bumped when the roles of the user change, see print3dstore.permissions
+    permission_version: Mapped[int] = mapped_column(default=0, server_default="0")
+
     def has_permission(self, permission):
-        for user_role in self.roles:
-            permissions_json = json.loads(user_role.role.permissions)
-            if permissions_json.get(permission):
-                return True
-        return False
+        bit = permissions.BITS.get(permission, 0)
+        user = (str(db.engine.url), self.id, self.email)
+        return bool(permissions.cache.get(user, self.permission_version, self.permission_mask) & bit)
+
+    def permission_mask(self) -> int:
+        return db.session.scalar(
+            db.select(effective_mask(Role.permission_mask))
+            .join(UserRole, UserRole.role_id == Role.id)
+            .where(UserRole.user_id == self.id)
+        ) or 0
+
+    @staticmethod
+    def with_permission(permission: str):
+        """
+        Select of the users holding `permission` through one of their roles.
+        """
+        return (
+            db.select(User)
+            .join(UserRole, UserRole.user_id == User.id)
+            .join(Role, UserRole.role_id == Role.id)
+            .where(Role.permission_mask.op("&")(permissions.BITS[permission]) != 0)
+            .distinct()
+        )
+
+    def permissions_changed(self) -> None:
+        self.permission_version += 1
 
     def __repr__(self) -> str:
         return f"User(id={self.id}, email={self.email})"
@@ -191,12 +405,36 @@ class Role(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
     permissions: Mapped[str]
+    # bits of print3dstore.permissions.REGISTRY, kept in sync with permissions
+    permission_mask: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
     users: Mapped[List["User"]] = relationship("UserRole", back_populates="role")
 
+    @validates("permissions")
+    def compile_permissions(self, _key: str, value: str) -> str:
+        self.permission_mask = permissions.compile_role(value)
+        return value
+
+    def permissions_changed(self) -> None:
+        db.session.execute(
+            db.update(User)
+            .where(User.id.in_(db.select(UserRole.user_id).where(UserRole.role_id == self.id)))
+            .values(permission_version=User.permission_version + 1)
+        )
+
     def __repr__(self) -> str:
         return f"Role(id={self.id}, name={self.name})"
 
 
+def effective_mask(mask):
+    """
+    Aggregate OR of the masks in the group.
+    """
+    if db.engine.dialect.name == "postgresql":
+        return func.bit_or(mask)
+    # SQLite has no bit_or: the OR is the sum of the bits set in any row
+    return sum(func.max(mask.op("&")(bit)) for bit in permissions.BITS.values())
+
+
 class UserRole(db.Model):
     __tablename__ = "user_role"
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
@@ -0,0 +1,95 @@
+"""
+Permission bits and the compiled permissions of users.
+
+Every permission has a fixed bit in REGISTRY. A role stores the OR of its
+bits in role.permission_mask, kept in sync with its permission JSON, and
+a user's effective mask is the bitwise OR over their roles, computed by
+the database in one aggregate. Masks are cached per process under the
+user's permission_version, which is bumped in the database whenever the
+user's roles or one of their roles change, so every process sees the
+change on the user's next request and a permission check is a bit test.
+"""
+import functools
+import json
+import logging
+import threading
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# append only: the position of a permission is its bit in the stored masks
+REGISTRY = (
+    "superuser",
+    "read_orders",
+    "write_orders",
+    "read_users",
+    "write_users",
+    "read_roles",
+    "write_roles",
+    "read_materials",
+    "write_materials",
+    "read_files",
+    "write_files",
+    "read_stl_models",
+    "write_stl_models",
+    "read_spools",
+    "write_spools",
+    "read_payment_gateways",
+    "write_payment_gateways",
+    "read_printers",
+    "write_printers",
+)
+BITS = {name: 1 << index for index, name in enumerate(REGISTRY)}
+
+# users whose permissions are cached per process
+MAX_CACHED_USERS = 10000
+
+
+def mask_of(names: Iterable[str]) -> int:
+    mask = 0
+    for name in names:
+        if name not in BITS:
+            logger.warning(f"Unknown permission {name} is ignored")
+            continue
+        mask |= BITS[name]
+    return mask
+
+
+def names_of(mask: int) -> list[str]:
+    return [name for name, bit in BITS.items() if mask & bit]
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_role(permissions_json: str) -> int:
+    """
+    Mask of the permissions granted by a role's permission JSON.
+    """
+    permissions = json.loads(permissions_json or "{}")
+    return mask_of(name for name, granted in permissions.items() if granted)
+
+
+class PermissionCache:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # by database url, user id and email: one process can run apps of several
+        # databases, and SQLite hands the id of the last deleted user to the next one
+        self.users: dict[tuple[str, int, str], tuple[int, int]] = {}
+
+    def get(self, user: tuple[str, int, str], version: int, load: Callable[[], int]) -> int:
+        """
+        The permission mask of `user` at `version`, from `load` when it is
+        not cached.
+        """
+        cached = self.users.get(user)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        mask = load()
+        with self.lock:
+            if len(self.users) >= MAX_CACHED_USERS:
+                self.users.clear()
+            self.users[user] = (version, mask)
+        return mask
+
+
+cache = PermissionCache()
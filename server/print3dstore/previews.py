@@ -0,0 +1,160 @@
+"""
+Decimated preview meshes for the STL viewer.
+
+The order history shows models in the browser, where the original upload,
+often tens of MB, is wasted. After upload a celery task clusters the
+vertices of the model on a grid sized for PREVIEW_MAX_TRIANGLES: the
+vertices of a cell are merged into their mean and the triangles that
+collapse are dropped. The result is stored next to the original as
+media/<sha256>.v1.mesh:
+
+    header    "P3DM", format version u16, index size u16, vertex count u32,
+              triangle count u32, bounding box min and max 6 x f32
+    vertices  3 x u16 per vertex, quantized over the bounding box,
+              padded to 4 bytes
+    indices   3 x u16 or u32 per triangle, counter-clockwise
+
+all little endian. 16 bits keep a 250 mm model exact to 4 micrometres,
+far below what a preview shows. static/stlViewer.js reads the format.
+"""
+import dataclasses
+import os
+import struct
+
+import numpy as np
+from flask import current_app
+
+from print3dstore.slicing import stl
+
+FORMAT_VERSION = 1
+MAGIC = b"P3DM"
+HEADER = struct.Struct("<4sHHII6f")
+QUANTIZATION = 65535
+
+DEFAULT_MAX_TRIANGLES = 50_000
+# a pass that still has too many triangles is redone on a coarser grid
+MAX_PASSES = 8
+
+
+@dataclasses.dataclass
+class Mesh:
+    # (n, 3) float64
+    vertices: np.ndarray
+    # (m, 3) indices into vertices
+    faces: np.ndarray
+
+
+def max_triangles() -> int:
+    return int(current_app.config.get("PREVIEW_MAX_TRIANGLES", DEFAULT_MAX_TRIANGLES))
+
+
+def path_for(full_path: str) -> str:
+    return f"{os.path.splitext(full_path)[0]}.v{FORMAT_VERSION}.mesh"
+
+
+def cluster(triangles: np.ndarray, origin: np.ndarray, cell_size: float) -> Mesh:
+    """
+    Merges the vertices of `triangles` that share a cell of a grid of
+    `cell_size` mm starting at `origin`.
+    """
+    points = len(triangles) * 3
+    keys = np.empty(points, dtype=np.int64)
+    # cells per axis, the keys stay far below 2**63 for any sane cell size
+    dims = np.int64(2 ** 20)
+    for start in range(0, len(triangles), stl.CHUNK_TRIANGLES):
+        chunk = np.asarray(triangles[start:start + stl.CHUNK_TRIANGLES], dtype=np.float64).reshape(-1, 3)
+        cells = np.clip(np.floor((chunk - origin) / cell_size), 0, dims - 1).astype(np.int64)
+        keys[start * 3:start * 3 + len(chunk)] = (cells[:, 0] * dims + cells[:, 1]) * dims + cells[:, 2]
+
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    del keys
+
+    sums = np.zeros((len(counts), 3))
+    for start in range(0, len(triangles), stl.CHUNK_TRIANGLES):
+        chunk = np.asarray(triangles[start:start + stl.CHUNK_TRIANGLES], dtype=np.float64).reshape(-1, 3)
+        indices = inverse[start * 3:start * 3 + len(chunk)]
+        for axis in range(3):
+            sums[:, axis] += np.bincount(indices, weights=chunk[:, axis], minlength=len(counts))
+    vertices = sums / counts[:, None]
+
+    faces = inverse.reshape(-1, 3)
+    collapsed = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 0] == faces[:, 2])
+    faces = faces[~collapsed]
+
+    # triangles merged into the same one, rotated to start at their lowest
+    # index so the two sides of a thin wall are kept apart
+    first = np.argmin(faces, axis=1)[:, None]
+    faces = np.take_along_axis(faces, (first + np.arange(3)) % 3, axis=1)
+    faces = np.unique(faces, axis=0)
+
+    used, faces = np.unique(faces, return_inverse=True)
+    return Mesh(vertices=vertices[used], faces=faces.reshape(-1, 3))
+
+
+def decimate(path: str, triangle_budget: int) -> Mesh:
+    """
+    The model at `path` with at most `triangle_budget` triangles, or as few
+    as the grid allows. Smaller models only have their vertices welded.
+    """
+    info = stl.analyze(path)
+    triangles = stl.read_triangles(path)
+    origin = np.array(info.bbox_min)
+    # a cell of one quantization step loses nothing the format would keep
+    step = max(max(info.size) / QUANTIZATION, 1e-6)
+
+    cell_size = step
+    if info.triangle_count > triangle_budget:
+        # a surface sampled every s mm has about 2 * area / s**2 triangles
+        cell_size = max(np.sqrt(2 * info.surface_area / triangle_budget), step)
+
+    for _ in range(MAX_PASSES):
+        mesh = cluster(triangles, origin, cell_size)
+        if len(mesh.faces) <= triangle_budget:
+            break
+        cell_size *= max(np.sqrt(len(mesh.faces) / triangle_budget), 1.1)
+    return mesh
+
+
+def encode(mesh: Mesh) -> bytes:
+    low = mesh.vertices.min(axis=0)
+    high = mesh.vertices.max(axis=0)
+    scale = np.where(high > low, high - low, 1.0)
+    quantized = np.rint((mesh.vertices - low) / scale * QUANTIZATION).astype("<u2")
+    index_type = np.dtype("<u2") if len(mesh.vertices) <= 2 ** 16 else np.dtype("<u4")
+
+    vertex_bytes = quantized.tobytes()
+    return b"".join((
+        HEADER.pack(MAGIC, FORMAT_VERSION, index_type.itemsize, len(mesh.vertices), len(mesh.faces), *low, *high),
+        vertex_bytes,
+        bytes(-len(vertex_bytes) % 4),
+        mesh.faces.astype(index_type).tobytes(),
+    ))
+
+
+def decode(data: bytes) -> Mesh:
+    magic, version, index_size, vertex_count, triangle_count, *bounds = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Not a version {FORMAT_VERSION} preview mesh")
+
+    low, high = np.array(bounds[:3]), np.array(bounds[3:])
+    quantized = np.frombuffer(data, dtype="<u2", count=vertex_count * 3, offset=HEADER.size)
+    offset = HEADER.size + vertex_count * 6 + (-vertex_count * 6 % 4)
+    faces = np.frombuffer(data, dtype=f"<u{index_size}", count=triangle_count * 3, offset=offset)
+    return Mesh(
+        vertices=low + quantized.reshape(-1, 3) / QUANTIZATION * (high - low),
+        faces=faces.reshape(-1, 3).astype(np.int64),
+    )
+
+
+def build(full_path: str) -> str:
+    """
+    Writes the preview of the model at `full_path`, returns its path.
+    Raises stl.StlError for models that cannot be read.
+    """
+    mesh = decimate(full_path, max_triangles())
+    path = path_for(full_path)
+    with open(f"{path}.part", "wb") as file:
+        file.write(encode(mesh))
+    os.replace(f"{path}.part", path)
+    return path
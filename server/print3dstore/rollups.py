@@ -0,0 +1,241 @@
+"""
+Analytics rollups maintained as orders change.
+
+order_rollup holds the orders and their totals by creation day and status,
+material_rollup the stl models, their estimates and filament by creation
+day, material and order status. Code changing an order takes its
+contributions before and after the change with `tracking` (or `add` and
+`remove` for created and deleted orders) and only the difference is
+written, as increments, so concurrent workers never overwrite each other.
+
+Writes outside of these hooks (the generic admin forms, manual SQL) are
+not tracked: `flask rebuild-rollups --check` compares the rollups with a
+full recompute and `flask rebuild-rollups` rebuilds them.
+"""
+import contextlib
+import datetime
+from typing import Iterable, Iterator
+
+from sqlalchemy import and_, case, func
+from sqlalchemy.exc import IntegrityError
+
+from print3dstore.models import Material, MaterialRollup, Order, OrderRollup, SliceResult, StlModel, db
+from print3dstore.slicing import pricing
+
+ORDER_COLUMNS = ("orders", "estimated_cost", "estimated_time")
+MATERIAL_COLUMNS = ("models", "unsliced", "estimated_cost", "estimated_time", "filament_grams")
+
+# filament sums are floats, they may drift by rounding
+GRAMS_TOLERANCE = 0.01
+
+# (table, key columns) -> summed columns
+Contributions = dict[tuple, list]
+
+
+def as_day(value) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    # SQLite returns date() as text
+    return datetime.date.fromisoformat(value)
+
+
+def contributions(orders: Iterable[Order]) -> Contributions:
+    """
+    What `orders` currently add to the rollups.
+    """
+    totals: Contributions = {}
+    for order in orders:
+        day = as_day(order.created_at)
+        status = order.status or ""
+        add_to(totals, (OrderRollup, day, status), [1, order.estimated_cost or 0, order.estimated_time or 0])
+        for stl_model in order.stl_models:
+            slice_result = stl_model.slice_result
+            add_to(totals, (MaterialRollup, day, stl_model.material_id, status), [
+                1,
+                int(slice_result is None and stl_model.errors is None),
+                stl_model.estimated_cost or 0,
+                stl_model.estimated_time or 0,
+                pricing.material_grams(slice_result, stl_model.material) if slice_result is not None else 0.0,
+            ])
+    return totals
+
+
+def add_to(totals: Contributions, key: tuple, values: list) -> None:
+    if key not in totals:
+        totals[key] = [0] * len(values)
+    totals[key] = [total + value for total, value in zip(totals[key], values)]
+
+
+def apply(before: Contributions, after: Contributions) -> None:
+    """
+    Writes the difference between two contributions to the rollups.
+    """
+    for key in before.keys() | after.keys():
+        old = before.get(key)
+        new = after.get(key)
+        width = len(old or new)
+        difference = [
+            new_value - old_value
+            for old_value, new_value in zip(old or [0] * width, new or [0] * width)
+        ]
+        if any(difference):
+            increment(key, difference)
+
+
+def increment(key: tuple, amounts: list) -> None:
+    model, day, *rest = key
+    if model is OrderRollup:
+        (status,) = rest
+        row = dict(day=day, status=status)
+        columns = ORDER_COLUMNS
+    else:
+        material_id, status = rest
+        row = dict(day=day, material_id=material_id, status=status)
+        columns = MATERIAL_COLUMNS
+
+    condition = [getattr(model, name) == value for name, value in row.items()]
+    values = {
+        name: getattr(model, name) + amount
+        for name, amount in zip(columns, amounts)
+        if amount
+    }
+    updated = db.session.execute(db.update(model).where(*condition).values(**values))
+    if updated.rowcount > 0:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**row, **dict(zip(columns, amounts))))
+    except IntegrityError:
+        # another worker created the row in the meantime
+        db.session.execute(db.update(model).where(*condition).values(**values))
+
+
+@contextlib.contextmanager
+def tracking(orders: Iterable[Order]) -> Iterator[None]:
+    """
+    Records the changes made to `orders` inside the block.
+    """
+    orders = list(orders)
+    before = contributions(orders)
+    yield
+    # foreign keys set through relationships are only written on flush
+    db.session.flush()
+    apply(before, contributions(orders))
+
+
+def add(orders: Iterable[Order]) -> None:
+    """
+    Records created orders, once they are flushed.
+    """
+    apply({}, contributions(orders))
+
+
+def remove(removed: Contributions) -> None:
+    """
+    Records deleted orders, from their contributions taken before deleting.
+    """
+    apply(removed, {})
+
+
+def recompute() -> Contributions:
+    """
+    The rollups computed from scratch with one GROUP BY per table.
+    """
+    totals: Contributions = {}
+    day = func.date(Order.created_at)
+    status = func.coalesce(Order.status, "")
+
+    order_rows = db.session.execute(
+        db.select(
+            day,
+            status,
+            func.count(Order.id),
+            func.coalesce(func.sum(Order.estimated_cost), 0),
+            func.coalesce(func.sum(Order.estimated_time), 0),
+        )
+        .group_by(day, status)
+    ).all()
+    for row_day, row_status, *values in order_rows:
+        totals[(OrderRollup, as_day(row_day), row_status)] = list(values)
+
+    # pricing.material_grams in SQL
+    grams = case(
+        (
+            and_(func.coalesce(SliceResult.filament_volume, 0) != 0, func.coalesce(Material.density, 0) != 0),
+            SliceResult.filament_volume * Material.density,
+        ),
+        else_=SliceResult.filament_used,
+    )
+    model_rows = db.session.execute(
+        db.select(
+            day,
+            StlModel.material_id,
+            status,
+            func.count(StlModel.id),
+            func.sum(case((and_(StlModel.slice_result_id.is_(None), StlModel.errors.is_(None)), 1), else_=0)),
+            func.coalesce(func.sum(StlModel.estimated_cost), 0),
+            func.coalesce(func.sum(StlModel.estimated_time), 0),
+            func.coalesce(func.sum(grams), 0.0),
+        )
+        .join(Order, StlModel.order_id == Order.id)
+        .join(Material, StlModel.material_id == Material.id)
+        .outerjoin(SliceResult, StlModel.slice_result_id == SliceResult.id)
+        .group_by(day, StlModel.material_id, status)
+    ).all()
+    for row_day, material_id, row_status, *values in model_rows:
+        totals[(MaterialRollup, as_day(row_day), material_id, row_status)] = list(values)
+
+    return totals
+
+
+def stored() -> Contributions:
+    totals: Contributions = {}
+    for rollup in db.session.scalars(db.select(OrderRollup)):
+        totals[(OrderRollup, rollup.day, rollup.status)] = [
+            getattr(rollup, name) for name in ORDER_COLUMNS
+        ]
+    for rollup in db.session.scalars(db.select(MaterialRollup)):
+        totals[(MaterialRollup, rollup.day, rollup.material_id, rollup.status)] = [
+            getattr(rollup, name) for name in MATERIAL_COLUMNS
+        ]
+    return totals
+
+
+def differences(expected: Contributions, actual: Contributions) -> list[tuple[tuple, list, list]]:
+    """
+    Keys whose stored values differ from the expected ones. Rows that were
+    counted down to zero match missing ones.
+    """
+    mismatches = []
+    for key in expected.keys() | actual.keys():
+        width = len(ORDER_COLUMNS if key[0] is OrderRollup else MATERIAL_COLUMNS)
+        expected_values = expected.get(key, [0] * width)
+        actual_values = actual.get(key, [0] * width)
+        if any(
+            abs(expected_value - actual_value) > GRAMS_TOLERANCE
+            for expected_value, actual_value in zip(expected_values, actual_values)
+        ):
+            mismatches.append((key, expected_values, actual_values))
+    return mismatches
+
+
+def rebuild() -> int:
+    """
+    Replaces the rollups with a full recompute. Returns the rows written.
+    """
+    totals = recompute()
+    db.session.execute(db.delete(OrderRollup))
+    db.session.execute(db.delete(MaterialRollup))
+    for (model, day, *rest), values in totals.items():
+        if model is OrderRollup:
+            (status,) = rest
+            db.session.add(OrderRollup(day=day, status=status, **dict(zip(ORDER_COLUMNS, values))))
+        else:
+            material_id, status = rest
+            db.session.add(MaterialRollup(
+                day=day, material_id=material_id, status=status, **dict(zip(MATERIAL_COLUMNS, values))
+            ))
+    return len(totals)
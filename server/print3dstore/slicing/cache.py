@@ -0,0 +1,147 @@
+"""
+Content addressed cache of slicer results.
+
+Entries are keyed by the STL bytes, the slicer profile bytes and the slicer
+version, so reorders, retries and the same model in another color reuse
+one slicer run. The G-code of an entry is kept under media/slice-cache and
+evicted least recently used first once the directory grows over
+SLICE_CACHE_MAX_BYTES. Evicted entries keep their estimates, which is all
+pricing needs.
+"""
+import datetime
+import hashlib
+import logging
+import os
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from print3dstore import metrics
+from print3dstore.models import SliceResult, db
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(stl_hash: str, profile_hash: str, slicer_version: str) -> str:
+    return hashlib.sha256(
+        f"{stl_hash}:{profile_hash}:{slicer_version}".encode("utf-8")
+    ).hexdigest()
+
+
+def cache_dir() -> str:
+    path = f"{current_app.root_path}/media/slice-cache"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def gcode_path_for(key: str) -> str:
+    return f"{cache_dir()}/{key}.gcode"
+
+
+def max_bytes() -> int:
+    return int(current_app.config.get("SLICE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+def lookup(key: str) -> SliceResult|None:
+    slice_result = db.session.scalar(
+        db.select(SliceResult).filter_by(cache_key=key)
+    )
+    if slice_result is None:
+        metrics.increment("slice_cache.misses")
+        return None
+
+    if slice_result.gcode_path is not None and not os.path.exists(slice_result.gcode_path):
+        # removed behind our back, the estimates are still good
+        slice_result.gcode_path = None
+        slice_result.gcode_size = 0
+
+    slice_result.hits += 1
+    slice_result.last_used_at = datetime.datetime.now()
+    metrics.increment("slice_cache.hits")
+    return slice_result
+
+
+def store(
+    key: str,
+    stl_hash: str,
+    profile_hash: str,
+    slicer_version: str,
+    gcode_path: str|None,
+    estimated_time: int,
+    filament_used: float,
+    filament_volume: float|None = None,
+    slice_duration: float|None = None,
+) -> SliceResult:
+    gcode_size = os.path.getsize(gcode_path) if gcode_path and os.path.exists(gcode_path) else 0
+    slice_result = SliceResult(
+        cache_key=key,
+        stl_hash=stl_hash,
+        profile_hash=profile_hash,
+        slicer_version=slicer_version,
+        gcode_path=gcode_path,
+        gcode_size=gcode_size,
+        estimated_time=estimated_time,
+        filament_used=filament_used,
+        filament_volume=filament_volume,
+        slice_duration=slice_duration,
+        hits=0,
+        last_used_at=datetime.datetime.now(),
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(slice_result)
+    except IntegrityError:
+        # the same model was sliced by another worker at the same time
+        slice_result = db.session.scalar(
+            db.select(SliceResult).filter_by(cache_key=key)
+        )
+
+    evict(max_bytes(), keep=slice_result.id)
+    return slice_result
+
+
+def evict(limit: int, keep: int|None = None) -> int:
+    """
+    Removes cached G-code, least recently used first, until the cache
+    is under `limit` bytes. Returns the number of bytes freed.
+    """
+    total = db.session.scalar(
+        db.select(db.func.coalesce(db.func.sum(SliceResult.gcode_size), 0))
+        .where(SliceResult.gcode_path.is_not(None))
+    )
+    if total <= limit:
+        return 0
+
+    candidates = db.session.scalars(
+        db.select(SliceResult)
+        .where(SliceResult.gcode_path.is_not(None))
+        .where(SliceResult.id != keep)
+        .order_by(SliceResult.last_used_at)
+    )
+
+    freed = 0
+    for slice_result in candidates:
+        if total - freed <= limit:
+            break
+        try:
+            os.remove(slice_result.gcode_path)
+        except OSError as error:
+            logger.warning(f"Could not evict {slice_result.gcode_path}: {error}")
+        freed += slice_result.gcode_size
+        slice_result.gcode_path = None
+        slice_result.gcode_size = 0
+        metrics.increment("slice_cache.evictions")
+
+    logger.info(f"Evicted {freed} bytes of cached gcode")
+    return freed
@@ -0,0 +1,192 @@
+"""
+Execution engine for the slicer binary.
+
+PrusaSlicer has no server mode, so a slicer process cannot be kept alive
+between jobs. Instead every celery worker shares one bounded pool of slicer
+slots: the slot and depth counters are created at import time, before celery
+forks its pool children, so all children of a worker draw from the same slots.
+SLICER_MAX_PROCESSES and SLICER_TIMEOUT_SECONDS are read from the app config
+on every run. The number of threads handed to each run is derived from the cores and
+the number of runs in flight, and several small models are sliced in a single
+invocation to pay the AppImage start-up cost once.
+"""
+import dataclasses
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+
+from flask import current_app
+
+from print3dstore.slicing.slicer import DEFAULT_PROFILE, SLICER_PATH
+
+logger = logging.getLogger(__name__)
+
+CPU_COUNT = os.cpu_count() or 1
+# runs still going after this long are killed, a hung slicer would block the worker forever
+DEFAULT_TIMEOUT = 3600
+# batched results are matched to their input by name, whatever the profile's
+# output_filename_format is
+OUTPUT_FILENAME_FORMAT = "{input_filename_base}.gcode"
+
+# runs holding a slot, and runs holding or waiting for one
+_running = multiprocessing.Value("i", 0)
+_slot_freed = multiprocessing.Condition(_running.get_lock())
+_depth = multiprocessing.Value("i", 0)
+
+
+@dataclasses.dataclass
+class SlicerRun:
+    returncode: int
+    stdout: str
+    stderr: str
+    # gcode files reported by the slicer
+    exported: list[str]
+    threads: int
+    wall_time: float
+    cpu_time: float
+    peak_rss_kb: int
+    timed_out: bool = False
+
+
+def max_processes() -> int:
+    return int(current_app.config.get("SLICER_MAX_PROCESSES", CPU_COUNT))
+
+
+def timeout() -> float:
+    return float(current_app.config.get("SLICER_TIMEOUT_SECONDS", DEFAULT_TIMEOUT))
+
+
+def thread_count() -> int:
+    """
+    Splits the cores between the runs that are queued or running.
+    A lone job gets every core, a busy worker falls back to one thread per run.
+    """
+    with _depth.get_lock():
+        depth = max(_depth.value, 1)
+    return max(CPU_COUNT // depth, 1)
+
+
+def run(input_paths: list[str], output_path: str, profile: str = DEFAULT_PROFILE) -> SlicerRun:
+    """
+    Slices `input_paths` in one slicer invocation. For a single input
+    `output_path` is the gcode file, for several it is a directory.
+    """
+    limit = max_processes()
+    with _depth.get_lock():
+        _depth.value += 1
+    try:
+        with _slot_freed:
+            _slot_freed.wait_for(lambda: _running.value < limit)
+            _running.value += 1
+        try:
+            return _run(input_paths, output_path, profile, timeout())
+        finally:
+            with _slot_freed:
+                _running.value -= 1
+                _slot_freed.notify()
+    finally:
+        with _depth.get_lock():
+            _depth.value -= 1
+
+
+def _run(input_paths: list[str], output_path: str, profile: str, timeout: float) -> SlicerRun:
+    threads = thread_count()
+    command = [
+        "bash", SLICER_PATH, "-g", *input_paths,
+        "--load", profile,
+        "--threads", str(threads),
+        "--output", output_path,
+        "--output-filename-format", OUTPUT_FILENAME_FORMAT,
+    ]
+
+    # output goes to temporary files so the child can be reaped with wait4,
+    # which gives the rusage of this one process tree
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        started_at = time.monotonic()
+        # in its own process group, so a timeout kills the AppImage started by the script too
+        process = subprocess.Popen(command, stdout=stdout, stderr=stderr, start_new_session=True)
+        status, rusage, timed_out = wait(process, started_at + timeout)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall_time = time.monotonic() - started_at
+
+        stdout.seek(0)
+        stderr.seek(0)
+        run_result = stdout.read().decode("utf-8", errors="replace")
+        run_error = stderr.read().decode("utf-8", errors="replace")
+
+    slicer_run = SlicerRun(
+        returncode=process.returncode,
+        stdout=run_result,
+        stderr=run_error,
+        exported=re.findall(r"Slicing result exported to (.+)", run_result, re.IGNORECASE),
+        threads=threads,
+        wall_time=wall_time,
+        cpu_time=rusage.ru_utime + rusage.ru_stime,
+        peak_rss_kb=rusage.ru_maxrss,
+        timed_out=timed_out,
+    )
+    logger.info(
+        f"Sliced {len(input_paths)} model(s) with {threads} thread(s) in {wall_time:.2f}s, "
+        f"cpu {slicer_run.cpu_time:.2f}s, peak rss {slicer_run.peak_rss_kb} kB"
+    )
+    return slicer_run
+
+
+def wait(process: subprocess.Popen, deadline: float) -> tuple[int, object, bool]:
+    """
+    Reaps `process` with wait4, killing its process group at `deadline`.
+    Returns the wait status, the rusage and whether it was killed.
+    """
+    delay = 0.01
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            return status, rusage, False
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+    logger.error(f"Slicer run {process.pid} is past its deadline, killing it")
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    _, status, rusage = os.wait4(process.pid, 0)
+    return status, rusage, True
+
+
+def run_batch(jobs: dict[str, str], profile: str = DEFAULT_PROFILE) -> tuple[SlicerRun, dict[str, str]]:
+    """
+    Slices every input of `jobs` (input path -> wanted gcode path) in one
+    invocation and moves the results in place. Returns the run and the
+    inputs that were exported, mapped to their gcode path.
+    """
+    if len(jobs) == 1:
+        [(input_path, gcode_path)] = jobs.items()
+        slicer_run = run([input_path], gcode_path, profile)
+        return slicer_run, {input_path: path.strip() for path in slicer_run.exported[:1]}
+
+    output_dir = tempfile.mkdtemp(dir=os.path.dirname(next(iter(jobs.values()))))
+    try:
+        slicer_run = run(list(jobs), output_dir, profile)
+
+        exported_by_name = {
+            os.path.splitext(os.path.basename(path))[0]: path.strip()
+            for path in slicer_run.exported
+        }
+        done = {}
+        for input_path, gcode_path in jobs.items():
+            name = os.path.splitext(os.path.basename(input_path))[0]
+            if name in exported_by_name:
+                shutil.move(exported_by_name[name], gcode_path)
+                done[input_path] = gcode_path
+        return slicer_run, done
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
@@ -0,0 +1,89 @@
+"""
+Classification of slicing failures.
+
+Permanent failures come from the model itself (too big, broken mesh, missing
+or unreadable file): they are shown to the user on the model and never
+retried. Transient failures (killed, hung or crashed slicer, full disk, database
+hiccups) are retried with capped exponential backoff and full jitter.
+"""
+import random
+import re
+
+from print3dstore.slicing.engine import SlicerRun
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 10
+BACKOFF_MAX = 600
+
+# (reason, pattern in the slicer output, message shown to the user)
+PERMANENT_PATTERNS = (
+    (
+        "too_big",
+        r"exceeds the maximum build volume|outside of the print volume|outside the print area",
+        "This model cannot be printed, because it is too big. Try scaling it down.",
+    ),
+    (
+        "non_manifold",
+        r"non-manifold|not manifold|open edges|repair failed",
+        "This model cannot be printed, because its mesh is not closed. Repair it and upload it again.",
+    ),
+    (
+        "empty",
+        r"nothing to print|no extrusions|empty layers|model is empty",
+        "This model cannot be printed, because it has no printable volume.",
+    ),
+    (
+        "unreadable",
+        r"failed loading|unknown file format|couldn't be read|could not read|error while reading",
+        "This model file could not be read. Export it as STL and upload it again.",
+    ),
+)
+
+TRANSIENT_PATTERNS = (
+    ("out_of_memory", r"bad_alloc|out of memory|cannot allocate memory"),
+    ("disk_full", r"no space left on device|disk quota exceeded"),
+    ("mount", r"cannot mount|fuse: |squashfs"),
+)
+
+
+class SliceError(Exception):
+    def __init__(self, message: str, reason: str, cpu_time: float = 0.0) -> None:
+        super().__init__(message)
+        self.reason = reason
+        # slicer CPU seconds spent on the failed run
+        self.cpu_time = cpu_time
+
+
+class PermanentSliceError(SliceError):
+    pass
+
+
+class TransientSliceError(SliceError):
+    pass
+
+
+def classify(slicer_run: SlicerRun) -> SliceError:
+    output = f"{slicer_run.stdout}\n{slicer_run.stderr}".lower()
+    for reason, pattern, message in PERMANENT_PATTERNS:
+        if re.search(pattern, output):
+            return PermanentSliceError(message, reason, slicer_run.cpu_time)
+
+    for reason, pattern in TRANSIENT_PATTERNS:
+        if re.search(pattern, output):
+            return TransientSliceError(f"Slicer error: {slicer_run.stderr}", reason, slicer_run.cpu_time)
+
+    if slicer_run.timed_out:
+        return TransientSliceError(f"Slicer did not finish in {slicer_run.wall_time:.0f}s", "timeout", slicer_run.cpu_time)
+
+    if slicer_run.returncode < 0:
+        return TransientSliceError(f"Slicer was killed by signal {-slicer_run.returncode}", "killed", slicer_run.cpu_time)
+
+    # unknown failures are retried, the retry cap keeps them from looping
+    return TransientSliceError(f"Slicer error: {slicer_run.stderr}", "unknown", slicer_run.cpu_time)
+
+
+def backoff(retries: int) -> float:
+    """
+    Seconds to wait before retry number `retries` + 1.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retries))
@@ -0,0 +1,137 @@
+"""
+Reads the summary PrusaSlicer writes at the end of a G-code file.
+
+The estimates live in the trailing comment block, so the file is read
+backwards in a bounded, growing window instead of loading hundreds of MB
+into memory. When the window limit is reached without finding them, the
+file is scanned forward line by line.
+"""
+import dataclasses
+import os
+import re
+
+TAIL_SIZE = 64 * 1024
+MAX_TAIL_SIZE = 8 * 1024 * 1024
+
+SUMMARY_LINE = re.compile(
+    rb"^;\s*((?:total )?filament (?:used|cost)[^=]*|estimated [^=]*|total toolchanges[^=]*)=\s*(.*?)\s*$",
+    re.MULTILINE | re.IGNORECASE,
+)
+ESTIMATED_TIME_KEY = re.compile(r"^estimated printing time \((.+) mode\)$", re.IGNORECASE)
+DURATION_PART = re.compile(r"(\d+)\s*([dhms])")
+
+REQUIRED_KEYS = ("estimated printing time (normal mode)", "total filament used [g]")
+
+
+class GcodeSummaryError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class GcodeSummary:
+    # seconds by printer mode, e.g. {"normal": 3723, "silent": 3940}
+    estimated_time: dict[str, int]
+    # one value per extruder
+    filament_mm: list[float]
+    filament_cm3: list[float]
+    filament_g: list[float]
+    total_filament_g: float
+    # every summary key as written by the slicer
+    values: dict[str, str]
+
+    @property
+    def normal_time(self) -> int|None:
+        return self.estimated_time.get("normal")
+
+    @property
+    def total_filament_cm3(self) -> float|None:
+        if len(self.filament_cm3) == 0:
+            return None
+        return sum(self.filament_cm3)
+
+
+def parse_duration(duration: str) -> int:
+    """
+    "1d 2h 3m 4s" -> seconds
+    """
+    multipliers = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+    return sum(
+        int(amount) * multipliers[unit]
+        for amount, unit in DURATION_PART.findall(duration.lower())
+    )
+
+
+def _parse_values(value: str) -> list[float]:
+    values = []
+    for part in value.split(","):
+        try:
+            values.append(float(part))
+        except ValueError:
+            pass
+    return values
+
+
+def _summary_values(contents: bytes) -> dict[str, str]:
+    return {
+        key.strip().decode("utf-8", errors="replace").lower(): value.decode("utf-8", errors="replace")
+        for key, value in SUMMARY_LINE.findall(contents)
+    }
+
+
+def _has_required(values: dict[str, str]) -> bool:
+    return all(key in values for key in REQUIRED_KEYS)
+
+
+def _read_tail(path: str) -> dict[str, str]:
+    file_size = os.path.getsize(path)
+    tail_size = TAIL_SIZE
+    with open(path, "rb") as file:
+        while True:
+            start = max(file_size - tail_size, 0)
+            file.seek(start)
+            contents = file.read(file_size - start)
+            if start > 0:
+                # the first line of the window may be cut in half
+                contents = contents[contents.find(b"\n") + 1:]
+
+            values = _summary_values(contents)
+            if _has_required(values) or start == 0 or tail_size >= MAX_TAIL_SIZE:
+                return values
+            tail_size = min(tail_size * 4, MAX_TAIL_SIZE)
+
+
+def _scan_forward(path: str) -> dict[str, str]:
+    values = {}
+    with open(path, "rb") as file:
+        for line in file:
+            if line.startswith(b";"):
+                values.update(_summary_values(line))
+    return values
+
+
+def read_summary(path: str) -> GcodeSummary:
+    values = _read_tail(path)
+    if not _has_required(values) and os.path.getsize(path) > MAX_TAIL_SIZE:
+        values = _scan_forward(path)
+
+    if "estimated printing time (normal mode)" not in values:
+        raise GcodeSummaryError("Error finding estimated time in gcode file")
+
+    total_filament_g = _parse_values(values.get("total filament used [g]", ""))
+    if len(total_filament_g) == 0:
+        raise GcodeSummaryError("Error finding filament cost in resulted gcode")
+
+    estimated_time = {}
+    for key, value in values.items():
+        mode = ESTIMATED_TIME_KEY.match(key)
+        if mode is not None:
+            estimated_time[mode.group(1)] = parse_duration(value)
+
+    return GcodeSummary(
+        estimated_time=estimated_time,
+        filament_mm=_parse_values(values.get("filament used [mm]", "")),
+        filament_cm3=_parse_values(values.get("filament used [cm3]", "")),
+        filament_g=_parse_values(values.get("filament used [g]", "")),
+        total_filament_g=total_filament_g[0],
+        values=values,
+    )
@@ -0,0 +1,77 @@
+"""
+Pricing on top of slice results.
+
+The toolpath does not depend on the material price, so one slice result
+prices a model in every material: the filament volume reported by the
+slicer is turned into grams with the density of each material.
+"""
+import math
+
+import numpy as np
+
+from print3dstore.models import Material, SliceResult
+
+# cents per started hour of printing
+HOURLY_RATE = 150
+
+# rough quote before slicing: walls and infill take about this share of the
+# solid volume and are printed at this volumetric flow
+ROUGH_FILL_RATIO = 0.35
+ROUGH_FLOW = 6.0  # mm3/s
+DEFAULT_DENSITY = 1.24  # g/cm3, PLA
+
+
+def calculate_cost(estimated_time_in_seconds: int, filament_grams: float, cost_per_gram: int) -> int:
+    return math.ceil(estimated_time_in_seconds / 3600) * HOURLY_RATE +\
+        math.ceil(filament_grams) * cost_per_gram
+
+
+def material_grams(slice_result: SliceResult, material: Material) -> float:
+    """
+    Grams of `material` needed for the sliced toolpath. Falls back to the
+    grams the slicer reported for its profile when either the volume or
+    the material density is unknown.
+    """
+    if slice_result.filament_volume and material.density:
+        return slice_result.filament_volume * material.density
+    return slice_result.filament_used
+
+
+def price(slice_result: SliceResult, material: Material) -> int:
+    return calculate_cost(
+        slice_result.estimated_time,
+        material_grams(slice_result, material),
+        material.cost_per_gram,
+    )
+
+
+def price_matrix(slice_results: list[SliceResult], materials: list[Material]) -> np.ndarray:
+    """
+    Costs in cents of every slice result (rows) in every material (columns),
+    computed in one pass.
+    """
+    estimated_time = np.array([result.estimated_time for result in slice_results], dtype=np.float64)
+    filament_used = np.array([result.filament_used for result in slice_results], dtype=np.float64)
+    filament_volume = np.array(
+        [result.filament_volume or np.nan for result in slice_results], dtype=np.float64
+    )
+    density = np.array([material.density or np.nan for material in materials], dtype=np.float64)
+    cost_per_gram = np.array([material.cost_per_gram for material in materials], dtype=np.float64)
+
+    grams = filament_volume[:, None] * density[None, :]
+    grams = np.where(np.isnan(grams), filament_used[:, None], grams)
+
+    hours = np.ceil(estimated_time / 3600)[:, None]
+    costs = hours * HOURLY_RATE + np.ceil(grams) * cost_per_gram[None, :]
+    return costs.astype(np.int64)
+
+
+def rough_quote(volume: float, material: Material) -> tuple[int, int]:
+    """
+    Estimated printing time in seconds and cost in cents from the model
+    volume (mm3) alone, shown to the user while the real slice is pending.
+    """
+    filament_volume = volume * ROUGH_FILL_RATIO
+    estimated_time_in_seconds = int(filament_volume / ROUGH_FLOW)
+    grams = filament_volume / 1000 * (material.density or DEFAULT_DENSITY)
+    return estimated_time_in_seconds, calculate_cost(estimated_time_in_seconds, grams, material.cost_per_gram)
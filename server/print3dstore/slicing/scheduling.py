@@ -0,0 +1,151 @@
+"""
+Shortest job first routing of slice jobs.
+
+Every job gets an expected slicer runtime, predicted from the geometry of the
+model with a least squares fit over past slice durations, and is sent to the
+queue for its size class so a huge model does not hold up a dozen keychains.
+Users that already have many models waiting are routed to the bulk queue.
+
+A worker started without -Q consumes every queue. To keep quick quotes
+quick, run dedicated workers, e.g.
+    celery -A print3dstore.make_celery worker -Q slice.small
+    celery -A print3dstore.make_celery worker -Q celery,slice.medium,slice.large,slice.bulk
+"""
+import os
+import time
+
+import numpy as np
+
+from print3dstore.models import File, Order, SliceResult, StlModel, db
+
+QUEUE_SMALL = "slice.small"
+QUEUE_MEDIUM = "slice.medium"
+QUEUE_LARGE = "slice.large"
+QUEUE_BULK = "slice.bulk"
+QUEUES = (QUEUE_SMALL, QUEUE_MEDIUM, QUEUE_LARGE, QUEUE_BULK)
+
+# expected runtime in seconds below which a job belongs to a queue
+SMALL_SECONDS = 30
+MEDIUM_SECONDS = 300
+
+# models a user may have waiting before further ones go to the bulk queue
+FAIR_SHARE = 10
+
+# records used for the fit and how long a fit is reused
+MIN_SAMPLES = 20
+MAX_SAMPLES = 2000
+REFIT_SECONDS = 600
+
+# rough bytes per triangle of an ASCII STL
+ASCII_BYTES_PER_TRIANGLE = 250
+
+
+def features(triangle_count: float, size_z: float, volume: float) -> np.ndarray:
+    # the slicer time grows with the mesh size, the number of layers and the filled volume
+    return np.array([1.0, triangle_count / 1e5, size_z / 100, volume / 1e5])
+
+
+class RuntimePredictor:
+    def __init__(self) -> None:
+        self.coefficients: np.ndarray|None = None
+        self.fitted_at = 0.0
+
+    def fit(self) -> None:
+        rows = db.session.execute(
+            db.select(File.triangle_count, File.size_z, File.volume, SliceResult.slice_duration)
+            .join(StlModel, StlModel.file_id == File.id)
+            .join(SliceResult, StlModel.slice_result_id == SliceResult.id)
+            .where(SliceResult.slice_duration.is_not(None))
+            .where(File.triangle_count.is_not(None))
+            .order_by(SliceResult.id.desc())
+            .limit(MAX_SAMPLES)
+        ).all()
+        self.fitted_at = time.monotonic()
+        if len(rows) < MIN_SAMPLES:
+            self.coefficients = None
+            return
+
+        x = np.array([features(row[0], row[1] or 0, row[2] or 0) for row in rows])
+        y = np.array([row[3] for row in rows])
+        self.coefficients, *_ = np.linalg.lstsq(x, y, rcond=None)
+
+    def predict(self, triangle_count: float, size_z: float, volume: float) -> float:
+        if time.monotonic() - self.fitted_at > REFIT_SECONDS:
+            self.fit()
+
+        if self.coefficients is None:
+            # until there is enough history: slicer start-up plus a rate per triangle
+            return 2.0 + triangle_count / 20000
+
+        return max(float(features(triangle_count, size_z, volume) @ self.coefficients), 1.0)
+
+
+_predictor = RuntimePredictor()
+
+
+def triangle_count(file: File) -> int:
+    """
+    Triangle count from the upload analysis, or else from the STL header.
+    A file that cannot be read counts as empty: its job goes to the small
+    queue, where the slice task records the error on its models.
+    """
+    if file.triangle_count is not None:
+        return file.triangle_count
+
+    try:
+        file_size = os.path.getsize(file.full_path)
+        with open(file.full_path, "rb") as stl_file:
+            header = stl_file.read(84)
+    except OSError:
+        return 0
+    if len(header) == 84:
+        count = int.from_bytes(header[80:84], "little")
+        # see stl.binary_triangle_count
+        if 84 + count * 50 <= file_size:
+            return count
+    return file_size // ASCII_BYTES_PER_TRIANGLE
+
+
+def model_bytes(file: File) -> int:
+    """
+    Size of the model as a binary STL, from the stored triangle count when
+    the upload was analyzed. An ASCII upload is larger on disk, the slicer
+    loads the same mesh either way.
+    """
+    if file.triangle_count is not None:
+        return 84 + file.triangle_count * 50
+    try:
+        return os.path.getsize(file.full_path)
+    except OSError:
+        return 0
+
+
+def expected_runtime(file: File) -> float:
+    return _predictor.predict(triangle_count(file), file.size_z or 0, file.volume or 0)
+
+
+def pending_models(user_id: int, exclude: list[int]) -> int:
+    """
+    Models of the user waiting to be sliced, other than `exclude`. Only
+    orders that are slicing count: models of older or given up orders that
+    were never sliced have no slice task queued.
+    """
+    return db.session.scalar(
+        db.select(db.func.count(StlModel.id))
+        .join(Order, StlModel.order_id == Order.id)
+        .where(Order.user_id == user_id)
+        .where(Order.status == Order.Status.SLICING)
+        .where(StlModel.slice_result_id.is_(None))
+        .where(StlModel.errors.is_(None))
+        .where(StlModel.id.not_in(exclude))
+    )
+
+
+def choose_queue(expected_runtime: float, user_pending: int) -> str:
+    if user_pending >= FAIR_SHARE:
+        return QUEUE_BULK
+    if expected_runtime < SMALL_SECONDS:
+        return QUEUE_SMALL
+    if expected_runtime < MEDIUM_SECONDS:
+        return QUEUE_MEDIUM
+    return QUEUE_LARGE
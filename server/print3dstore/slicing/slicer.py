@@ -0,0 +1,34 @@
+import subprocess
+
+SLICER_PATH = "./print3dstore/slicer/prusa-slicer"
+DEFAULT_PROFILE = "./print3dstore/slicer/general.ini"
+
+# read once per worker process, a failed read is tried again on the next slice
+_version: str|None = None
+
+
+def slicer_version() -> str|None:
+    """
+    First line of `prusa-slicer --help`, e.g.
+    "PrusaSlicer-2.7.4+linux-x64-GTK3-202404050928 based on Slic3r", or
+    None when it cannot be read. Slice results are keyed by it, so callers
+    must not look up or store results without it.
+    """
+    global _version
+    if _version is not None:
+        return _version
+
+    try:
+        run_command = subprocess.run(
+            ["bash", SLICER_PATH, "--help"],
+            capture_output=True,
+            timeout=60,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    lines = run_command.stdout.decode("utf-8", errors="replace").strip().splitlines()
+    if len(lines) == 0:
+        return None
+    _version = lines[0].strip()
+    return _version
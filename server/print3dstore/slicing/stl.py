@@ -0,0 +1,195 @@
+"""
+Pre-slice analysis of STL files.
+
+Reads binary (memory mapped) and ASCII STL files with numpy and computes the
+triangle count, bounding box, surface area and volume in a vectorized pass,
+so oversized models are rejected at upload time instead of after a full
+slicer run.
+"""
+import configparser
+import dataclasses
+import functools
+import os
+import re
+
+import numpy as np
+
+from print3dstore.slicing.slicer import DEFAULT_PROFILE
+
+HEADER_SIZE = 84
+TRIANGLE_DTYPE = np.dtype([
+    ("normal", "<f4", (3,)),
+    ("vertices", "<f4", (3, 3)),
+    ("attribute", "<u2"),
+])
+# triangles processed at once, keeps the float64 copies of huge models bounded
+CHUNK_TRIANGLES = 1_000_000
+# bytes of an ASCII STL parsed at once, keeps the matched strings bounded
+ASCII_CHUNK_BYTES = 1024 * 1024
+
+# bed of the printer in general.ini, used when the profile cannot be read
+DEFAULT_BUILD_VOLUME = (235.0, 235.0, 265.0)
+
+ASCII_VERTEX = re.compile(
+    rb"vertex\s+([-+0-9.eE]+)\s+([-+0-9.eE]+)\s+([-+0-9.eE]+)"
+)
+
+
+class StlError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class StlInfo:
+    triangle_count: int
+    # mm3, signed: negative when the normals point inwards
+    signed_volume: float
+    surface_area: float
+    bbox_min: tuple[float, float, float]
+    bbox_max: tuple[float, float, float]
+
+    @property
+    def volume(self) -> float:
+        return abs(self.signed_volume)
+
+    @property
+    def size(self) -> tuple[float, float, float]:
+        return tuple(high - low for low, high in zip(self.bbox_min, self.bbox_max))
+
+
+def binary_triangle_count(path: str) -> int|None:
+    """
+    Triangle count in the header of a binary STL, None for an ASCII one.
+    Exporters may write trailing bytes or start the binary header with
+    "solid": the file is binary when it holds the triangles its header
+    counts. In an ASCII file those header bytes are text, a count far
+    beyond the file size.
+    """
+    file_size = os.path.getsize(path)
+    if file_size < HEADER_SIZE:
+        return None
+    with open(path, "rb") as file:
+        file.seek(80)
+        triangle_count = int.from_bytes(file.read(4), "little")
+    if HEADER_SIZE + triangle_count * TRIANGLE_DTYPE.itemsize <= file_size:
+        return triangle_count
+    return None
+
+
+def read_triangles(path: str) -> np.ndarray:
+    """
+    Returns the triangles of the model as a (n, 3, 3) float32 array.
+    Binary files are memory mapped, nothing is read until it is used.
+    """
+    triangle_count = binary_triangle_count(path)
+    if triangle_count == 0:
+        return np.empty((0, 3, 3), dtype=np.float32)
+    if triangle_count is not None:
+        triangles = np.memmap(path, dtype=TRIANGLE_DTYPE, mode="r", offset=HEADER_SIZE, shape=(triangle_count,))
+        return triangles["vertices"]
+
+    with open(path, "rb") as file:
+        if not file.read(ASCII_CHUNK_BYTES).lstrip().startswith(b"solid"):
+            raise StlError("The file is not a valid STL file.")
+        file.seek(0)
+        vertices = read_ascii_vertices(file)
+    if len(vertices) % 3 != 0:
+        raise StlError("The file contains an incomplete triangle.")
+    return vertices.reshape(-1, 3, 3)
+
+
+def read_ascii_vertices(file) -> np.ndarray:
+    """
+    The vertex coordinates of an ASCII STL as a (n, 3) float32 array,
+    parsed ASCII_CHUNK_BYTES at a time.
+    """
+    chunks = [np.empty((0, 3), dtype=np.float32)]
+    rest = b""
+    while True:
+        data = file.read(ASCII_CHUNK_BYTES)
+        block = rest + data
+        if len(data) > 0:
+            # a vertex cut at the end of the block is parsed with the next one
+            end = max(block.rfind(b"\n"), block.rfind(b"\r")) + 1
+            block, rest = block[:end], block[end:]
+        try:
+            vertices = np.array(ASCII_VERTEX.findall(block), dtype=np.float32)
+        except ValueError as error:
+            raise StlError("The file contains invalid vertex coordinates.") from error
+        chunks.append(vertices.reshape(-1, 3))
+        if len(data) == 0:
+            return np.concatenate(chunks)
+
+
+def analyze(path: str) -> StlInfo:
+    triangles = read_triangles(path)
+    if len(triangles) == 0:
+        raise StlError("The model does not contain any triangles.")
+
+    signed_volume = 0.0
+    surface_area = 0.0
+    bbox_min = np.full(3, np.inf)
+    bbox_max = np.full(3, -np.inf)
+    for start in range(0, len(triangles), CHUNK_TRIANGLES):
+        chunk = np.asarray(triangles[start:start + CHUNK_TRIANGLES], dtype=np.float64)
+        v0, v1, v2 = chunk[:, 0], chunk[:, 1], chunk[:, 2]
+
+        signed_volume += np.einsum("ij,ij->", v0, np.cross(v1, v2)) / 6.0
+        surface_area += np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1).sum() / 2.0
+
+        points = chunk.reshape(-1, 3)
+        bbox_min = np.minimum(bbox_min, points.min(axis=0))
+        bbox_max = np.maximum(bbox_max, points.max(axis=0))
+
+    if not (np.isfinite(bbox_min).all() and np.isfinite(bbox_max).all()):
+        raise StlError("The model contains invalid coordinates.")
+
+    return StlInfo(
+        triangle_count=len(triangles),
+        signed_volume=float(signed_volume),
+        surface_area=float(surface_area),
+        bbox_min=tuple(float(value) for value in bbox_min),
+        bbox_max=tuple(float(value) for value in bbox_max),
+    )
+
+
+@functools.cache
+def build_volume(profile: str = DEFAULT_PROFILE) -> tuple[float, float, float]:
+    """
+    Width, depth and height of the printer from the `bed_shape` and
+    `max_print_height` keys of the slicer profile.
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        with open(profile, "r") as file:
+            parser.read_string("[profile]\n" + file.read())
+        height = parser.getfloat("profile", "max_print_height")
+        points = [
+            tuple(map(float, point.split("x")))
+            for point in parser.get("profile", "bed_shape").split(",")
+        ]
+        xs, ys = zip(*points)
+    except (OSError, configparser.Error, ValueError):
+        return DEFAULT_BUILD_VOLUME
+
+    return max(xs) - min(xs), max(ys) - min(ys), height
+
+
+def fits_build_volume(info: StlInfo, profile: str = DEFAULT_PROFILE) -> bool:
+    width, depth, height = build_volume(profile)
+    size_x, size_y, size_z = info.size
+    if size_z > height:
+        return False
+    # the model may be turned on the bed
+    return (size_x <= width and size_y <= depth) or (size_y <= width and size_x <= depth)
+
+
+def check(path: str) -> StlInfo:
+    """
+    Analyzes the model at `path`, raising StlError with a message for the
+    user when it cannot be printed.
+    """
+    info = analyze(path)
+    if not fits_build_volume(info):
+        raise StlError("This model cannot be printed, because it is too big. Try scaling it down.")
+    return info
@@ -0,0 +1,109 @@
+// Uploads the models of the order form through the resumable /uploads API,
+// a few chunks at a time, and submits the form with the upload ids only.
+// An interrupted upload resumes from the chunks the server is missing.
+(() => {
+  const PARALLEL_CHUNKS = 4;
+  const CHUNK_RETRIES = 3;
+
+  const form = document.querySelector('form[enctype="multipart/form-data"]');
+  const fileInput = document.querySelector('#stl_models');
+  if (!form || !fileInput) return;
+
+  const submitButton = form.querySelector('button');
+
+  const storageKey = file => `upload:${file.name}:${file.size}:${file.lastModified}`;
+
+  const request = async (url, options) => {
+    const response = await fetch(url, options);
+    if (!response.ok) {
+      const body = await response.json().catch(() => ({}));
+      throw new Error(body.error || `${response.status} ${response.statusText}`);
+    }
+    return response;
+  };
+
+  const startUpload = async file => {
+    const uploadId = localStorage.getItem(storageKey(file));
+    if (uploadId) {
+      const response = await fetch(`/uploads/${uploadId}`);
+      if (response.ok) return response.json();
+    }
+
+    const response = await request('/uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ name: file.name, length: file.size }),
+    });
+    const upload = await response.json();
+    localStorage.setItem(storageKey(file), upload.id);
+    return upload;
+  };
+
+  const sendChunk = async (upload, file, offset) => {
+    const chunk = file.slice(offset, Math.min(offset + upload.chunk_size, file.size));
+    for (let attempt = 1; ; attempt++) {
+      try {
+        await request(`/uploads/${upload.id}`, {
+          method: 'PATCH',
+          headers: { 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': String(offset) },
+          body: chunk,
+        });
+        return;
+      } catch (error) {
+        if (attempt >= CHUNK_RETRIES) throw error;
+      }
+    }
+  };
+
+  // ids of the finished uploads, one per part for ZIP and 3MF archives
+  const uploadFile = async (file, onProgress) => {
+    const upload = await startUpload(file);
+    if (!upload.finished) {
+      const missing = [...upload.missing];
+      const total = Math.ceil(file.size / upload.chunk_size);
+      let done = total - missing.length;
+      const worker = async () => {
+        while (missing.length > 0) {
+          await sendChunk(upload, file, missing.shift());
+          onProgress(++done / total);
+        }
+      };
+      await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+      const response = await request(`/uploads/${upload.id}/finish`, { method: 'POST' });
+      const finished = await response.json();
+      if (finished.parts) return finished.parts.map(part => part.id);
+    }
+    return [upload.id];
+  };
+
+  form.addEventListener('submit', async event => {
+    if (fileInput.files.length === 0) return;
+    event.preventDefault();
+    submitButton.disabled = true;
+    form.querySelectorAll('input[name="uploads"]').forEach(input => input.remove());
+
+    try {
+      for (const [index, file] of [...fileInput.files].entries()) {
+        const uploadIds = await uploadFile(file, progress => {
+          submitButton.textContent = `Uploading ${file.name} (${index + 1}/${fileInput.files.length}): ${Math.round(progress * 100)}%`;
+        });
+        uploadIds.forEach(uploadId => {
+          const input = document.createElement('input');
+          input.type = 'hidden';
+          input.name = 'uploads';
+          input.value = uploadId;
+          form.appendChild(input);
+        });
+      }
+    } catch (error) {
+      submitButton.disabled = false;
+      submitButton.textContent = `Upload failed: ${error.message}. Submit again to resume.`;
+      return;
+    }
+
+    // the models are on the server already, only the order details are posted
+    [...fileInput.files].forEach(file => localStorage.removeItem(storageKey(file)));
+    fileInput.disabled = true;
+    form.submit();
+  });
+})();
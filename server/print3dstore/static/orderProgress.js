@@ -0,0 +1,49 @@
+// Updates the order history as the parts of slicing orders are sliced,
+// from the server-sent events of /orders/events (see print3dstore/events.py).
+// The stream is closed once no order is slicing anymore.
+(() => {
+  const slicing = () => document.querySelectorAll('[data-order-id][data-status="slicing"]');
+  if (slicing().length === 0) return;
+
+  const formatPrice = cost => `BGN ${cost / 100.0} lv.`;
+
+  const partText = part => {
+    if (part.state === 'sliced' && part.estimated_cost && part.estimated_time) {
+      return `${formatPrice(part.estimated_cost)} -- ${Math.ceil(part.estimated_time / 3600)}h`;
+    }
+    if (part.state === 'failed') return part.errors;
+    return null;
+  };
+
+  const update = progress => {
+    const item = document.querySelector(`[data-order-id="${progress.id}"]`);
+    if (!item) return;
+    item.dataset.status = progress.status;
+
+    item.querySelector('.order-total').textContent =
+      progress.estimated_cost ? `-- ${formatPrice(progress.estimated_cost)} in total` : '';
+    item.querySelector('.order-progress').textContent =
+      progress.status === 'slicing' ? `-- ${progress.sliced} of ${progress.total} parts sliced` : '';
+
+    for (const part of progress.parts) {
+      const estimate = item.querySelector(`[data-part-id="${part.id}"]`);
+      const text = partText(part);
+      // parts still slicing keep their rough estimate
+      if (estimate && text !== null) estimate.textContent = text;
+    }
+
+    // the slice tasks of the order ended with some parts left unsliced
+    item.querySelector('.retry-slice').hidden = progress.status !== 'stalled';
+  };
+
+  const source = new EventSource('/orders/events');
+  source.addEventListener('progress', event => {
+    update(JSON.parse(event.data));
+    if (slicing().length === 0) source.close();
+  });
+  source.addEventListener('error', () => {
+    // the stream answers No Content once none of the orders is slicing, which
+    // happens when they ended between two connections: show their final state
+    if (source.readyState === EventSource.CLOSED && slicing().length > 0) window.location.reload();
+  });
+})();
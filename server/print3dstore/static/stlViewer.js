@@ -9,6 +9,40 @@ import { STLLoader } from 'three/addons/loaders/STLLoader.js';
   if (!stlViewWrapper) return;
 
   const loader = new STLLoader();
+
+  // decimated preview of a model, in the format of print3dstore/previews.py
+  const HEADER_SIZE = 40;
+  const QUANTIZATION = 65535;
+  const decodePreview = buffer => {
+    const view = new DataView(buffer);
+    const indexSize = view.getUint16(6, true);
+    const vertexCount = view.getUint32(8, true);
+    const triangleCount = view.getUint32(12, true);
+    const low = [0, 1, 2].map(axis => view.getFloat32(16 + 4 * axis, true));
+    const high = [0, 1, 2].map(axis => view.getFloat32(28 + 4 * axis, true));
+
+    const quantized = new Uint16Array(buffer, HEADER_SIZE, vertexCount * 3);
+    const positions = new Float32Array(vertexCount * 3);
+    for (let i = 0; i < positions.length; i++) {
+      const axis = i % 3;
+      positions[i] = low[axis] + quantized[i] / QUANTIZATION * (high[axis] - low[axis]);
+    }
+    const indexOffset = HEADER_SIZE + Math.ceil(vertexCount * 6 / 4) * 4;
+    const indices = indexSize === 2
+      ? new Uint16Array(buffer, indexOffset, triangleCount * 3)
+      : new Uint32Array(buffer, indexOffset, triangleCount * 3);
+
+    const geometry = new THREE.BufferGeometry();
+    geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3));
+    geometry.setIndex(new THREE.BufferAttribute(indices, 1));
+    geometry.computeVertexNormals();
+    return geometry;
+  };
+  const loadPreview = (url, onLoad) => {
+    fetch(url)
+      .then(response => response.arrayBuffer())
+      .then(buffer => onLoad(decodePreview(buffer)));
+  };
   const width = parseInt(stlViewWrapper.style.width);
   const height = parseInt(stlViewWrapper.style.height);
   
@@ -73,7 +107,8 @@ import { STLLoader } from 'three/addons/loaders/STLLoader.js';
     stlAnchorLinks.forEach(anchor => {
       anchor.addEventListener('click', event => {
         event.preventDefault();
-        loader.load(event.target.href, geometry => {
+        const load = event.target.dataset.format === 'mesh' ? loadPreview : loader.load.bind(loader);
+        load(event.target.href, geometry => {
           stlMesh.geometry = geometry;
           stlMesh.geometry.center();
           const bbox = new THREE.Box3().setFromObject(stlMesh);
@@ -0,0 +1,264 @@
+"""
+Content addressed storage of uploaded models.
+
+Uploads are streamed by werkzeug in fixed size chunks straight into a file
+under media/uploads while their SHA-256 is computed, instead of being
+spooled to memory or /tmp first. A stored upload is renamed to
+media/<sha256>.stl, so byte identical uploads share one file on disk and
+one File row. The row counts the models referencing it, and the bytes are
+removed together with the last reference.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from typing import BinaryIO
+
+from flask import Request, current_app, g
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import FileStorage
+
+from print3dstore import previews, thumbnails
+from print3dstore.models import File, db
+from print3dstore.slicing import cache as slice_cache, stl
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def media_dir() -> str:
+    return f"{current_app.root_path}/media"
+
+
+def upload_dir() -> str:
+    path = f"{media_dir()}/uploads"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def content_path(content_hash: str) -> str:
+    return f"{media_dir()}/{content_hash}.stl"
+
+
+class HashingFile:
+    """
+    A file under media/uploads that hashes everything written to it. It is
+    removed on close, unless it was moved into place with persist.
+    """
+    def __init__(self) -> None:
+        self.file = tempfile.NamedTemporaryFile(dir=upload_dir(), suffix=".part", delete=False)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.persisted = False
+
+    @property
+    def name(self) -> str:
+        return self.file.name
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+    def persist(self, path: str) -> None:
+        self.file.close()
+        # same file system as media/, so this is a rename and not a copy
+        os.replace(self.file.name, path)
+        self.persisted = True
+
+    def close(self) -> None:
+        self.file.close()
+        if not self.persisted:
+            try:
+                os.remove(self.file.name)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name: str) -> object:
+        # read, seek, flush, ... of the underlying file
+        return getattr(self.file, name)
+
+
+class ChunkedFile:
+    """
+    A resumable upload at media/uploads/<upload id>.part. Chunks are written
+    at their offsets as they arrive, in any order and from parallel requests,
+    so nothing is assembled afterwards.
+    """
+    def __init__(self, upload_id: str) -> None:
+        self.name = f"{upload_dir()}/{upload_id}.part"
+        self.persisted = False
+        self._hexdigest: str|None = None
+
+    def allocate(self, length: int) -> None:
+        with open(self.name, "wb") as file:
+            file.truncate(length)
+
+    def write_at(self, offset: int, stream: BinaryIO, length: int) -> int:
+        """
+        Copies up to `length` bytes of `stream` to `offset`, returns the
+        number of bytes written.
+        """
+        written = 0
+        with open(self.name, "r+b") as file:
+            file.seek(offset)
+            while written < length:
+                chunk = stream.read(min(CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                file.write(chunk)
+                written += len(chunk)
+        return written
+
+    def hexdigest(self) -> str:
+        # the chunks arrive out of order, so the file is hashed once it is complete
+        if self._hexdigest is None:
+            self._hexdigest = slice_cache.hash_file(self.name)
+        return self._hexdigest
+
+    def persist(self, path: str) -> None:
+        os.replace(self.name, path)
+        self.persisted = True
+
+    def close(self) -> None:
+        if not self.persisted:
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+
+
+class UploadRequest(Request):
+    def _get_file_stream(
+        self,
+        total_content_length: int|None,
+        content_type: str|None,
+        filename: str|None = None,
+        content_length: int|None = None,
+    ) -> HashingFile:
+        return HashingFile()
+
+
+def temporary_file() -> HashingFile:
+    """
+    A HashingFile that is removed with the app context, unless it is stored.
+    """
+    stream = HashingFile()
+    g.setdefault("temporary_files", []).append(stream)
+    return stream
+
+
+def close_temporary_files(_exception: BaseException|None = None) -> None:
+    for stream in g.pop("temporary_files", []):
+        stream.close()
+
+
+def hashed(upload: FileStorage) -> HashingFile:
+    """
+    The hashing stream of `upload`. Uploads that were not parsed by
+    UploadRequest are copied into one chunk by chunk.
+    """
+    if isinstance(upload.stream, HashingFile):
+        upload.stream.flush()
+        return upload.stream
+
+    stream = temporary_file()
+    upload.stream.seek(0)
+    for chunk in iter(lambda: upload.stream.read(CHUNK_SIZE), b""):
+        stream.write(chunk)
+    stream.flush()
+    return stream
+
+
+def file_columns(stl_info: stl.StlInfo) -> dict[str, object]:
+    """
+    The File columns of an analyzed upload, for reference.
+    """
+    size_x, size_y, size_z = stl_info.size
+    return dict(
+        triangle_count=stl_info.triangle_count,
+        volume=stl_info.volume,
+        surface_area=stl_info.surface_area,
+        size_x=size_x,
+        size_y=size_y,
+        size_z=size_z,
+    )
+
+
+def check(upload: HashingFile|ChunkedFile) -> dict[str, object]|None:
+    """
+    Analyzes `upload`, raising stl.StlError when it cannot be printed.
+    Returns the File columns for reference, or None when the same bytes
+    were uploaded and analyzed before.
+    """
+    if find(upload.hexdigest()) is not None:
+        return None
+    return file_columns(stl.check(upload.name))
+
+
+def find(content_hash: str) -> File|None:
+    return db.session.execute(
+        db.select(File).filter_by(content_hash=content_hash)
+    ).scalar_one_or_none()
+
+
+def reference(upload: HashingFile|ChunkedFile, **columns: object) -> File:
+    """
+    The File with the contents of `upload`, with one more reference.
+    The bytes are moved into place only when no file has them yet.
+    `columns` are set on a newly created File.
+    """
+    content_hash = upload.hexdigest()
+    file = find(content_hash)
+    if file is None:
+        upload.persist(content_path(content_hash))
+        file = File(full_path=content_path(content_hash), content_hash=content_hash, reference_count=1, **columns)
+        try:
+            with db.session.begin_nested():
+                db.session.add(file)
+            return file
+        except IntegrityError:
+            # a concurrent upload of the same bytes created the file
+            file = find(content_hash)
+
+    if not os.path.exists(file.full_path):
+        logger.warning(f"{file.full_path} was missing, restoring it from a new upload")
+        upload.persist(file.full_path)
+
+    file.reference_count = File.reference_count + 1
+    return file
+
+
+def release(file: File) -> str|None:
+    """
+    Drops one reference to `file`, deleting the row with the last one.
+    Returns the path to remove once the transaction is committed.
+    """
+    path = file.full_path
+    db.session.execute(
+        db.update(File).where(File.id == file.id).values(reference_count=File.reference_count - 1)
+    )
+    deleted = db.session.execute(
+        db.delete(File).where(File.id == file.id).where(File.reference_count <= 0)
+    )
+    if deleted.rowcount == 0:
+        return None
+
+    return path
+
+
+def remove(paths: list[str]) -> None:
+    """
+    Removes the files at `paths` along with their viewer previews and
+    thumbnails.
+    """
+    for path in paths:
+        for companion in (path, previews.path_for(path), *thumbnails.paths_for(path)):
+            try:
+                os.remove(companion)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,229 @@
+"""
+Server rendered thumbnails of models, for lists that show no viewer.
+
+A celery task draws every file once with a NumPy z-buffer rasterizer, no
+GPU needed: the mesh, the decimated preview when there is one, is seen
+from the front right corner above the bed like in the viewer, shaded by the
+angle of every triangle to a light above the camera. The image is rendered
+SUPERSAMPLE times larger than the biggest size and box filtered down to
+each of SIZES, and written as
+media/thumbnails/<sha256>-<size>.v<RENDERER_VERSION>.png. Bumping
+RENDERER_VERSION gives new names, so browsers never keep a stale image,
+and the build-previews command queues every file again.
+"""
+import glob
+import os
+import struct
+import zlib
+
+import numpy as np
+from flask import url_for
+from markupsafe import Markup
+
+from print3dstore import previews
+
+RENDERER_VERSION = 1
+SIZES = (32, 64, 128)
+SUPERSAMPLE = 2
+THUMBNAIL_DIR = "thumbnails"
+
+# triangles of a model without a preview
+RENDER_TRIANGLES = 20_000
+# pixel samples tested at once, bounds the memory of a render
+MAX_SAMPLES = 4_000_000
+
+# towards the camera, and the light a bit above it
+VIEW_DIRECTION = np.array([1.0, 1.0, 0.8]) / np.linalg.norm([1.0, 1.0, 0.8])
+LIGHT_DIRECTION = np.array([0.6, 1.0, 1.4]) / np.linalg.norm([0.6, 1.0, 1.4])
+COLOR = np.array([242, 140, 40])
+AMBIENT = 0.35
+MARGIN = 0.08
+
+
+def name(full_path: str, size: int, version: int = RENDERER_VERSION) -> str:
+    stem = os.path.splitext(os.path.basename(full_path))[0]
+    return f"{THUMBNAIL_DIR}/{stem}-{size}.v{version}.png"
+
+
+def path_for(full_path: str, size: int, version: int = RENDERER_VERSION) -> str:
+    return f"{os.path.dirname(full_path)}/{name(full_path, size, version)}"
+
+
+def paths_for(full_path: str) -> list[str]:
+    """
+    The thumbnails of the model at `full_path` in every size and version.
+    """
+    stem = os.path.splitext(os.path.basename(full_path))[0]
+    return glob.glob(f"{os.path.dirname(full_path)}/{THUMBNAIL_DIR}/{glob.escape(stem)}-*.png")
+
+
+def url(file, size: int = SIZES[0]) -> str|None:
+    """
+    The thumbnail of a File, None until it is rendered.
+    """
+    if file.thumbnail_version is None:
+        return None
+    return url_for("media.file", filename=name(file.full_path, size, file.thumbnail_version))
+
+
+def img(file, size: int = SIZES[0]) -> Markup:
+    """
+    An <img> of the thumbnail of a File, twice the size on high density
+    screens, or nothing until it is rendered.
+    """
+    src = url(file, size)
+    if src is None:
+        return Markup("")
+    if size * 2 in SIZES:
+        return Markup('<img src="{}" srcset="{} 2x" width="{}" height="{}" alt="" loading="lazy">').format(
+            src, url(file, size * 2), size, size
+        )
+    return Markup('<img src="{}" width="{}" height="{}" alt="" loading="lazy">').format(src, size, size)
+
+
+def project(vertices: np.ndarray, size: int) -> np.ndarray:
+    """
+    Pixel x, y and depth of `vertices`, the model fitted into the image.
+    Larger depths are closer to the camera.
+    """
+    right = np.cross([0.0, 0.0, 1.0], VIEW_DIRECTION)
+    right /= np.linalg.norm(right)
+    up = np.cross(VIEW_DIRECTION, right)
+    view = vertices @ np.stack([right, up, VIEW_DIRECTION], axis=1)
+
+    low = view[:, :2].min(axis=0)
+    high = view[:, :2].max(axis=0)
+    scale = size * (1 - 2 * MARGIN) / max(float((high - low).max()), 1e-9)
+    center = (low + high) / 2
+    return np.column_stack((
+        (view[:, 0] - center[0]) * scale + size / 2,
+        size / 2 - (view[:, 1] - center[1]) * scale,
+        view[:, 2],
+    ))
+
+
+def rasterize(mesh: previews.Mesh, size: int) -> np.ndarray:
+    """
+    A (size, size, 4) float image of `mesh`, alpha 1 where it is drawn.
+    """
+    points = project(mesh.vertices, size)
+    corners = points[mesh.faces]
+    x, y, depth = corners[..., 0], corners[..., 1], corners[..., 2]
+
+    normals = np.cross(
+        mesh.vertices[mesh.faces[:, 1]] - mesh.vertices[mesh.faces[:, 0]],
+        mesh.vertices[mesh.faces[:, 2]] - mesh.vertices[mesh.faces[:, 0]],
+    )
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+    # lit from both sides, STL normals are not always outwards
+    shades = AMBIENT + (1 - AMBIENT) * np.abs(normals @ LIGHT_DIRECTION)
+
+    # pixel bounding boxes, sampled at the pixel centers
+    x0 = np.clip(np.floor(x.min(axis=1)), 0, size).astype(np.int64)
+    x1 = np.clip(np.ceil(x.max(axis=1)), 0, size).astype(np.int64)
+    y0 = np.clip(np.floor(y.min(axis=1)), 0, size).astype(np.int64)
+    y1 = np.clip(np.ceil(y.max(axis=1)), 0, size).astype(np.int64)
+    widths = x1 - x0
+    areas = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+    counts = np.where(np.abs(areas) > 1e-12, widths * (y1 - y0), 0)
+
+    zbuffer = np.full(size * size, -np.inf)
+    shade = np.zeros(size * size)
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        end = max(int(np.searchsorted(ends, ends[start] - counts[start] + MAX_SAMPLES, side="right")), start + 1)
+        chunk = np.arange(start, end)
+        chunk_counts = counts[start:end]
+        start = end
+        if chunk_counts.sum() == 0:
+            continue
+
+        triangle = np.repeat(chunk, chunk_counts)
+        offset = np.arange(chunk_counts.sum()) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+        px = x0[triangle] + offset % widths[triangle]
+        py = y0[triangle] + offset // widths[triangle]
+        sx, sy = px + 0.5, py + 0.5
+
+        tx, ty = x[triangle], y[triangle]
+        weights = np.stack([
+            (tx[:, 1] - sx) * (ty[:, 2] - sy) - (tx[:, 2] - sx) * (ty[:, 1] - sy),
+            (tx[:, 2] - sx) * (ty[:, 0] - sy) - (tx[:, 0] - sx) * (ty[:, 2] - sy),
+            (tx[:, 0] - sx) * (ty[:, 1] - sy) - (tx[:, 1] - sx) * (ty[:, 0] - sy),
+        ], axis=1) / areas[triangle][:, None]
+        inside = (weights >= 0).all(axis=1)
+
+        pixels = (py * size + px)[inside]
+        depths = (weights[inside] * depth[triangle[inside]]).sum(axis=1)
+        triangle = triangle[inside]
+
+        # the closest sample of every pixel in the chunk, then against the buffer
+        order = np.lexsort((depths, pixels))
+        last = np.append(pixels[order][1:] != pixels[order][:-1], True)
+        nearest = order[last]
+        closer = depths[nearest] > zbuffer[pixels[nearest]]
+        nearest = nearest[closer]
+        zbuffer[pixels[nearest]] = depths[nearest]
+        shade[pixels[nearest]] = shades[triangle[nearest]]
+
+    image = np.zeros((size * size, 4))
+    drawn = np.isfinite(zbuffer)
+    image[drawn, :3] = shade[drawn, None] * COLOR
+    image[drawn, 3] = 1.0
+    return image.reshape(size, size, 4)
+
+
+def downsample(image: np.ndarray, size: int) -> np.ndarray:
+    """
+    `image` box filtered to `size`, as 8 bit RGBA.
+    """
+    factor = image.shape[0] // size
+    blocks = image[:size * factor, :size * factor].reshape(size, factor, size, factor, 4)
+    alpha = blocks[..., 3].mean(axis=(1, 3))
+    # the color of the covered samples only, the edges fade out through alpha
+    color = (blocks[..., :3] * blocks[..., 3:]).sum(axis=(1, 3)) / np.maximum(blocks[..., 3].sum(axis=(1, 3)), 1e-9)[..., None]
+    return np.dstack([color, alpha * 255]).round().clip(0, 255).astype(np.uint8)
+
+
+def png(image: np.ndarray) -> bytes:
+    """
+    `image`, 8 bit RGBA, as a PNG file.
+    """
+    height, width, _ = image.shape
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    # every row starts with filter type 0
+    rows = np.hstack([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 4)])
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)),
+        chunk(b"IEND", b""),
+    ))
+
+
+def load_mesh(full_path: str, preview_path: str|None) -> previews.Mesh:
+    if preview_path is not None and os.path.exists(preview_path):
+        with open(preview_path, "rb") as file:
+            return previews.decode(file.read())
+    return previews.decimate(full_path, RENDER_TRIANGLES)
+
+
+def render(full_path: str, preview_path: str|None) -> int:
+    """
+    Writes the thumbnails of the model at `full_path` in every size,
+    returns the renderer version. Raises stl.StlError for models that
+    cannot be read.
+    """
+    mesh = load_mesh(full_path, preview_path)
+    image = rasterize(mesh, max(SIZES) * SUPERSAMPLE)
+
+    os.makedirs(f"{os.path.dirname(full_path)}/{THUMBNAIL_DIR}", exist_ok=True)
+    for size in SIZES:
+        path = path_for(full_path, size)
+        with open(f"{path}.part", "wb") as file:
+            file.write(png(downsample(image, size)))
+        os.replace(f"{path}.part", path)
+    return RENDERER_VERSION
@@ -14,3 +14,16 @@ def error_handler(view):
             return make_response(render_template('error.html', error=unexpected_error), 500)
 
     return error_handler
+
+
+def json_error_handler(view):
+    @functools.wraps(view)
+    def json_error_handler(**kwargs):
+        try:
+            return view(**kwargs)
+        except RequestException as e:
+            return {"error": str(e)}, e.http_code
+        except Exception as unexpected_error:
+            return {"error": str(unexpected_error)}, 500
+
+    return json_error_handler
@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+
+# read when the forms are imported
+os.environ.setdefault("SECRET_KEY", "test")
+
+from print3dstore import create_app
+from print3dstore.models import Material, PaymentGateway, Role, User, UserRole, db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "SECRET_KEY": "test",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.sqlite'}",
+        "CELERY_BROKER_URL": "memory://",
+        "CELERY_RESULT_BACKEND": "cache+memory://",
+        "CELERY_IGNORE_RESULT": True,
+        "EVENTS_URL": "memory://",
+    })
+    app.extensions["celery"].conf.task_always_eager = True
+
+    with app.app_context():
+        db.session.add_all([
+            Material(name="PLA", cost_per_gram=10, density=1.24),
+            PaymentGateway(name="Cash", type="cash"),
+        ])
+        admin = User(email="admin@example.com", password="x")
+        role = Role(name="superuser", permissions=json.dumps({"superuser": True}))
+        db.session.add_all([admin, role, UserRole(user=admin, role=role)])
+        db.session.commit()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    return client
@@ -0,0 +1,47 @@
+import re
+
+import pytest
+
+from print3dstore.models import File, Material, Order, SliceResult, Spool, StlModel, db
+from print3dstore.slicing import pricing
+
+
+@pytest.fixture
+def order_id(app):
+    with app.app_context():
+        petg = Material(name="PETG", cost_per_gram=20, density=1.27)
+        db.session.add_all([petg, Spool(make="x", material=petg, color="red", grams=1000, grams_left=1000)])
+        order = Order(user_id=1, payment_gateway_id=1, status=Order.Status.QUEUED, city="Sofia")
+        for i, grams in enumerate((10.0, 40.0)):
+            slice_result = SliceResult(
+                cache_key=f"key{i}", stl_hash=f"hash{i}", profile_hash="profile", slicer_version="2.7",
+                estimated_time=3600 * (i + 1), filament_used=grams * 1000 / 1.24 / 2.98, filament_volume=grams * 1000 / 1.24,
+            )
+            db.session.add(StlModel(
+                order=order, file=File(full_path=f"media/part{i}.stl"), material_id=1, color="red",
+                slice_result=slice_result,
+            ))
+        db.session.flush()
+        for stl_model in order.stl_models:
+            stl_model.estimated_cost = pricing.price(stl_model.slice_result, stl_model.material)
+        order.update_totals()
+        db.session.commit()
+        return order.id
+
+
+def test_material_change_reprices_every_part(app, admin_client, order_id):
+    url = f"/admin/orders/edit/?id={order_id}"
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', admin_client.get(url).data.decode()).group(1)
+    response = admin_client.post(url, data={
+        "csrf_token": token, "material": "2", "color": "red", "payment_method": "1", "status": "queued",
+        "city": "Sofia", "postal_code": "1000", "address_line1": "a", "address_line2": "", "phone": "",
+    })
+    assert response.status_code == 302
+
+    with app.app_context():
+        order = db.session.get(Order, order_id)
+        petg = db.session.get(Material, 2)
+        costs = [pricing.price(stl_model.slice_result, petg) for stl_model in order.stl_models]
+        assert [stl_model.material_id for stl_model in order.stl_models] == [2, 2]
+        assert [stl_model.estimated_cost for stl_model in order.stl_models] == costs
+        assert order.estimated_cost == sum(costs)
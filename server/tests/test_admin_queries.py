@@ -0,0 +1,50 @@
+import contextlib
+
+from sqlalchemy import event
+
+from print3dstore.models import File, Order, StlModel, User, db
+
+
+@contextlib.contextmanager
+def count_queries(app):
+    counts = []
+    with app.app_context():
+        engine = db.engine
+
+    def count(*args):
+        counts.append(1)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield counts
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+
+def add_orders(app, count: int, models_per_order: int = 3) -> None:
+    with app.app_context():
+        users = [User(email=f"user{index}@example.com", password="x") for index in range(5)]
+        db.session.add_all(users)
+        for index in range(count):
+            order = Order(user=users[index % len(users)], payment_gateway_id=1, status=Order.Status.QUEUED)
+            for part in range(models_per_order):
+                file = File(full_path=f"/media/{index}-{part}.stl")
+                db.session.add(StlModel(file=file, material_id=1, order=order, name=f"part {part}.stl"))
+            db.session.add(order)
+        db.session.commit()
+
+
+def test_order_list_queries_do_not_grow_with_the_page_size(app, admin_client):
+    add_orders(app, 120)
+    # the first request loads the permission cache
+    assert admin_client.get("/admin/orders/").status_code == 200
+
+    queries = {}
+    for page_size in (10, 100):
+        with count_queries(app) as counts:
+            response = admin_client.get(f"/admin/orders/?page_size={page_size}")
+        assert response.status_code == 200
+        assert response.data.count(b"part 0.stl") == page_size
+        queries[page_size] = len(counts)
+
+    assert queries[10] == queries[100]
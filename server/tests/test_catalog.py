@@ -0,0 +1,10 @@
+from print3dstore import catalog
+
+
+def test_choices_are_plain_tuples(app):
+    with app.app_context():
+        choices = catalog.current()
+
+    assert choices.materials == ((1, "PLA"),)
+    assert choices.payment_gateways == ((1, "Cash", "cash"),)
+    assert all(type(choice) is tuple for choice in choices.materials + choices.payment_gateways)
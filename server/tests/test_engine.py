@@ -0,0 +1,40 @@
+import threading
+import time
+
+from print3dstore.slicing import engine
+
+
+def fake_slicer(tmp_path, monkeypatch, seconds: float) -> None:
+    script = tmp_path / "slicer.sh"
+    script.write_text(f"sleep {seconds}\n")
+    monkeypatch.setattr(engine, "SLICER_PATH", str(script))
+
+
+def test_timeout_is_read_from_the_app_config(app, tmp_path, monkeypatch):
+    fake_slicer(tmp_path, monkeypatch, 30)
+    app.config["SLICER_TIMEOUT_SECONDS"] = "0.2"
+
+    with app.app_context():
+        slicer_run = engine.run(["model.stl"], str(tmp_path / "model.gcode"))
+
+    assert slicer_run.timed_out
+    assert slicer_run.wall_time < 5
+
+
+def test_max_processes_is_read_from_the_app_config(app, tmp_path, monkeypatch):
+    fake_slicer(tmp_path, monkeypatch, 0.3)
+    app.config["SLICER_MAX_PROCESSES"] = "1"
+
+    def slice():
+        with app.app_context():
+            engine.run(["model.stl"], str(tmp_path / "model.gcode"))
+
+    started_at = time.monotonic()
+    threads = [threading.Thread(target=slice) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # one slot: the second run waits for the first
+    assert time.monotonic() - started_at >= 0.6
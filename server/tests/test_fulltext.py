@@ -0,0 +1,67 @@
+import re
+
+import pytest
+
+from print3dstore.admin import fulltext
+from print3dstore.models import Order, User, db
+
+
+@pytest.fixture
+def orders(app):
+    with app.app_context():
+        maria = User(email="maria.petrova@example.com", first_name="Maria", last_name="Petrova", password="x")
+        ivan = User(email="ivan@example.com", first_name="Ivan", last_name="Ivanov", password="x")
+        orders = {
+            "maria plovdiv": Order(user=maria, payment_gateway_id=1, city="Plovdiv", postal_code="4000"),
+            "maria sofia": Order(user=maria, payment_gateway_id=1, city="Sofia", postal_code="1000"),
+            "ivan plovdiv": Order(user=ivan, payment_gateway_id=1, city="Plovdiv", postal_code="4002"),
+        }
+        db.session.add_all(orders.values())
+        db.session.commit()
+        return {name: order.id for name, order in orders.items()}
+
+
+def search(table: str, term: str) -> list[int]:
+    matches = fulltext.matches(table, term)
+    assert matches is not None
+    return db.session.scalars(db.select(matches.c.id).order_by(matches.c.rank.desc(), matches.c.id)).all()
+
+
+def test_create_all_builds_the_sqlite_index(app):
+    with app.app_context():
+        assert fulltext.installed(str(db.engine.url), "order")
+        assert fulltext.installed(str(db.engine.url), "user")
+
+
+def test_order_words_match_across_the_order_and_its_user(app, orders):
+    with app.app_context():
+        assert search("order", "mar pl") == [orders["maria plovdiv"]]
+        assert search("order", "plovdiv") == sorted([orders["maria plovdiv"], orders["ivan plovdiv"]])
+        assert search("order", "petrova sofia 1000") == [orders["maria sofia"]]
+        assert search("order", "ivan sofia") == []
+
+
+def test_order_number_matches(app, orders):
+    with app.app_context():
+        assert search("order", f"#{orders['ivan plovdiv']}")[0] == orders["ivan plovdiv"]
+        assert search("order", f"{orders['maria sofia']} sofia") == [orders["maria sofia"]]
+
+
+def test_index_follows_updates(app, orders):
+    with app.app_context():
+        db.session.get(Order, orders["maria sofia"]).city = "Varna"
+        db.session.commit()
+        assert search("order", "mar varna") == [orders["maria sofia"]]
+        assert search("order", "mar sofia") == []
+
+
+def test_user_words_match_together(app, orders):
+    with app.app_context():
+        assert search("user", "maria petr") == [2]
+        assert search("user", "maria ivanov") == []
+
+
+def test_admin_order_list_searches_every_word(admin_client, orders):
+    html = admin_client.get("/admin/orders/?search=mar+pl").data.decode()
+    # the order id cells, the csrf token can hold "#<digits>" as well
+    assert re.findall(r'class="col-order_id">\s*#(\d+)', html) == [str(orders["maria plovdiv"])]
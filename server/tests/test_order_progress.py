@@ -0,0 +1,89 @@
+import re
+
+import pytest
+from kombu.exceptions import OperationalError as BrokerError
+
+from print3dstore.blueprints import tasks
+from print3dstore.models import File, Order, StlModel, db
+
+
+@pytest.fixture
+def order_id(app):
+    with app.app_context():
+        order = Order(user_id=1, payment_gateway_id=1, status=Order.Status.SLICING)
+        file = File(full_path="media/part.stl")
+        db.session.add_all([order, StlModel(order=order, file=file, material_id=1)])
+        db.session.commit()
+        return order.id
+
+
+def retry_links(client) -> list[str]:
+    html = client.get("/profile/orders").data.decode()
+    return re.findall(r'class="retry-slice"( hidden)?>', html)
+
+
+def test_given_up_order_stalls_with_a_retry_link(app, admin_client, order_id):
+    # the slice tasks ended without slicing or failing the model
+    with app.app_context():
+        assert tasks.finalize_order(order_id)["status"] == Order.Status.STALLED
+
+    assert retry_links(admin_client) == [""]
+    assert "orderProgress.js" not in admin_client.get("/profile/orders").data.decode()
+    assert admin_client.get("/orders/events").status_code == 204
+    assert admin_client.get(f"/order/{order_id}/events").status_code == 204
+
+
+def test_queued_order_never_sliced_has_a_retry_link(app, admin_client, order_id):
+    with app.app_context():
+        db.session.get(Order, order_id).status = Order.Status.QUEUED
+        db.session.commit()
+
+    assert retry_links(admin_client) == [""]
+
+
+def test_slicing_order_streams_without_a_retry_link(admin_client, order_id):
+    assert retry_links(admin_client) == [" hidden"]
+    assert "orderProgress.js" in admin_client.get("/profile/orders").data.decode()
+    assert admin_client.get("/slice/retry/1", follow_redirects=True).status_code == 200
+
+    response = admin_client.get("/orders/events", buffered=False)
+    assert response.status_code == 200
+    response.close()
+
+
+def stall(app, order_id):
+    with app.app_context():
+        db.session.get(Order, order_id).status = Order.Status.STALLED
+        db.session.commit()
+
+
+def order_status(app, order_id) -> str:
+    with app.app_context():
+        return db.session.get(Order, order_id).status
+
+
+def test_retry_unreachable_broker_keeps_the_order_stalled(app, admin_client, order_id, monkeypatch):
+    stall(app, order_id)
+
+    def unreachable(*args, **kwargs):
+        raise BrokerError("connection refused")
+
+    monkeypatch.setattr(tasks, "slice_signatures", lambda stl_models: [tasks.tasks.finalize_order.si(order_id)])
+    monkeypatch.setattr(tasks, "chord", lambda signatures: unreachable)
+    response = admin_client.get(f"/slice/retry/{order_id}", follow_redirects=True)
+
+    assert "Slicing could not be started" in response.data.decode()
+    assert order_status(app, order_id) == Order.Status.STALLED
+    assert retry_links(admin_client) == [""]
+
+
+def test_retry_failing_to_plan_does_not_commit_slicing(app, admin_client, order_id, monkeypatch):
+    stall(app, order_id)
+
+    def missing(stl_models):
+        raise FileNotFoundError("media/part.stl")
+
+    monkeypatch.setattr(tasks, "slice_signatures", missing)
+    admin_client.get(f"/slice/retry/{order_id}")
+
+    assert order_status(app, order_id) == Order.Status.STALLED
@@ -0,0 +1,37 @@
+import json
+
+from print3dstore import create_app
+from print3dstore.models import Role, User, UserRole, db
+
+
+def test_cache_is_kept_apart_by_database(app, tmp_path):
+    # user 1 is a superuser in the app fixture and a plain user here
+    other = create_app({**app.config, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'other.sqlite'}"})
+    with other.app_context():
+        db.create_all()
+        db.session.add(User(email="admin@example.com", password="x"))
+        db.session.commit()
+
+    with app.app_context():
+        assert db.session.get(User, 1).has_permission("superuser")
+    with other.app_context():
+        assert not db.session.get(User, 1).has_permission("superuser")
+
+
+def test_reused_user_id_does_not_inherit_the_cached_mask(app):
+    with app.app_context():
+        user = User(email="staff@example.com", password="x")
+        role = Role(name="staff", permissions=json.dumps({"read_orders": True}))
+        db.session.add_all([user, role, UserRole(user=user, role=role)])
+        db.session.commit()
+        user_id = user.id
+        assert user.has_permission("read_orders")
+
+        db.session.delete(user)
+        db.session.commit()
+        # SQLite gives the id of the last deleted row to the next one
+        newcomer = User(email="newcomer@example.com", password="x")
+        db.session.add(newcomer)
+        db.session.commit()
+        assert newcomer.id == user_id
+        assert not newcomer.has_permission("read_orders")
@@ -0,0 +1,30 @@
+from print3dstore.blueprints import tasks
+from print3dstore.models import File, Order, StlModel, db
+from print3dstore.slicing import scheduling
+
+
+def add_model(file: File) -> StlModel:
+    order = Order(user_id=1, payment_gateway_id=1, status=Order.Status.SLICING)
+    stl_model = StlModel(order=order, file=file, material_id=1)
+    db.session.add(stl_model)
+    db.session.flush()
+    return stl_model
+
+
+def test_stored_geometry_plans_without_the_file(app):
+    with app.app_context():
+        stl_model = add_model(File(full_path="media/gone.stl", triangle_count=100000, size_z=50, volume=1000))
+
+        assert scheduling.model_bytes(stl_model.file) == 84 + 100000 * 50
+        (signature,) = tasks.slice_signatures([stl_model])
+        assert signature.args[0]["stl_model_ids"] == [stl_model.id]
+
+
+def test_missing_file_is_left_to_the_slice_task(app):
+    with app.app_context():
+        stl_models = [add_model(File(full_path=f"media/gone{i}.stl")) for i in range(2)]
+
+        assert scheduling.triangle_count(stl_models[0].file) == 0
+        (signature,) = tasks.slice_signatures(stl_models)
+        assert signature.options["queue"] == scheduling.QUEUE_SMALL
+        assert signature.args[0]["stl_model_ids"] == [stl_model.id for stl_model in stl_models]
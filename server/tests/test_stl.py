@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from print3dstore.slicing import stl
+
+# a tetrahedron with outward normals, volume 1/6 * 10^3
+TRIANGLES = np.array([
+    [[0, 0, 0], [0, 10, 0], [10, 0, 0]],
+    [[0, 0, 0], [10, 0, 0], [0, 0, 10]],
+    [[0, 0, 0], [0, 0, 10], [0, 10, 0]],
+    [[10, 0, 0], [0, 10, 0], [0, 0, 10]],
+], dtype=np.float32)
+
+
+def write_ascii(path, triangles) -> str:
+    lines = ["solid tetrahedron"]
+    for triangle in triangles:
+        lines += ["  facet normal 0 0 0", "    outer loop"]
+        lines += [f"      vertex {x:e} {y:e} {z:e}" for x, y, z in triangle]
+        lines += ["    endloop", "  endfacet"]
+    lines.append("endsolid tetrahedron")
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_ascii_is_parsed_in_chunks(tmp_path, monkeypatch):
+    path = write_ascii(tmp_path / "model.stl", np.tile(TRIANGLES, (50, 1, 1)))
+    whole = stl.read_triangles(path)
+
+    # blocks end in the middle of vertex lines
+    monkeypatch.setattr(stl, "ASCII_CHUNK_BYTES", 37)
+    chunked = stl.read_triangles(path)
+
+    assert chunked.shape == (200, 3, 3)
+    np.testing.assert_array_equal(chunked, whole)
+    np.testing.assert_array_equal(chunked[:4], TRIANGLES)
+
+
+def test_ascii_analysis(tmp_path):
+    info = stl.analyze(write_ascii(tmp_path / "model.stl", TRIANGLES))
+
+    assert info.triangle_count == 4
+    assert info.volume == pytest.approx(1000 / 6)
+    assert info.size == (10.0, 10.0, 10.0)
+
+
+def test_ascii_invalid_coordinates(tmp_path):
+    path = tmp_path / "model.stl"
+    path.write_text("solid x\nvertex 1 2 3\nvertex 1 2 3\nvertex 1 2 3e\nendsolid x\n")
+
+    with pytest.raises(stl.StlError):
+        stl.read_triangles(str(path))
+
+
+def write_binary(path, triangles, header: bytes = b"", trailer: bytes = b"") -> str:
+    records = np.zeros(len(triangles), dtype=stl.TRIANGLE_DTYPE)
+    records["vertices"] = triangles
+    path.write_bytes(header.ljust(80, b" ") + len(triangles).to_bytes(4, "little") + records.tobytes() + trailer)
+    return str(path)
+
+
+@pytest.mark.parametrize("header, trailer", [
+    (b"binary", b""),
+    (b"binary", b"\0" * 7),
+    (b"solid exported by a CAD tool", b""),
+    (b"solid exported by a CAD tool", b"trailing metadata"),
+])
+def test_binary_header_and_trailing_bytes(tmp_path, header, trailer):
+    path = write_binary(tmp_path / "model.stl", TRIANGLES, header, trailer)
+
+    assert stl.binary_triangle_count(path) == 4
+    np.testing.assert_array_equal(stl.read_triangles(path), TRIANGLES)
+
+
+def test_ascii_is_not_binary(tmp_path):
+    assert stl.binary_triangle_count(write_ascii(tmp_path / "model.stl", TRIANGLES)) is None
@@ -0,0 +1,31 @@
+import pytest
+
+from print3dstore import storage
+
+
+@pytest.fixture
+def uploads(app, admin_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "upload_dir", lambda: str(tmp_path))
+    app.config.update(UPLOAD_MAX_OPEN="3", UPLOAD_MAX_OPEN_BYTES=str(10 * 1024 * 1024))
+
+    def create(length: int):
+        return admin_client.post("/uploads", json={"name": "model.stl", "length": length})
+
+    return create
+
+
+def test_unfinished_uploads_are_capped_by_count(uploads):
+    assert [uploads(1024).status_code for _ in range(3)] == [201, 201, 201]
+
+    response = uploads(1024)
+    assert response.status_code == 429
+    assert "3 unfinished uploads" in response.json["error"]
+
+
+def test_unfinished_uploads_are_capped_by_bytes(uploads, tmp_path):
+    assert uploads(6 * 1024 * 1024).status_code == 201
+
+    assert uploads(5 * 1024 * 1024).status_code == 413
+    assert uploads(4 * 1024 * 1024).status_code == 201
+    # nothing is allocated for the rejected upload
+    assert len(list(tmp_path.glob("*.part"))) == 2